@@ -0,0 +1,69 @@
+"""Общая обвязка бенчмарков: настройка Django и временная база данных.
+
+Бенчмарки запускаются из корня проекта как модули:
+
+    python -m benchmarks.timelines
+"""
+import contextlib
+import os
+import statistics
+import time
+
+import django
+
+
+def setup():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+    django.setup()
+
+
+@contextlib.contextmanager
+def temporary_database():
+    """Тестовая база на время бенчмарка, как у test runner."""
+    from django.db import connection
+    from django.test.utils import (setup_test_environment,
+                                   teardown_test_environment)
+
+    setup_test_environment(debug=False)
+    old_name = connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, serialize=False
+    )
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def measure(func, repeat):
+    """Время repeat вызовов func в миллисекундах."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def percentile(timings, fraction):
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def report(title, rows, columns=('queries',)):
+    """Печатает таблицу: имя, медиана, p95 и дополнительные колонки.
+
+    Строка — (имя, замеры в мс, значения колонок columns...).
+    """
+    print(title)
+    print(('{:<40} {:>10} {:>10}' + ' {:>12}' * len(columns)).format(
+        'case', 'median ms', 'p95 ms', *columns
+    ))
+    for name, timings, *values in rows:
+        print(('{:<40} {:>10.3f} {:>10.3f}' + ' {:>12}' * len(columns)).format(
+            name,
+            statistics.median(timings),
+            percentile(timings, 0.95),
+            *values
+        ))
+    print()
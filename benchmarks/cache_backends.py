@@ -0,0 +1,174 @@
+"""Сравнение бэкендов кэша: LocMemCache, FileBasedCache и MmapCache.
+
+    python -m benchmarks.cache_backends [--workers 4] [--repeat 2000]
+
+Колонка queries здесь — число промахов: в параллельном сценарии
+каждый воркер читает одни и те же страницы, и LocMemCache промахивается
+в каждом процессе, а общие бэкенды — только при первом чтении.
+
+Случай «full cache» заполняет кэш несжимаемыми страницами сверх
+FULL_ENTRIES записей и MAX_SIZE, а затем измеряет запись новых страниц:
+каждая из них требует вытеснения.
+"""
+import argparse
+import itertools
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+
+from benchmarks.base import measure, report, setup
+
+PAGE = '<div class="card">{}</div>'.format('Текст поста. ' * 3000)
+KEYS = 200
+# Несжимаемая страница и размер кэша для случая с полным кэшем.
+FULL_PAGE = os.urandom(len(PAGE.encode()))
+FULL_ENTRIES = 2000
+
+
+def backends(directory):
+    return (
+        ('locmem', {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'benchmark',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }),
+        ('filebased', {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(directory, 'files'),
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }),
+        ('mmap', {
+            'BACKEND': 'yatube.mmap_cache.MmapCache',
+            'LOCATION': os.path.join(directory, 'mmap'),
+            'OPTIONS': {
+                'MAX_SIZE': 64 * 1024 * 1024, 'MAX_ENTRIES': 10000
+            },
+        }),
+    )
+
+
+def open_cache(params):
+    from django.core.cache import _create_cache
+
+    params = dict(params)
+    return _create_cache(params.pop('BACKEND'), **params)
+
+
+def full_cache_case(params, repeat):
+    """Запись новых страниц в заполненный кэш."""
+    params = dict(params)
+    params['OPTIONS'] = dict(params['OPTIONS'], MAX_ENTRIES=FULL_ENTRIES)
+    cache = open_cache(params)
+    cache.clear()
+    keys = ('full:{}'.format(number) for number in itertools.count())
+    # Страниц больше, чем помещается и по числу, и по объёму.
+    fill = max(FULL_ENTRIES, params['OPTIONS'].get('MAX_SIZE', 0)
+               // len(FULL_PAGE)) * 3 // 2
+    for key in itertools.islice(keys, fill):
+        cache.set(key, FULL_PAGE)
+    timings = measure(lambda: cache.set(next(keys), FULL_PAGE), repeat)
+    cache.clear()
+    return timings
+
+
+def worker(params, repeat, seed, results):
+    """Воркер читает страницы и кладёт отсутствующие, как view с кэшем."""
+    import time
+
+    cache = open_cache(params)
+    rnd = random.Random(seed)
+    timings, misses = [], 0
+    for _ in range(repeat):
+        key = 'page:{}'.format(rnd.randrange(KEYS))
+        start = time.perf_counter()
+        if cache.get(key) is None:
+            misses += 1
+            cache.set(key, PAGE)
+        timings.append((time.perf_counter() - start) * 1000)
+    results.put((timings, misses))
+
+
+def run(options):
+    directory = tempfile.mkdtemp()
+    try:
+        for name, params in backends(directory):
+            cache = open_cache(params)
+            cache.clear()
+            rnd = random.Random(1)
+            small = {'versions': {'post:1': 'a' * 32}, 'count': 10}
+
+            def set_small():
+                cache.set('small:{}'.format(rnd.randrange(KEYS)), small)
+
+            def get_small():
+                cache.get('small:{}'.format(rnd.randrange(KEYS)))
+
+            def set_page():
+                cache.set('page:{}'.format(rnd.randrange(KEYS)), PAGE)
+
+            def get_page():
+                cache.get('page:{}'.format(rnd.randrange(KEYS)))
+
+            def get_many_tags():
+                cache.get_many(
+                    ['small:{}'.format(rnd.randrange(KEYS)) for _ in range(20)]
+                )
+
+            rows = []
+            for case, func in (
+                ('set small value', set_small),
+                ('get small value', get_small),
+                ('get_many 20 tag versions', get_many_tags),
+                ('set page ({} KB)'.format(len(PAGE.encode()) // 1024),
+                 set_page),
+                ('get page', get_page),
+            ):
+                rows.append((case, measure(func, options.repeat), '-'))
+            rows.append((
+                'set page, full cache',
+                full_cache_case(params, options.repeat),
+                '-'
+            ))
+
+            cache.clear()
+            context = multiprocessing.get_context('fork')
+            results = context.Queue()
+            processes = [
+                context.Process(
+                    target=worker,
+                    args=(params, options.repeat, seed, results)
+                )
+                for seed in range(options.workers)
+            ]
+            for process in processes:
+                process.start()
+            timings, misses = [], 0
+            for _ in processes:
+                worker_timings, worker_misses = results.get()
+                timings.extend(worker_timings)
+                misses += worker_misses
+            for process in processes:
+                process.join()
+            rows.append((
+                '{} workers: get or set page'.format(options.workers),
+                timings,
+                misses
+            ))
+            report('Cache backend: {}'.format(name), rows)
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=2000)
+    options = parser.parse_args()
+    setup()
+    run(options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Поиск по постам: LIKE '%...%' (icontains) против индекса FTS5.
+
+    python -m benchmarks.search [--posts 50000] [--comments 50000]
+"""
+import argparse
+import random
+
+from benchmarks.base import measure, report, setup, temporary_database
+
+WORDS = (
+    'кот собака погода город море лес книга фильм музыка кофе чай '
+    'поезд самолёт горы река парк осень зима весна лето утро вечер '
+    'работа отпуск концерт выставка рецепт пирог сад дача велосипед'
+).split()
+
+
+def text(rnd, length):
+    return ' '.join(rnd.choice(WORDS) for _ in range(length))
+
+
+def seed(posts, comments):
+    from django.contrib.auth import get_user_model
+
+    from posts import search
+    from posts.models import Comment, Post
+
+    rnd = random.Random(1)
+    author = get_user_model().objects.create(username='author')
+    Post.objects.bulk_create(
+        (
+            Post(text=text(rnd, 30), author=author)
+            for _ in range(posts)
+        ),
+        batch_size=500
+    )
+    post_ids = list(Post.objects.values_list('pk', flat=True))
+    Comment.objects.bulk_create(
+        (
+            Comment(
+                post_id=rnd.choice(post_ids),
+                author=author,
+                text=text(rnd, 10)
+            )
+            for _ in range(comments)
+        ),
+        batch_size=500
+    )
+    # Обычная строка, которой нет в словаре: редкий запрос.
+    Post.objects.create(text='уникальное слово бенчмарка', author=author)
+    search.rebuild()
+
+
+def run(options):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    from posts.models import Comment, Post
+    from posts.search import filter_matching, search_page
+
+    seed(options.posts, options.comments)
+    rnd = random.Random(2)
+
+    def like_page(word):
+        return list(
+            Post.objects.for_feed().filter(text__icontains=word)[:10]
+        )
+
+    def like_admin(word):
+        Comment.objects.filter(text__icontains=word).count()
+
+    def fts_admin(word):
+        filter_matching(Comment.objects.all(), word).count()
+
+    connection.queries_log.clear()
+    rows = []
+    for name, func in (
+        ('icontains: common word, page', lambda: like_page(
+            rnd.choice(WORDS)
+        )),
+        ('fts5: common word, ranked page', lambda: list(search_page(
+            rnd.choice(WORDS)
+        ))),
+        ('icontains: rare word, page', lambda: like_page('уникальное')),
+        ('fts5: rare word, ranked page', lambda: list(search_page(
+            'уникальное'
+        ))),
+        ('icontains: admin comment count', lambda: like_admin(
+            rnd.choice(WORDS)
+        )),
+        ('fts5: admin comment count', lambda: fts_admin(
+            rnd.choice(WORDS)
+        )),
+    ):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        rows.append((name, measure(func, options.repeat), len(queries)))
+    report(
+        'Search, {} posts, {} comments'.format(
+            options.posts, options.comments
+        ),
+        rows
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--posts', type=int, default=50000)
+    parser.add_argument('--comments', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=20)
+    options = parser.parse_args()
+    setup()
+    with temporary_database():
+        run(options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""Чтение и запись из нескольких потоков: SQLite по умолчанию и в
+продакшен-режиме (WAL, PRAGMA, постоянные соединения).
+
+    python -m benchmarks.sqlite_modes [--threads 8] [--writes 0.2]
+
+Каждый поток — последовательность «запросов»: чтение случайной
+страницы ленты или, с вероятностью --writes, публикация поста.
+Запрос обрамлён сигналами request_started/request_finished, поэтому
+соединения открываются и закрываются так же, как в настоящем
+запросе (с учётом CONN_MAX_AGE). Шаблоны не рендерятся: иначе время
+уходит на Python под GIL, а не на базу. Колонка errors — запросы,
+упавшие с «database is locked».
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from benchmarks.base import report, setup
+
+PROFILES = (
+    ('default', {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'CONN_MAX_AGE': 0,
+        'OPTIONS': {},
+    }),
+    ('production', None),
+)
+
+
+def use_database(profile, path):
+    """Переключает соединение default на файл path с профилем profile."""
+    from django.db import connections
+
+    connections['default'].close()
+    connections.databases['default'] = dict(profile, NAME=path)
+    connections.ensure_defaults('default')
+    connections.prepare_test_settings('default')
+    del connections['default']
+
+
+def fill(users):
+    from django.contrib.auth import get_user_model
+
+    from posts.models import Post
+
+    User = get_user_model()
+    authors = [
+        User.objects.create_user(username='author{}'.format(i))
+        for i in range(users)
+    ]
+    for i in range(200):
+        Post.objects.create(
+            text='Пост {}'.format(i), author=authors[i % users]
+        )
+    return authors
+
+
+def read_page(rnd):
+    from posts.models import Post
+
+    offset = rnd.randrange(20) * 10
+    list(Post.objects.for_feed()[offset:offset + 10])
+
+
+def write_post(author, rnd):
+    from django.db import transaction
+
+    from posts.models import Post
+
+    with transaction.atomic():
+        Post.objects.create(
+            text='Новый пост {}'.format(rnd.random()), author=author
+        )
+
+
+def client_thread(author, options, seed, results):
+    from django.core.signals import request_finished, request_started
+    from django.db import OperationalError, connection
+
+    rnd = random.Random(seed)
+    timings, errors = [], 0
+    for _ in range(options.requests):
+        start = time.perf_counter()
+        request_started.send(sender=None)
+        try:
+            if rnd.random() < options.writes:
+                write_post(author, rnd)
+            else:
+                read_page(rnd)
+        except OperationalError:
+            errors += 1
+        finally:
+            request_finished.send(sender=None)
+        timings.append((time.perf_counter() - start) * 1000)
+    connection.close()
+    results.append((timings, errors))
+
+
+def run(options):
+    from django.core.management import call_command
+
+    from yatube import settings_production
+
+    rows = []
+    for name, profile in PROFILES:
+        if profile is None:
+            profile = settings_production.DATABASES['default']
+        directory = tempfile.mkdtemp()
+        try:
+            use_database(profile, os.path.join(directory, 'db.sqlite3'))
+            call_command('migrate', verbosity=0)
+            authors = fill(options.threads)
+            results = []
+            threads = [
+                threading.Thread(
+                    target=client_thread,
+                    args=(author, options, seed, results)
+                )
+                for seed, author in enumerate(authors)
+            ]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            shutil.rmtree(directory)
+        timings = [timing for result, _ in results for timing in result]
+        rows.append((
+            name,
+            timings,
+            '{:.0f}'.format(len(timings) / elapsed),
+            sum(errors for _, errors in results)
+        ))
+    report(
+        '{} threads x {} requests, {:.0%} writes'.format(
+            options.threads, options.requests, options.writes
+        ),
+        rows,
+        columns=('req/s', 'errors')
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--writes', type=float, default=0.2)
+    options = parser.parse_args()
+    setup()
+    from django.conf import settings
+
+    settings.DEBUG = False
+    run(options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Сравнение ленты подписок: JOIN по Follow против материализованной ленты.
+
+    python -m benchmarks.timelines [--authors 200] [--readers 200]
+"""
+import argparse
+import random
+
+from benchmarks.base import measure, report, setup, temporary_database
+
+
+def seed(authors, readers, follows, posts):
+    from django.contrib.auth import get_user_model
+
+    from posts import timelines
+    from posts.models import Follow, Post
+
+    User = get_user_model()
+    rnd = random.Random(1)
+    User.objects.bulk_create(
+        User(username='author{}'.format(i)) for i in range(authors)
+    )
+    User.objects.bulk_create(
+        User(username='reader{}'.format(i)) for i in range(readers)
+    )
+    author_ids = list(User.objects.filter(
+        username__startswith='author'
+    ).values_list('pk', flat=True))
+    reader_list = list(User.objects.filter(username__startswith='reader'))
+    Post.objects.bulk_create(
+        Post(text='Пост {}'.format(n), author_id=author_id)
+        for author_id in author_ids for n in range(posts)
+    )
+    Follow.objects.bulk_create(
+        Follow(user=reader, author_id=author_id)
+        for reader in reader_list
+        for author_id in rnd.sample(author_ids, follows)
+    )
+    for reader in reader_list:
+        timelines.rebuild(reader)
+    return author_ids, reader_list
+
+
+def run(options):
+    from django.core.paginator import Paginator
+    from django.db import connection
+    from django.db.models.signals import post_save
+    from django.test.utils import CaptureQueriesContext
+
+    from posts.models import Post
+    from posts.signals import post_created
+    from posts.timelines import FollowFeed
+
+    author_ids, readers = seed(
+        options.authors, options.readers, options.follows, options.posts
+    )
+    rnd = random.Random(2)
+
+    def join_page():
+        reader = rnd.choice(readers)
+        posts = Post.objects.filter(author__following__user=reader)
+        list(Paginator(posts, 10).get_page(1))
+
+    def timeline_page():
+        reader = rnd.choice(readers)
+        list(Paginator(FollowFeed(reader), 10).get_page(1))
+
+    def write():
+        Post.objects.create(
+            text='Новый пост', author_id=rnd.choice(author_ids)
+        )
+
+    connection.queries_log.clear()
+    rows = []
+    for name, func in (
+        ('read: join over Follow', join_page),
+        ('read: materialized timeline', timeline_page),
+    ):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        rows.append((name, measure(func, options.repeat), len(queries)))
+
+    post_save.disconnect(post_created, sender=Post)
+    with CaptureQueriesContext(connection) as queries:
+        write()
+    rows.append((
+        'write: plain insert', measure(write, options.repeat), len(queries)
+    ))
+    post_save.connect(post_created, sender=Post)
+    with CaptureQueriesContext(connection) as queries:
+        write()
+    rows.append((
+        'write: insert with fan-out',
+        measure(write, options.repeat),
+        len(queries)
+    ))
+    report(
+        'Follow feed, {} authors x {} posts, {} readers x {} follows'.format(
+            options.authors, options.posts, options.readers, options.follows
+        ),
+        rows
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--authors', type=int, default=200)
+    parser.add_argument('--readers', type=int, default=200)
+    parser.add_argument('--follows', type=int, default=50)
+    parser.add_argument('--posts', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=200)
+    options = parser.parse_args()
+    setup()
+    with temporary_database():
+        run(options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""Пиковая память при загрузке картинки: обработчики Django против
+LimitedTemporaryFileUploadHandler и проверок PostForm.
+
+    python -m benchmarks.uploads [--repeat 5]
+
+Каждый случай — разбор multipart-запроса, проверка формы и, если файл
+принят, декодирование картинки (как при построении миниатюр). Случай
+выполняется в отдельном процессе, чтобы память, освобождённая прошлым
+случаем, не скрывала пик. Колонка python — пик памяти интерпретатора
+(tracemalloc), rss — пик памяти процесса вместе с буферами Pillow
+(только Linux).
+"""
+import argparse
+import io
+import multiprocessing
+import random
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.base import report, setup
+
+MB = 1024 * 1024
+CASES = ('photo', 'oversized', 'bomb')
+PIPELINES = {
+    'django': [
+        'django.core.files.uploadhandler.MemoryFileUploadHandler',
+        'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+    ],
+    'limited': ['posts.uploads.LimitedTemporaryFileUploadHandler'],
+}
+
+
+def image(case):
+    """Имя файла, содержимое и подпись случая."""
+    from PIL import Image
+
+    def encode(picture, image_format, **params):
+        data = io.BytesIO()
+        picture.save(data, image_format, **params)
+        return data.getvalue()
+
+    rnd = random.Random(1)
+    noise = Image.frombytes('RGB', (1200, 900), rnd.randbytes(1200 * 900 * 3))
+    photo = encode(noise, 'JPEG', quality=95)
+    if case == 'photo':
+        return 'photo.jpg', photo, 'photo {:.1f} MB'.format(len(photo) / MB)
+    if case == 'oversized':
+        content = photo + rnd.randbytes(24 * MB - len(photo))
+        return 'big.jpg', content, 'oversized 24 MB jpeg'
+    bomb = encode(Image.new('L', (12000, 12000)), 'PNG')
+    return 'bomb.png', bomb, 'bomb 12000x12000 png, {} KB'.format(
+        len(bomb) // 1024
+    )
+
+
+def proc_status(field):
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_rss_peak():
+    """Сбрасывает пик RSS процесса, возвращает текущий RSS в байтах."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        return None
+    return proc_status('VmRSS')
+
+
+def measure_case(case, pipeline, repeat):
+    """Замеры одного случая; выполняется в отдельном процессе."""
+    setup()
+    from django import forms
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.test import RequestFactory, override_settings
+    from PIL import Image
+
+    from posts.forms import PostForm
+    from posts.models import Post
+    from posts.uploads import too_large
+
+    class PlainPostForm(forms.ModelForm):
+        class Meta:
+            model = Post
+            fields = ['text', 'image']
+
+    # Без этого Pillow сам отказывается открывать самую большую бомбу.
+    Image.MAX_IMAGE_PIXELS = None
+    name, content, title = image(case)
+    timings, python_peak, rss_peak, accepted = [], 0, 0, False
+    with override_settings(FILE_UPLOAD_HANDLERS=PIPELINES[pipeline]):
+        for _ in range(repeat):
+            # Тело запроса собирается заранее: его держит в памяти
+            # веб-сервер, а не обработка загрузки.
+            request = RequestFactory().post('/new/', {
+                'text': 'Пост с картинкой',
+                'image': SimpleUploadedFile(name, content),
+            })
+            rss = reset_rss_peak()
+            tracemalloc.start()
+            start = time.perf_counter()
+            data, files = request.POST, request.FILES
+            if pipeline == 'limited':
+                form = PostForm(
+                    data, files, upload_too_large=too_large(request)
+                )
+            else:
+                form = PlainPostForm(data, files)
+            accepted = form.is_valid()
+            if accepted:
+                upload = form.cleaned_data['image']
+                upload.seek(0)
+                with Image.open(upload) as decoded:
+                    decoded.load()
+            timings.append((time.perf_counter() - start) * 1000)
+            python_peak = max(python_peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            if rss is not None:
+                rss_peak = max(rss_peak, proc_status('VmHWM') - rss)
+            for upload in request.FILES.values():
+                upload.close()
+    return title, timings, accepted, python_peak, rss_peak
+
+
+def run(options):
+    rows = []
+    context = multiprocessing.get_context('spawn')
+    for case in CASES:
+        for pipeline in PIPELINES:
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                title, timings, accepted, python_peak, rss_peak = (
+                    executor.submit(
+                        measure_case, case, pipeline, options.repeat
+                    ).result()
+                )
+            rows.append((
+                '{}: {}'.format(pipeline, title),
+                timings,
+                'accepted' if accepted else 'rejected',
+                '{:.1f} MB'.format(python_peak / MB),
+                '{:.1f} MB'.format(rss_peak / MB) if rss_peak else '-',
+            ))
+    report(
+        'Image upload, peak memory per request',
+        rows,
+        columns=('result', 'python', 'rss')
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+"""Задержки и число SQL-запросов всех маршрутов posts/urls.py.
+
+    python -m benchmarks.views [--repeat 100] [--threshold 0.25]
+    python -m benchmarks.views --repeat 300 --update-baseline
+
+Бенчмарк наполняет временную базу авторами, группами, постами,
+комментариями и подписками, затем запрашивает каждый маршрут через
+тестовый клиент от имени пользователя с подписками. Перед каждым
+запросом кэш очищается (с --warm — нет), поэтому по умолчанию
+измеряется сама работа view, а не кэш страниц.
+
+Результаты сравниваются с сохранённым в репозитории
+benchmarks/views_baseline.json: маршрут считается регрессией, если его
+медиана превысила базовую, умноженную на 1 + --threshold, больше чем на
+MIN_DELTA_MS, или число запросов выросло больше чем на
+--query-threshold. p95 сравнивается так же только с --p95-threshold: при
+нескольких десятках повторов его задаёт одна медленная итерация. Запас
+MIN_DELTA_MS нужен быстрым маршрутам: у них шум в пару миллисекунд
+больше любого относительного порога. Базовый файл снимается с
+--repeat 300, чтобы его медианы сами не были шумом. При регрессиях
+бенчмарк завершается с кодом 1.
+--output сохраняет результаты в JSON, --update-baseline записывает их
+в базовый файл.
+"""
+import argparse
+import gc
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+from benchmarks.base import percentile, report, setup, temporary_database
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'views_baseline.json')
+# Рост задержки сверх относительного порога меньше этого — шум
+# измерения, а не регрессия.
+MIN_DELTA_MS = 2.0
+
+WORDS = (
+    'утро', 'кофе', 'город', 'кот', 'книга', 'поезд', 'море', 'дождь',
+    'проект', 'работа', 'музыка', 'фильм', 'друзья', 'прогулка', 'горы',
+    'код', 'релиз', 'ошибка', 'выходные', 'осень',
+)
+
+
+def seed(options):
+    """Наполняет базу, возвращает (читателя, авторов, группы, посты)."""
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+
+    from posts.models import Comment, Follow, Group, Post
+
+    User = get_user_model()
+    rnd = random.Random(1)
+    User.objects.bulk_create(
+        User(username='user{}'.format(i)) for i in range(options.users)
+    )
+    users = list(User.objects.order_by('pk'))
+    Group.objects.bulk_create(
+        Group(
+            title='Группа {}'.format(i),
+            slug='group{}'.format(i),
+            description='Описание группы {}'.format(i)
+        )
+        for i in range(options.groups)
+    )
+    groups = list(Group.objects.order_by('pk'))
+    Post.objects.bulk_create(
+        Post(
+            text='Пост {} автора {}: {}'.format(
+                n, user.username, ' '.join(rnd.choices(WORDS, k=30))
+            ),
+            author=user,
+            group=rnd.choice(groups) if rnd.random() < 0.5 else None
+        )
+        for user in users for n in range(options.posts)
+    )
+    post_ids = list(Post.objects.values_list('pk', flat=True))
+    Comment.objects.bulk_create(
+        Comment(
+            post_id=rnd.choice(post_ids),
+            author=rnd.choice(users),
+            text=' '.join(rnd.choices(WORDS, k=10))
+        )
+        for _ in range(options.comments * len(post_ids))
+    )
+    Follow.objects.bulk_create(
+        Follow(user=user, author=author)
+        for user in users
+        for author in rnd.sample(
+            [other for other in users if other != user], options.follows
+        )
+    )
+    # bulk_create не отправляет сигналы: счётчики, поисковый индекс и
+    # ленты подписок собираются целиком.
+    for command in ('reconcile_counters', 'rebuild_search_index',
+                    'rebuild_timelines'):
+        call_command(command, stdout=io.StringIO())
+    return users[0], users, groups, post_ids
+
+
+def cases(reader, users, groups, post_ids):
+    """Маршруты: имя и функция, готовящая (метод, url, данные).
+
+    Подготовка выполняется вне замера.
+    """
+    from django.urls import reverse
+
+    from posts.models import Follow, Post
+
+    authors = [user for user in users if user != reader]
+    own_posts = list(
+        Post.objects.filter(author=reader).values_list('pk', flat=True)
+    )
+
+    def post_url(name, rnd, pk=None):
+        post = Post.objects.select_related('author').get(
+            pk=pk or rnd.choice(post_ids)
+        )
+        return reverse(name, args=[post.author.username, post.pk])
+
+    def follow(rnd):
+        author = rnd.choice(authors)
+        Follow.objects.filter(user=reader, author=author).delete()
+        return 'post', reverse('profile_follow', args=[author.username]), {}
+
+    def unfollow(rnd):
+        author = rnd.choice(authors)
+        Follow.objects.get_or_create(user=reader, author=author)
+        return 'post', reverse('profile_unfollow', args=[author.username]), {}
+
+    return (
+        ('index', lambda rnd: ('get', reverse('index'), {})),
+        ('index page 5', lambda rnd: ('get', reverse('index'), {'page': 5})),
+        ('follow_index', lambda rnd: ('get', reverse('follow_index'), {})),
+        ('profile_follow', follow),
+        ('profile_unfollow', unfollow),
+        ('group_posts', lambda rnd: (
+            'get', reverse('group_posts', args=[rnd.choice(groups).slug]), {}
+        )),
+        ('new_post GET', lambda rnd: ('get', reverse('new_post'), {})),
+        ('new_post POST', lambda rnd: (
+            'post', reverse('new_post'),
+            {'text': ' '.join(rnd.choices(WORDS, k=20))}
+        )),
+        ('search', lambda rnd: (
+            'get', reverse('search'), {'q': rnd.choice(WORDS)}
+        )),
+        ('profile', lambda rnd: (
+            'get', reverse('profile', args=[rnd.choice(users).username]), {}
+        )),
+        ('post', lambda rnd: ('get', post_url('post', rnd), {})),
+        ('post_comments', lambda rnd: (
+            'get', post_url('post_comments', rnd), {'format': 'json'}
+        )),
+        ('post_edit GET', lambda rnd: (
+            'get', post_url('post_edit', rnd, rnd.choice(own_posts)), {}
+        )),
+        ('post_edit POST', lambda rnd: (
+            'post', post_url('post_edit', rnd, rnd.choice(own_posts)),
+            {'text': ' '.join(rnd.choices(WORDS, k=20))}
+        )),
+        ('add_comment', lambda rnd: (
+            'post', post_url('add_comment', rnd),
+            {'text': ' '.join(rnd.choices(WORDS, k=10))}
+        )),
+    )
+
+
+def measure_case(client, prepare, options):
+    """Замеры в мс и число запросов одного (первого после прогрева)."""
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    rnd = random.Random(2)
+    timings, queries = [], None
+    for attempt in range(options.warmup + options.repeat):
+        method, url, data = prepare(rnd)
+        if not options.warm:
+            cache.clear()
+        # Паузы сборщика мусора от предыдущих запросов не должны попадать
+        # в замер, а журнал запросов — упираться в свой предел.
+        gc.collect()
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = getattr(client, method)(url, data)
+            elapsed = (time.perf_counter() - start) * 1000
+        if response.status_code not in (200, 302):
+            raise RuntimeError('{} {} ответил {}'.format(
+                method.upper(), url, response.status_code
+            ))
+        if attempt < options.warmup:
+            continue
+        if queries is None:
+            queries = len(captured)
+        timings.append(elapsed)
+    return timings, queries
+
+
+def run(options):
+    from django.test import Client
+
+    reader, users, groups, post_ids = seed(options)
+    client = Client()
+    client.force_login(reader)
+    results = {}
+    for name, prepare in cases(reader, users, groups, post_ids):
+        timings, queries = measure_case(client, prepare, options)
+        results[name] = (timings, queries)
+    return results
+
+
+def summary(results, options):
+    """Результаты в виде JSON: параметры данных и метрики маршрутов."""
+    return {
+        'dataset': {
+            key: getattr(options, key)
+            for key in ('users', 'groups', 'posts', 'comments', 'follows')
+        },
+        'warm': options.warm,
+        'routes': {
+            name: {
+                'median_ms': round(statistics.median(timings), 3),
+                'p95_ms': round(percentile(timings, 0.95), 3),
+                'p99_ms': round(percentile(timings, 0.99), 3),
+                'queries': queries,
+            }
+            for name, (timings, queries) in results.items()
+        },
+    }
+
+
+def regressions(current, baseline, thresholds, query_threshold):
+    """Описания регрессий current относительно baseline.
+
+    thresholds — допустимый относительный рост по метрикам задержки
+    (сверх него ещё MIN_DELTA_MS).
+    """
+    found = []
+    for name, old in baseline['routes'].items():
+        new = current['routes'].get(name)
+        if new is None:
+            found.append('{}: маршрута нет в результатах'.format(name))
+            continue
+        for key, threshold in thresholds.items():
+            if new[key] > old[key] * (1 + threshold) + MIN_DELTA_MS:
+                found.append('{}: {} {:.3f} -> {:.3f}'.format(
+                    name, key, old[key], new[key]
+                ))
+        if new['queries'] > old['queries'] + query_threshold:
+            found.append('{}: queries {} -> {}'.format(
+                name, old['queries'], new['queries']
+            ))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--groups', type=int, default=10)
+    parser.add_argument('--posts', type=int, default=20,
+                        help='Постов на пользователя.')
+    parser.add_argument('--comments', type=int, default=3,
+                        help='Комментариев на пост в среднем.')
+    parser.add_argument('--follows', type=int, default=20,
+                        help='Подписок на пользователя.')
+    parser.add_argument('--repeat', type=int, default=100)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--warm', action='store_true',
+                        help='Не очищать кэш перед запросами.')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--threshold', type=float, default=0.25)
+    parser.add_argument('--p95-threshold', type=float)
+    parser.add_argument('--query-threshold', type=int, default=0)
+    parser.add_argument('--output')
+    parser.add_argument('--update-baseline', action='store_true')
+    options = parser.parse_args()
+    setup()
+    from django.conf import settings
+
+    settings.DEBUG = False
+    with temporary_database():
+        results = run(options)
+    current = summary(results, options)
+
+    baseline = None
+    if os.path.exists(options.baseline):
+        with open(options.baseline) as source:
+            baseline = json.load(source)
+    report(
+        'Views, {users} users x {posts} posts, {groups} groups, '
+        '{comments} comments/post, {follows} follows/user'.format(
+            **current['dataset']
+        ),
+        [
+            (
+                name,
+                timings,
+                queries,
+                baseline['routes'].get(name, {}).get('median_ms', '-')
+                if baseline else '-'
+            )
+            for name, (timings, queries) in results.items()
+        ],
+        columns=('queries', 'base median')
+    )
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(current, output, indent=2, ensure_ascii=False)
+    if options.update_baseline:
+        with open(options.baseline, 'w') as output:
+            json.dump(current, output, indent=2, ensure_ascii=False)
+            output.write('\n')
+        print('Базовые результаты записаны в {}'.format(options.baseline))
+        return
+    if baseline is None:
+        print('Нет базовых результатов {}'.format(options.baseline))
+        return
+    if (baseline['dataset'] != current['dataset']
+            or baseline['warm'] != current['warm']):
+        print('Внимание: базовые результаты сняты на других данных')
+    thresholds = {'median_ms': options.threshold}
+    if options.p95_threshold is not None:
+        thresholds['p95_ms'] = options.p95_threshold
+    found = regressions(
+        current, baseline, thresholds, options.query_threshold
+    )
+    if found:
+        print('Регрессии (пороги: {}):'.format(', '.join(
+            '{} {:.0%}'.format(key, threshold)
+            for key, threshold in thresholds.items()
+        )))
+        for line in found:
+            print('  ' + line)
+        sys.exit(1)
+    print('Регрессий нет')
+
+
+if __name__ == '__main__':
+    main()
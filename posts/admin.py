@@ -1,9 +1,85 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.core.exceptions import ValidationError
+from django.template.response import TemplateResponse
 
+from . import bulk, search
 from .models import Comment, Group, Post
+from .paginators import ApproximatePaginator
 
 
-class PostAdmin(admin.ModelAdmin):
+class FullTextSearchMixin:
+    """Поиск в списке объектов через полнотекстовый индекс.
+
+    search_fields остаётся, чтобы админка показывала строку поиска,
+    но вместо LIKE '%...%' по ним ищется индекс из posts.search.
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search.available() or not search.match_query(search_term):
+            return super().get_search_results(
+                request, queryset, search_term
+            )
+        return search.filter_matching(queryset, search_term), False
+
+
+class LargeTableMixin:
+    """Список объектов большой таблицы без N+1 и полных проходов.
+
+    Связанные объекты колонок читаются одним JOIN, число записей
+    оценивается ApproximatePaginator вместо COUNT(*), а стандартное
+    удаление, которое загружает всю выборку и строит дерево связанных
+    объектов для подтверждения, заменено удалением порциями из posts.bulk.
+    """
+
+    paginator = ApproximatePaginator
+    show_full_result_count = False
+    bulk_delete = None
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def delete_in_chunks(self, request, queryset):
+        """Удаление порциями с подтверждением по числу объектов."""
+        if request.POST.get('post'):
+            deleted = self.bulk_delete(queryset)
+            self.message_user(
+                request,
+                'Удалено объектов: {}.'.format(deleted),
+                messages.SUCCESS
+            )
+            return None
+        opts = self.model._meta
+        context = dict(
+            self.admin_site.each_context(request),
+            title='Вы уверены?',
+            opts=opts,
+            count=queryset.count(),
+            selected=request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+            select_across=request.POST.get('select_across'),
+            action_checkbox_name=helpers.ACTION_CHECKBOX_NAME,
+        )
+        return TemplateResponse(
+            request, 'admin/posts/bulk_delete_confirmation.html', context
+        )
+
+    delete_in_chunks.short_description = 'Удалить выбранные (порциями)'
+    delete_in_chunks.allowed_permissions = ('delete',)
+
+
+class MoveToGroupForm(helpers.ActionForm):
+    group = forms.ModelChoiceField(
+        Group.objects.order_by('title'),
+        required=False,
+        empty_label='без группы',
+        label='Группа'
+    )
+
+
+class PostAdmin(LargeTableMixin, FullTextSearchMixin, admin.ModelAdmin):
     list_display = (
         'pk',
         'text',
@@ -12,9 +88,33 @@ class PostAdmin(admin.ModelAdmin):
         'group',
         'image',
     )
+    list_select_related = ('author', 'group')
     search_fields = ('text',)
     list_filter = ('pub_date',)
+    date_hierarchy = 'pub_date'
     empty_value_display = '-пусто-'
+    action_form = MoveToGroupForm
+    actions = ('move_to_group', 'delete_in_chunks')
+    bulk_delete = staticmethod(bulk.delete_posts)
+
+    def move_to_group(self, request, queryset):
+        # Поле action формы действий проверяет сама админка.
+        try:
+            group = MoveToGroupForm.base_fields['group'].clean(
+                request.POST.get('group')
+            )
+        except ValidationError:
+            self.message_user(request, 'Нет такой группы.', messages.ERROR)
+            return
+        moved = bulk.move_to_group(queryset, group)
+        self.message_user(
+            request,
+            'Перенесено постов: {}.'.format(moved),
+            messages.SUCCESS
+        )
+
+    move_to_group.short_description = 'Перенести в группу'
+    move_to_group.allowed_permissions = ('change',)
 
 
 class GroupAdmin(admin.ModelAdmin):
@@ -28,7 +128,7 @@ class GroupAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(LargeTableMixin, FullTextSearchMixin, admin.ModelAdmin):
     list_display = (
         'pk',
         'post',
@@ -36,8 +136,11 @@ class CommentAdmin(admin.ModelAdmin):
         'author',
         'created',
     )
+    list_select_related = ('post', 'author')
     search_fields = ('text',)
     empty_value_display = '-пусто-'
+    actions = ('delete_in_chunks',)
+    bulk_delete = staticmethod(bulk.delete_comments)
 
 
 admin.site.register(Post, PostAdmin)
@@ -0,0 +1,88 @@
+"""Массовые изменения постов и комментариев порциями.
+
+Каждая порция — запросы по списку id в своей транзакции, поэтому
+выборка любого размера не держит долгих блокировок и не загружается в
+память целиком. Удаление идёт через QuerySet.delete(): счётчики,
+полнотекстовый индекс, ленты и теги кэша обновляют сигналы моделей.
+Перенос в группу — UPDATE без сигналов, теги кэша для него
+сбрасываются здесь.
+"""
+from django.db import transaction
+
+from .cache import invalidate
+from .models import Comment, Post
+
+CHUNK_SIZE = 500
+
+
+def chunks(queryset, fields, size=CHUNK_SIZE):
+    """Порции строк выборки (pk, *fields) по возрастанию pk.
+
+    Каждая следующая порция выбирается после последнего pk предыдущей,
+    поэтому изменения и удаления строк не сдвигают выборку.
+    """
+    queryset = queryset.order_by('pk').values_list('pk', *fields)
+    last = None
+    while True:
+        chunk = queryset if last is None else queryset.filter(pk__gt=last)
+        rows = list(chunk[:size])
+        if not rows:
+            return
+        yield rows
+        last = rows[-1][0]
+
+
+def post_tags(rows):
+    """Теги кэша для строк (pk, author_id, group_id)."""
+    tags = {'posts'}
+    for pk, author_id, group_id in rows:
+        tags.add('post:{}'.format(pk))
+        tags.add('author:{}'.format(author_id))
+        if group_id:
+            tags.add('group:{}'.format(group_id))
+    return tags
+
+
+def move_to_group(queryset, group):
+    """Переносит посты выборки в группу (или убирает из групп при None).
+
+    Возвращает число перенесённых постов.
+    """
+    group_id = group.pk if group is not None else None
+    moved = 0
+    for rows in chunks(queryset, ('author_id', 'group_id')):
+        ids = [pk for pk, _, _ in rows]
+        with transaction.atomic():
+            moved += Post.objects.filter(pk__in=ids).update(group=group_id)
+        tags = post_tags(rows)
+        if group_id:
+            tags.add('group:{}'.format(group_id))
+        invalidate(*tags)
+    return moved
+
+
+def delete_posts(queryset):
+    """Удаляет посты выборки вместе с комментариями и записями лент.
+
+    Возвращает число удалённых постов.
+    """
+    deleted = 0
+    for rows in chunks(queryset, ()):
+        with transaction.atomic():
+            _, per_model = Post.objects.filter(
+                pk__in=[pk for pk, in rows]
+            ).delete()
+        deleted += per_model.get(Post._meta.label, 0)
+    return deleted
+
+
+def delete_comments(queryset):
+    """Удаляет комментарии выборки. Возвращает число удалённых."""
+    deleted = 0
+    for rows in chunks(queryset, ()):
+        with transaction.atomic():
+            _, per_model = Comment.objects.filter(
+                pk__in=[pk for pk, in rows]
+            ).delete()
+        deleted += per_model.get(Comment._meta.label, 0)
+    return deleted
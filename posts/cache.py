@@ -0,0 +1,333 @@
+"""Кэш страниц с инвалидацией по тегам.
+
+Закэшированный ответ помечается тегами того, от чего он зависит:
+'posts' (общая лента), 'post:<id>', 'author:<id>', 'group:<id>',
+'user:<id>' (имя пользователя в карточках его постов).
+У каждого тега в кэше хранится версия. Ответ действителен, пока версии
+его тегов не изменились, а сигналы моделей меняют версии ровно тех
+тегов, которых коснулось изменение. Поэтому страницы можно хранить
+долго и при этом сразу показывать новые посты.
+
+Те же версии служат валидаторами условных GET-запросов: версия тега
+меняется при каждом новом, изменённом или удалённом посте, комментарии
+и подписке, а начинается со времени изменения. Из них получаются ETag
+и Last-Modified, и на If-None-Match/If-Modified-Since ответ 304
+отдаётся без обращения к базе и рендеринга шаблонов.
+"""
+import hashlib
+import time
+import uuid
+from collections import Counter
+from functools import partial, wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from . import replicas
+
+TAG_KEY = 'cache-tag:{}'
+LOCK_KEY = 'view-cache-lock:{}'
+# Лежит под общим ключом страницы, если её ответ содержит CSRF-токен:
+# сам ответ тогда хранится отдельно для каждой CSRF-cookie.
+CSRF_BOUND = 'csrf-bound'
+
+# Исходы запросов к закэшированным view в этом процессе.
+METRICS = Counter()
+
+
+def new_version():
+    """Новая версия тега: время создания в мс (hex) и случайная часть."""
+    return '{:011x}{}'.format(int(time.time() * 1000), uuid.uuid4().hex)
+
+
+def version_time(version):
+    """Время создания версии в секундах или None для чужого формата."""
+    try:
+        return int(version[:11], 16) / 1000
+    except ValueError:
+        return None
+
+
+def settled(versions):
+    """Прошло ли с изменения тегов больше, чем может отставать реплика.
+
+    Ответ, прочитанный с реплики раньше, мог не увидеть изменения, и
+    кэшировать его под новыми версиями тегов нельзя.
+    """
+    oldest = time.time() - settings.REPLICA_PIN_TIMEOUT
+    for version in versions:
+        created = version_time(version)
+        if created is not None and created > oldest:
+            return False
+    return True
+
+
+def tag_versions(tags):
+    """Текущие версии тегов одним обращением к кэшу."""
+    keys = {TAG_KEY.format(tag): tag for tag in tags}
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        for key in missing:
+            cache.add(key, new_version(), None)
+        found.update(cache.get_many(missing))
+    return {keys[key]: version for key, version in found.items()}
+
+
+def _bump(tags):
+    cache.set_many(
+        {TAG_KEY.format(tag): new_version() for tag in tags}, None
+    )
+
+
+def invalidate(*tags):
+    """Сбрасывает все ответы, помеченные хотя бы одним из тегов.
+
+    Внутри транзакции версии меняются ещё раз после коммита: читатель,
+    пришедший до коммита, видит в базе старые данные, и сохранённый им
+    под новыми версиями ответ иначе жил бы до конца VIEW_CACHE_TIMEOUT.
+    """
+    tags = list(tags)
+    _bump(tags)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(partial(_bump, tags))
+
+
+def tag(request, *tags):
+    """Помечает ответ текущего запроса тегами.
+
+    Версии запоминаются в момент вызова: если данные изменятся, пока
+    страница рендерится, сохранённый ответ сразу окажется устаревшим.
+    """
+    if not hasattr(request, 'cache_tags'):
+        request.cache_tags = {}
+    new = [tag for tag in tags if tag not in request.cache_tags]
+    if new:
+        request.cache_tags.update(tag_versions(new))
+
+
+def post_tags(posts):
+    """Теги, от которых зависят карточки постов."""
+    tags = set()
+    for post in posts:
+        tags.add('post:{}'.format(post.pk))
+        tags.add('user:{}'.format(post.author_id))
+        if post.group_id:
+            tags.add('group:{}'.format(post.group_id))
+    return tags
+
+
+def stamp_cards(posts, versions=None):
+    """Проставляет постам card_version — версию карточки для кэша шаблона.
+
+    Версия складывается из версий тегов поста, его группы и автора,
+    поэтому карточка перерисовывается, только когда меняется её
+    содержимое. Тег автора — 'user:<id>', а не 'author:<id>': его не
+    меняют ни новые посты, ни подписки.
+    Уже известные версии (например, request.cache_tags) можно передать
+    в versions, остальные берутся из кэша одним запросом.
+    """
+    posts = list(posts)
+    versions = dict(versions or {})
+    missing = post_tags(posts) - set(versions)
+    if missing:
+        versions.update(tag_versions(missing))
+    for post in posts:
+        card = [
+            versions['post:{}'.format(post.pk)],
+            versions.get('group:{}'.format(post.group_id), ''),
+            versions['user:{}'.format(post.author_id)]
+        ]
+        if replicas.used_replica() and not settled(card):
+            # Карточка с реплики могла отстать от версии: одноразовый ключ.
+            card.append(new_version())
+        post.card_version = '.'.join(card)
+
+
+def cache_key(request, key_prefix, csrf=False):
+    """Ключ ответа: адрес страницы, пользователь и, с csrf, CSRF-cookie.
+
+    Страница зависит от пользователя (меню, подписка, форма комментария),
+    а токен в форме действителен только для своей CSRF-cookie. Страницы
+    без токена общие для всех посетителей с одним пользователем, какие
+    бы CSRF-cookie у них ни были.
+    """
+    user = request.user.pk if request.user.is_authenticated else 0
+    parts = [request.get_full_path()]
+    if csrf:
+        parts.append(request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''))
+    digest = hashlib.md5('|'.join(parts).encode()).hexdigest()
+    return 'view-cache:{}:{}:{}'.format(key_prefix, user, digest)
+
+
+def _lookup(request, key_prefix):
+    """Ключ и запись кэша для запроса (None, если записи нет)."""
+    key = cache_key(request, key_prefix)
+    entry = cache.get(key)
+    if entry == CSRF_BOUND:
+        key = cache_key(request, key_prefix, csrf=True)
+        entry = cache.get(key)
+    return key, entry
+
+
+def validators(key, versions):
+    """ETag и Last-Modified ответа с ключом key и версиями тегов versions.
+
+    ETag меняется вместе с версией любого тега и с ключом ответа, то есть
+    различается у пользователей и CSRF-cookie. Last-Modified — время
+    последнего изменения тегов; в HTTP оно с точностью до секунды,
+    поэтому точным валидатором остаётся ETag.
+    """
+    digest = hashlib.md5('|'.join(
+        [key] + [versions[tag] for tag in sorted(versions)]
+    ).encode()).hexdigest()
+    times = [version_time(version) for version in versions.values()]
+    times = [created for created in times if created is not None]
+    return quote_etag(digest), int(max(times)) if times else None
+
+
+def _set_validators(request, response, etag, last_modified, csrf_used):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # Клиент хранит страницу, но перед показом сверяет валидаторы; чужую
+    # страницу общий кэш прокси отдавать не должен.
+    patch_cache_control(response, no_cache=True)
+    if request.user.is_authenticated or csrf_used:
+        patch_cache_control(response, private=True)
+
+
+def _not_modified(request, key, entry):
+    """Ответ 304, если у клиента та же версия, что в кэше, иначе None."""
+    etag, last_modified = validators(key, entry[0])
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified, response=entry[3]
+    )
+    return response if response.status_code == 304 else None
+
+
+def _serve(request, entry, state):
+    _, csrf_used, _, response = entry
+    if csrf_used:
+        get_token(request)
+    METRICS[state] += 1
+    response['X-Cache'] = state
+    return response
+
+
+def _is_valid(entry):
+    return entry is not None and tag_versions(entry[0]) == entry[0]
+
+
+def _wait(request, key_prefix, lock):
+    """Ждёт, пока ответ построит воркер, держащий блокировку.
+
+    Возвращает свежий ответ или None, если ждать дольше нельзя или
+    блокировку отпустили, не закэшировав ответ (например, 404).
+    """
+    deadline = time.monotonic() + settings.VIEW_CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(settings.VIEW_CACHE_LOCK_POLL)
+        _, entry = _lookup(request, key_prefix)
+        if _is_valid(entry):
+            return entry
+        if cache.get(lock) is None:
+            return None
+    return None
+
+
+def cache_tagged(key_prefix, timeout=None):
+    """Кэширует ответы GET-запросов view до инвалидации их тегов.
+
+    Кэшируются только ответы со статусом 200, которые view пометил
+    через tag(). Ответ перестраивает только воркер, взявший блокировку
+    в кэше, остальные тем временем:
+
+    * отдают устаревший по сроку ответ (stale-while-revalidate) ещё
+      settings.VIEW_CACHE_STALE_TIMEOUT секунд;
+    * ждут новый ответ, если старый сброшен по тегам: устаревшие
+      данные после инвалидации не показываются.
+
+    Ответ, прочитанный с реплики вскоре после изменения его тегов, не
+    кэшируется: реплика могла ещё не получить изменение.
+
+    Кэшируемые ответы получают ETag и Last-Modified из версий тегов.
+    Если ответ в кэше действителен и клиент прислал его валидаторы,
+    отдаётся 304 без вызова view; после промаха 304 получается из только
+    что построенного ответа.
+
+    Заголовок X-Cache и счётчики METRICS показывают, чем закончился
+    запрос: not-modified, hit, stale, coalesced, miss или
+    not-modified-rendered (304, но страница построена заново).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            key, entry = _lookup(request, key_prefix)
+            valid = _is_valid(entry)
+            if valid:
+                not_modified = _not_modified(request, key, entry)
+                if not_modified is not None:
+                    return _serve(
+                        request, entry[:3] + (not_modified,), 'not-modified'
+                    )
+            if valid and time.time() < entry[2]:
+                return _serve(request, entry, 'hit')
+            # Блокировка общая для страницы: до ответа неизвестно, будет
+            # ли в нём CSRF-токен.
+            page_key = cache_key(request, key_prefix)
+            lock = LOCK_KEY.format(page_key)
+            locked = cache.add(lock, 1, settings.VIEW_CACHE_LOCK_TIMEOUT)
+            if not locked:
+                if valid:
+                    return _serve(request, entry, 'stale')
+                entry = _wait(request, key_prefix, lock)
+                if entry is not None:
+                    return _serve(request, entry, 'coalesced')
+            try:
+                response = view(request, *args, **kwargs)
+                versions = getattr(request, 'cache_tags', None)
+                csrf_used = bool(request.META.get('CSRF_COOKIE_USED'))
+                # Токен, выданный под новую CSRF-cookie, не подойдёт
+                # следующему посетителю без cookie: такой ответ не хранится.
+                if (versions and response.status_code == 200
+                        and not response.streaming
+                        and (not csrf_used or settings.CSRF_COOKIE_NAME
+                             in request.COOKIES)
+                        and (not replicas.used_replica()
+                             or settled(versions.values()))):
+                    fresh = timeout or settings.VIEW_CACHE_TIMEOUT
+                    stored = fresh + settings.VIEW_CACHE_STALE_TIMEOUT
+                    key = cache_key(request, key_prefix, csrf_used)
+                    if csrf_used:
+                        cache.set(page_key, CSRF_BOUND, stored)
+                    etag, last_modified = validators(key, versions)
+                    _set_validators(
+                        request, response, etag, last_modified, csrf_used
+                    )
+                    cache.set(
+                        key,
+                        (versions, csrf_used, time.time() + fresh, response),
+                        stored
+                    )
+                    response = get_conditional_response(
+                        request, etag=etag, last_modified=last_modified,
+                        response=response
+                    )
+            finally:
+                if locked:
+                    cache.delete(lock)
+            state = 'miss'
+            if response.status_code == 304:
+                state = 'not-modified-rendered'
+            METRICS[state] += 1
+            response['X-Cache'] = state
+            return response
+        return wrapper
+    return decorator
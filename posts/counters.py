@@ -0,0 +1,88 @@
+"""Денормализованные счётчики подписок, постов и комментариев.
+
+Счётчики меняются выражениями F() одним UPDATE, поэтому параллельные
+запросы не теряют изменений. Если счётчики всё же разошлись с данными,
+их исправляет reconcile() (команда reconcile_counters).
+"""
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from users.models import Profile
+
+from .models import Comment, Follow, Post, User
+
+
+def change(queryset, field, delta):
+    """Сдвигает счётчик на delta, не опуская его ниже нуля.
+
+    Счётчик может отставать от данных (например, после bulk_create),
+    и вычитание из нуля нарушило бы ограничение поля.
+    """
+    if delta < 0:
+        queryset = queryset.filter(**{field + '__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def change_follow(user_id, author_id, delta):
+    change(
+        Profile.objects.filter(user_id=author_id), 'followers_count', delta
+    )
+    change(
+        Profile.objects.filter(user_id=user_id), 'following_count', delta
+    )
+
+
+def change_posts(author_id, delta):
+    change(Profile.objects.filter(user_id=author_id), 'posts_count', delta)
+
+
+def change_comments(post_id, delta):
+    change(Post.objects.filter(pk=post_id), 'comment_count', delta)
+
+
+def count_of(model, field, outer='pk'):
+    rows = model.objects.filter(
+        **{field: OuterRef(outer)}
+    ).order_by().values(field).annotate(count=Count('pk')).values('count')
+    return Coalesce(Subquery(rows), 0)
+
+
+def reconcile():
+    """Пересчитывает разошедшиеся счётчики. Возвращает число исправлений."""
+    Profile.objects.bulk_create(
+        Profile(user_id=pk)
+        for pk in User.objects.filter(
+            profile__isnull=True
+        ).values_list('pk', flat=True)
+    )
+    fixed = 0
+    profiles = Profile.objects.annotate(
+        actual_followers=count_of(Follow, 'author', 'user'),
+        actual_following=count_of(Follow, 'user', 'user'),
+        actual_posts=count_of(Post, 'author', 'user'),
+    )
+    for profile in profiles.iterator():
+        actual = (
+            profile.actual_followers,
+            profile.actual_following,
+            profile.actual_posts,
+        )
+        stored = (
+            profile.followers_count,
+            profile.following_count,
+            profile.posts_count,
+        )
+        if actual != stored:
+            Profile.objects.filter(pk=profile.pk).update(
+                followers_count=profile.actual_followers,
+                following_count=profile.actual_following,
+                posts_count=profile.actual_posts,
+            )
+            fixed += 1
+    posts = Post.objects.annotate(
+        actual_comments=count_of(Comment, 'post')
+    ).exclude(comment_count=F('actual_comments'))
+    for pk, actual in posts.values_list('pk', 'actual_comments').iterator():
+        Post.objects.filter(pk=pk).update(comment_count=actual)
+        fixed += 1
+    return fixed
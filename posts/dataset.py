@@ -0,0 +1,323 @@
+"""Синтетические данные для бенчмарков и нагрузочных тестов.
+
+generate() заполняет базу пользователями, группами, постами,
+комментариями и подписками с перекосом, как у настоящей ленты:
+несколько авторов-«звёзд» пишут большую часть постов и собирают
+большую часть подписчиков (распределение Ципфа), популярны немногие
+группы, а у большинства постов почти нет комментариев, зато у
+некоторых — длинные обсуждения, написанные вскоре после поста
+(распределение Парето).
+
+Строки вставляются через bulk_create порциями, каждая порция — в своей
+транзакции, без сигналов. Всё, что обычно делают сигналы, считается
+сразу: счётчики профилей и постов известны при генерации, ленты
+подписок и полнотекстовый индекс собираются одним INSERT ... SELECT.
+Теги страниц сигналы тоже не сбрасывают, поэтому в конце кэш очищается
+целиком: иначе общий кэш ещё час отдавал бы старые страницы и число
+записей в пагинаторах.
+
+Одинаковые параметры и seed дают одинаковые данные; даты отсчитываются
+от момента запуска.
+"""
+import contextlib
+import datetime as dt
+import io
+import itertools
+import random
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image, ImageDraw
+
+from users.models import Profile
+
+from . import search, thumbnails
+from .bulk import chunks
+from .models import Comment, Follow, Group, Post, TimelineEntry, User
+
+BATCH_SIZE = 5000
+
+# Показатели распределений: чем больше, тем сильнее перекос.
+AUTHOR_SKEW = 1.0
+FOLLOW_SKEW = 1.0
+GROUP_SKEW = 1.2
+THREAD_SKEW = 1.5
+MAX_THREAD = 5000
+UNGROUPED = 0.4
+IMAGE_VARIANTS = 16
+
+WORDS = (
+    'утро', 'кофе', 'город', 'кот', 'книга', 'поезд', 'море', 'дождь',
+    'проект', 'работа', 'музыка', 'фильм', 'друзья', 'прогулка', 'горы',
+    'код', 'релиз', 'ошибка', 'выходные', 'осень', 'зима', 'весна',
+    'лето', 'вечер', 'концерт', 'выставка', 'рецепт', 'пирог', 'чай',
+    'дорога', 'отпуск', 'фото', 'новости', 'спорт', 'футбол', 'бег',
+    'лес', 'река', 'снег', 'солнце',
+)
+
+
+@contextlib.contextmanager
+def explicit_dates(*fields):
+    """Отключает auto_now_add у полей, чтобы сохранить заданные даты."""
+    saved = [field.auto_now_add for field in fields]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now_add in zip(fields, saved):
+            field.auto_now_add = auto_now_add
+
+
+def zipf_weights(count, skew):
+    """Накопленные веса Ципфа для count элементов."""
+    return list(itertools.accumulate(
+        1 / (rank + 1) ** skew for rank in range(count)
+    ))
+
+
+def insert(model, objects, batch_size):
+    """Вставляет объекты порциями, каждую в своей транзакции."""
+    total = 0
+    objects = iter(objects)
+    while True:
+        batch = list(itertools.islice(objects, batch_size))
+        if not batch:
+            return total
+        with transaction.atomic():
+            model.objects.bulk_create(batch)
+        total += len(batch)
+
+
+def text(rnd, low, high):
+    return ' '.join(rnd.choices(WORDS, k=rnd.randint(low, high))).capitalize()
+
+
+def make_images(rnd, prefix):
+    """Несколько картинок в хранилище и их миниатюры, возвращает имена."""
+    names = []
+    for number in range(IMAGE_VARIANTS):
+        image = Image.new('RGB', (960, 540), tuple(
+            rnd.randrange(256) for _ in range(3)
+        ))
+        draw = ImageDraw.Draw(image)
+        for _ in range(8):
+            box = sorted(rnd.randrange(960) for _ in range(2))
+            rows = sorted(rnd.randrange(540) for _ in range(2))
+            draw.rectangle(
+                (box[0], rows[0], box[1], rows[1]),
+                fill=tuple(rnd.randrange(256) for _ in range(3))
+            )
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=80)
+        name = default_storage.save(
+            'posts/{}-{}.jpg'.format(prefix, number),
+            ContentFile(output.getvalue())
+        )
+        thumbnails.generate(name)
+        names.append(name)
+    return names
+
+
+def fill_timelines(user_ids, batch_size):
+    """Ленты подписок пользователей одним INSERT ... SELECT на порцию.
+
+    Как timelines.rebuild(): посты «звёзд» в ленты не раскладываются.
+    """
+    timeline = TimelineEntry._meta.db_table
+    sql = (
+        'INSERT INTO {timeline} (user_id, post_id, author_id, pub_date) '
+        'SELECT f.user_id, p.id, p.author_id, p.pub_date '
+        'FROM {follow} f '
+        'JOIN {profile} pr ON pr.user_id = f.author_id '
+        'JOIN {post} p ON p.author_id = f.author_id '
+        'WHERE pr.followers_count <= %s AND f.user_id IN ({ids})'
+    )
+    total = 0
+    for start in range(0, len(user_ids), batch_size):
+        ids = user_ids[start:start + batch_size]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                sql.format(
+                    timeline=timeline,
+                    follow=Follow._meta.db_table,
+                    profile=Profile._meta.db_table,
+                    post=Post._meta.db_table,
+                    ids=', '.join(['%s'] * len(ids))
+                ),
+                [settings.TIMELINE_CELEBRITY_FOLLOWERS, *ids]
+            )
+            total += cursor.rowcount
+    return total
+
+
+def generate(users, groups, posts, follows=20, comments=2, images=0.0,
+             days=365, seed=1, prefix='gen', batch_size=BATCH_SIZE,
+             progress=None):
+    """Генерирует данные. Возвращает [(таблица, строк, секунд)].
+
+    follows и comments — средние число подписок пользователя и
+    комментариев поста, images — доля постов с картинкой. progress,
+    если задан, вызывается с (таблица, строк, секунд) после каждого шага.
+    """
+    rnd = random.Random(seed)
+    now = timezone.now()
+    start = now - dt.timedelta(days=days)
+    results = []
+
+    def step(name, func):
+        started = time.perf_counter()
+        rows = func()
+        result = (name, rows, time.perf_counter() - started)
+        results.append(result)
+        if progress is not None:
+            progress(*result)
+
+    password = make_password(None)
+    step('users', lambda: insert(User, (
+        User(
+            username='{}{}'.format(prefix, number),
+            password=password,
+            date_joined=start
+        )
+        for number in range(users)
+    ), batch_size))
+    user_ids = list(User.objects.filter(
+        username__startswith=prefix
+    ).order_by('pk').values_list('pk', flat=True))
+    # «Звёзды» — случайные пользователи, а не первые по id. Самые
+    # плодовитые и самые популярные авторы — разные люди: иначе каждый
+    # подписчик «звезды» чуть ниже TIMELINE_CELEBRITY_FOLLOWERS получает
+    # в ленту все её посты, и ленты растут на порядки.
+    prolific = rnd.sample(user_ids, len(user_ids))
+    popular = rnd.sample(user_ids, len(user_ids))
+    author_weights = zipf_weights(len(user_ids), AUTHOR_SKEW)
+    follow_weights = zipf_weights(len(user_ids), FOLLOW_SKEW)
+
+    step('groups', lambda: insert(Group, (
+        Group(
+            title='{} {}-{}'.format(text(rnd, 1, 3), prefix, number),
+            slug='{}-group-{}'.format(prefix, number),
+            description=text(rnd, 5, 30)
+        )
+        for number in range(groups)
+    ), batch_size))
+    group_ids = list(Group.objects.filter(
+        slug__startswith='{}-group-'.format(prefix)
+    ).order_by('pk').values_list('pk', flat=True))
+    group_weights = zipf_weights(len(group_ids), GROUP_SKEW)
+
+    image_names = []
+    if images:
+        def add_images():
+            image_names.extend(make_images(rnd, prefix))
+            return len(image_names)
+        step('images', add_images)
+
+    posts_count = Counter()
+    last_post = Post.objects.order_by('-pk').values_list(
+        'pk', flat=True
+    ).first() or 0
+    span = (now - start).total_seconds()
+
+    def thread_size():
+        # Парето с хвостом: средний размер — comments, единицы постов
+        # собирают сотни комментариев.
+        size = comments * (THREAD_SKEW - 1) * (
+            rnd.paretovariate(THREAD_SKEW) - 1
+        )
+        return min(MAX_THREAD, int(size))
+
+    def make_posts():
+        for number in range(posts):
+            author_id = rnd.choices(prolific, cum_weights=author_weights)[0]
+            posts_count[author_id] += 1
+            group_id = None
+            if group_ids and rnd.random() >= UNGROUPED:
+                group_id = rnd.choices(
+                    group_ids, cum_weights=group_weights
+                )[0]
+            image = ''
+            if image_names and rnd.random() < images:
+                image = rnd.choice(image_names)
+            yield Post(
+                text=text(rnd, 5, 60),
+                author_id=author_id,
+                group_id=group_id,
+                # Посты идут по времени в порядке id, как настоящие.
+                pub_date=start + dt.timedelta(
+                    seconds=span * (number + rnd.random()) / posts
+                ),
+                image=image,
+                comment_count=thread_size()
+            )
+
+    def make_comments():
+        new_posts = Post.objects.filter(pk__gt=last_post)
+        for rows in chunks(new_posts, ('pub_date', 'comment_count'),
+                           batch_size):
+            for post_id, pub_date, count in rows:
+                for _ in range(count):
+                    # Обсуждение вспыхивает в первые часы после поста.
+                    created = min(now, pub_date + dt.timedelta(
+                        seconds=rnd.expovariate(1 / 3600)
+                    ))
+                    yield Comment(
+                        post_id=post_id,
+                        author_id=rnd.choice(user_ids),
+                        text=text(rnd, 1, 25),
+                        created=created
+                    )
+
+    followers_count = Counter()
+    following_count = Counter()
+
+    def make_follows():
+        for user_id in user_ids:
+            wanted = min(
+                len(user_ids) - 1, max(1, int(rnd.expovariate(1 / follows)))
+            )
+            authors = set()
+            # Подписки тянутся к «звёздам»: повторы отбрасываются, число
+            # попыток ограничено, чтобы не зациклиться на малых данных.
+            for _ in range(wanted * 10):
+                if len(authors) == wanted:
+                    break
+                author_id = rnd.choices(
+                    popular, cum_weights=follow_weights
+                )[0]
+                if author_id != user_id:
+                    authors.add(author_id)
+            following_count[user_id] = len(authors)
+            for author_id in sorted(authors):
+                followers_count[author_id] += 1
+                yield Follow(user_id=user_id, author_id=author_id)
+
+    fields = (
+        Post._meta.get_field('pub_date'), Comment._meta.get_field('created')
+    )
+    with explicit_dates(*fields):
+        step('posts', lambda: insert(Post, make_posts(), batch_size))
+        step('comments', lambda: insert(Comment, make_comments(), batch_size))
+    step('follows', lambda: insert(Follow, make_follows(), batch_size))
+    step('profiles', lambda: insert(Profile, (
+        Profile(
+            user_id=user_id,
+            followers_count=followers_count[user_id],
+            following_count=following_count[user_id],
+            posts_count=posts_count[user_id]
+        )
+        for user_id in user_ids
+    ), batch_size))
+    step('timeline entries', lambda: fill_timelines(user_ids, 100))
+    if search.available():
+        step('search index', search.rebuild)
+    cache.clear()
+    return results
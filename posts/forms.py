@@ -1,6 +1,9 @@
+from django.core.exceptions import ValidationError
 from django.forms import ModelForm, Textarea
 
 from posts.models import Comment, Post
+from posts.thumbnails import strip_metadata
+from posts.uploads import check_pixels, size_error
 
 
 class PostForm(ModelForm):
@@ -8,6 +11,26 @@ class PostForm(ModelForm):
         model = Post
         fields = ['group', 'text', 'image']
 
+    def __init__(self, *args, upload_too_large=False, **kwargs):
+        """upload_too_large — загрузка картинки прервана по размеру."""
+        super().__init__(*args, **kwargs)
+        self.upload_too_large = upload_too_large
+
+    def clean_image(self):
+        if self.upload_too_large:
+            raise size_error()
+        image = self.cleaned_data['image']
+        if 'image' in self.changed_data and image:
+            check_pixels(image)
+            try:
+                return strip_metadata(image)
+            except ValueError:
+                raise ValidationError(
+                    self.fields['image'].error_messages['invalid_image'],
+                    code='invalid_image'
+                )
+        return image
+
 
 class CommentForm(ModelForm):
     class Meta:
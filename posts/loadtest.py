@@ -0,0 +1,428 @@
+"""Нагрузочный тест приложения целиком (команда loadtest).
+
+yatube.wsgi.application запускается в нескольких процессах
+ThreadedWSGIServer на одном порту (SO_REUSEPORT), как воркеры
+gunicorn, поэтому видны блокировки записи SQLite, одновременные
+промахи кэша и генерация миниатюр в соседних процессах. Вместо этого
+можно нагружать уже запущенный сервер (--url).
+
+Клиенты — отдельные процессы. Каждый либо выбирает сценарии из смеси
+(чтение лент анонимом, лента подписок, посты, комментарии, подписки от
+имени своего пользователя), либо повторяет GET-запросы из access log.
+Для каждого маршрута считаются число запросов, пропускная способность,
+доля ошибок и перцентили задержки.
+"""
+import http.client
+import io
+import multiprocessing
+import random
+import re
+import signal
+import socket
+import statistics
+import sys
+import time
+import uuid
+from collections import defaultdict
+from http.cookies import SimpleCookie
+from importlib import import_module
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.contrib.auth import login
+from django.core.servers.basehttp import (ThreadedWSGIServer,
+                                          WSGIRequestHandler)
+from django.db import connections
+from django.http import HttpRequest
+from django.urls import Resolver404, resolve, reverse
+from PIL import Image
+
+from . import thumbnails
+from .models import Group, Post, User
+
+ACTIONS = ('feed', 'follow_feed', 'post', 'comment', 'follow')
+DEFAULT_MIX = 'feed=60,follow_feed=20,post=5,comment=10,follow=5'
+# Доли страниц в анонимном чтении лент.
+FEEDS = {'index': 4, 'group_posts': 2, 'profile': 2, 'post': 2}
+TARGETS = 1000
+TIMEOUT = 30
+LOG_LINE = re.compile(r'"(?:GET|HEAD) (\S+) HTTP/[\d.]+"')
+WORDS = ('утро', 'кофе', 'город', 'кот', 'книга', 'поезд', 'море', 'код')
+
+
+def parse_mix(text):
+    """Смесь сценариев из строки «feed=60,post=5»."""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ACTIONS:
+            raise ValueError('Неизвестный сценарий: {}'.format(name))
+        mix[name] = float(weight)
+    if not any(mix.values()):
+        raise ValueError('В смеси нет сценариев с ненулевым весом')
+    return mix
+
+
+def read_log(path):
+    """Пути GET- и HEAD-запросов из access log (common/combined)."""
+    with open(path) as source:
+        return [
+            match.group(1) for match in map(LOG_LINE.search, source) if match
+        ]
+
+
+def route_of(path):
+    try:
+        match = resolve(urlsplit(path).path)
+    except Resolver404:
+        return 'unmatched'
+    return match.view_name
+
+
+def session_key(user):
+    """Ключ сессии, в которой пользователь уже вошёл."""
+    request = HttpRequest()
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+    login(request, user, 'django.contrib.auth.backends.ModelBackend')
+    request.session.save()
+    return request.session.session_key
+
+
+def targets(clients, seed):
+    """Пользователи клиентов с сессиями и адреса, которые они читают."""
+    rnd = random.Random(seed)
+    ids = list(User.objects.filter(
+        is_active=True, is_superuser=False
+    ).order_by('pk').values_list('pk', flat=True))
+    users = User.objects.filter(pk__in=rnd.sample(ids, min(len(ids), clients)))
+    return {
+        'sessions': [(user.username, session_key(user)) for user in users],
+        'authors': list(User.objects.filter(
+            pk__in=rnd.sample(ids, min(len(ids), TARGETS))
+        ).values_list('username', flat=True)),
+        'posts': list(Post.objects.order_by('-pk').values_list(
+            'author__username', 'pk'
+        )[:TARGETS]),
+        'groups': list(
+            Group.objects.order_by('pk').values_list('slug', flat=True)[
+                :TARGETS
+            ]
+        ),
+    }
+
+
+def make_image():
+    output = io.BytesIO()
+    Image.new('RGB', (640, 360), (200, 120, 40)).save(output, 'JPEG')
+    return output.getvalue()
+
+
+def multipart(fields, files):
+    """Тело multipart/form-data и его Content-Type."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            '--{}\r\nContent-Disposition: form-data; name="{}"\r\n\r\n'
+            '{}\r\n'.format(boundary, name, value).encode()
+        )
+    for name, (filename, content) in files.items():
+        parts.append(
+            '--{}\r\nContent-Disposition: form-data; name="{}"; '
+            'filename="{}"\r\nContent-Type: image/jpeg\r\n\r\n'.format(
+                boundary, name, filename
+            ).encode() + content + b'\r\n'
+        )
+    parts.append('--{}--\r\n'.format(boundary).encode())
+    return b''.join(parts), 'multipart/form-data; boundary=' + boundary
+
+
+class Server(ThreadedWSGIServer):
+    """Сервер разработки Django, делящий порт с соседними процессами."""
+
+    def server_bind(self):
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, ready):
+    from yatube.wsgi import application
+
+    # Как в продакшене: без панели отладки и журнала SQL-запросов.
+    settings.DEBUG = False
+    server = Server(('127.0.0.1', port), QuietHandler)
+    server.set_app(application)
+    # stop_servers() завершает процесс через SIGTERM: выходим штатно,
+    # чтобы остановить и пул генерации миниатюр.
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit())
+    ready.send(True)
+    ready.close()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        thumbnails.shutdown()
+
+
+def start_servers(processes):
+    """Запускает processes процессов сервера, возвращает порт и их.
+
+    Процессы не демоны: как воркеры gunicorn, они запускают пул
+    генерации миниатюр. Останавливает их stop_servers().
+    """
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    # Дочерние процессы не должны делить соединения с базой.
+    connections.close_all()
+    context = multiprocessing.get_context('fork')
+    started = []
+    try:
+        for _ in range(processes):
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=serve, args=(port, sender))
+            process.start()
+            started.append(process)
+            sender.close()
+            if not receiver.poll(TIMEOUT):
+                raise RuntimeError('Сервер не запустился')
+            receiver.close()
+    except BaseException:
+        stop_servers(started)
+        raise
+    return port, started
+
+
+def stop_servers(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join()
+
+
+class Client:
+    """HTTP-клиент с cookie, по соединению на запрос."""
+
+    def __init__(self, host, port, cookies=None):
+        self.host = host
+        self.port = port
+        self.cookies = dict(cookies or {})
+
+    def request(self, method, path, body=None, content_type=None):
+        headers = {}
+        if self.cookies:
+            headers['Cookie'] = '; '.join(
+                '{}={}'.format(*item) for item in self.cookies.items()
+            )
+        if body is not None:
+            headers['Content-Type'] = content_type
+            headers['X-CSRFToken'] = self.cookies.get(
+                settings.CSRF_COOKIE_NAME, ''
+            )
+        connection = http.client.HTTPConnection(
+            self.host, self.port, timeout=TIMEOUT
+        )
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+        finally:
+            connection.close()
+        for header in response.msg.get_all('Set-Cookie') or ():
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+        return response.status
+
+
+class Worker:
+    """Процесс-клиент: сценарии или строки лога до конца теста."""
+
+    def __init__(self, number, plan):
+        self.number = number
+        self.plan = plan
+        self.rnd = random.Random(plan['seed'] + number)
+        self.results = []
+        self.anonymous = Client(plan['host'], plan['port'])
+        self.user = None
+        self.username = None
+        self.followed = []
+
+    def timed(self, client, route, method, path, data=None, files=None):
+        body = content_type = None
+        if files:
+            body, content_type = multipart(data, files)
+        elif data is not None:
+            body = urlencode(data).encode()
+            content_type = 'application/x-www-form-urlencoded'
+        start = time.perf_counter()
+        try:
+            status = client.request(method, path, body, content_type)
+        except (OSError, http.client.HTTPException):
+            status = 0
+        self.results.append(
+            (route, status, (time.perf_counter() - start) * 1000)
+        )
+        return status
+
+    def text(self, words):
+        return ' '.join(self.rnd.choices(WORDS, k=words))
+
+    def feed(self):
+        plan = self.plan
+        kinds = [
+            kind for kind in FEEDS
+            if kind == 'index'
+            or plan[{'group_posts': 'groups', 'profile': 'authors',
+                     'post': 'posts'}[kind]]
+        ]
+        kind = self.rnd.choices(kinds, [FEEDS[kind] for kind in kinds])[0]
+        if kind == 'index':
+            path = reverse('index')
+            if self.rnd.random() < 0.2:
+                path += '?page={}'.format(self.rnd.randint(2, 5))
+        elif kind == 'group_posts':
+            path = reverse('group_posts', args=[self.rnd.choice(
+                plan['groups']
+            )])
+        elif kind == 'profile':
+            path = reverse('profile', args=[self.rnd.choice(plan['authors'])])
+        else:
+            path = reverse('post', args=self.rnd.choice(plan['posts']))
+        self.timed(self.anonymous, kind, 'GET', path)
+
+    def follow_feed(self):
+        self.timed(self.user, 'follow_index', 'GET', reverse('follow_index'))
+
+    def post(self):
+        files = None
+        if self.rnd.random() < self.plan['images']:
+            files = {'image': ('load.jpg', self.plan['image'])}
+        self.timed(
+            self.user, 'new_post', 'POST', reverse('new_post'),
+            {'text': self.text(20)}, files
+        )
+
+    def comment(self):
+        if not self.plan['posts']:
+            return
+        self.timed(
+            self.user, 'add_comment', 'POST',
+            reverse('add_comment', args=self.rnd.choice(self.plan['posts'])),
+            {'text': self.text(8)}
+        )
+
+    def follow(self):
+        if self.followed and self.rnd.random() < 0.5:
+            author = self.followed.pop(self.rnd.randrange(len(self.followed)))
+            self.timed(
+                self.user, 'profile_unfollow', 'GET',
+                reverse('profile_unfollow', args=[author])
+            )
+            return
+        authors = [
+            author for author in self.plan['authors']
+            if author != self.username and author not in self.followed
+        ]
+        if not authors:
+            return
+        author = self.rnd.choice(authors)
+        status = self.timed(
+            self.user, 'profile_follow', 'GET',
+            reverse('profile_follow', args=[author])
+        )
+        if status == 302:
+            self.followed.append(author)
+
+    def login(self):
+        self.username, key = self.plan['sessions'][
+            self.number % len(self.plan['sessions'])
+        ]
+        self.user = Client(
+            self.plan['host'], self.plan['port'],
+            {settings.SESSION_COOKIE_NAME: key}
+        )
+        # Страница с формой ставит cookie CSRF для POST-запросов.
+        self.user.request('GET', reverse('new_post'))
+
+    def run(self):
+        plan = self.plan
+        if plan['paths'] is not None:
+            for path in plan['paths'][self.number::plan['clients']]:
+                if time.time() >= plan['deadline']:
+                    break
+                self.timed(self.anonymous, route_of(path), 'GET', path)
+            return self.results
+        self.login()
+        names = list(plan['mix'])
+        weights = list(plan['mix'].values())
+        while time.time() < plan['deadline']:
+            getattr(self, self.rnd.choices(names, weights)[0])()
+        return self.results
+
+
+def run_worker(number, plan):
+    return Worker(number, plan).run()
+
+
+def run(clients, duration, host, port, mix=None, paths=None, images=0.0,
+        seed=1):
+    """Нагружает сервер host:port. Возвращает (замеры, секунд).
+
+    Замер — (маршрут, статус или 0 при сбое соединения, мс).
+    """
+    plan = {
+        'clients': clients,
+        'host': host,
+        'port': port,
+        'mix': mix,
+        'paths': paths,
+        'images': images,
+        'image': make_image() if images else None,
+        'seed': seed,
+    }
+    if paths is None:
+        plan.update(targets(clients, seed))
+        if not plan['sessions']:
+            raise ValueError('В базе нет пользователей')
+    connections.close_all()
+    context = multiprocessing.get_context('fork')
+    start = time.time()
+    plan['deadline'] = start + duration
+    with context.Pool(clients) as pool:
+        parts = pool.starmap(
+            run_worker, [(number, plan) for number in range(clients)]
+        )
+    return [row for part in parts for row in part], time.time() - start
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(results, seconds):
+    """Сводка по маршрутам и итог под именем «total»."""
+    routes = defaultdict(list)
+    for route, status, elapsed in results:
+        routes[route].append((status, elapsed))
+        routes['total'].append((status, elapsed))
+    summary = {}
+    for route, rows in routes.items():
+        timings = [elapsed for _, elapsed in rows]
+        errors = sum(1 for status, _ in rows if not 0 < status < 400)
+        summary[route] = {
+            'requests': len(rows),
+            'rps': round(len(rows) / seconds, 1),
+            'error_rate': round(errors / len(rows), 4),
+            'p50_ms': round(statistics.median(timings), 2),
+            'p95_ms': round(percentile(timings, 0.95), 2),
+            'p99_ms': round(percentile(timings, 0.99), 2),
+            'max_ms': round(max(timings), 2),
+        }
+    return summary
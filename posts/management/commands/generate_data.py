@@ -0,0 +1,96 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import dataset
+from posts.models import Group, User
+
+# Размер данных при --scale 1.
+SCALE = {
+    'users': 10000,
+    'groups': 500,
+    'posts': 1000000,
+}
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу воспроизводимыми синтетическими данными: '
+            'авторы-«звёзды», длинный хвост групп, всплески комментариев.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale', type=float, default=1.0,
+            help='Множитель размера: при 1 — 10 000 пользователей, '
+                 '500 групп и миллион постов.'
+        )
+        parser.add_argument('--users', type=int)
+        parser.add_argument('--groups', type=int)
+        parser.add_argument('--posts', type=int)
+        parser.add_argument(
+            '--follows', type=int, default=20,
+            help='Подписок на пользователя в среднем.'
+        )
+        parser.add_argument(
+            '--comments', type=float, default=2,
+            help='Комментариев на пост в среднем.'
+        )
+        parser.add_argument(
+            '--images', type=float, default=0,
+            help='Доля постов с картинкой.'
+        )
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='За сколько дней до запуска начинаются посты.'
+        )
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--prefix', default='gen',
+            help='Начало имён пользователей и адресов групп.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=dataset.BATCH_SIZE
+        )
+
+    def handle(self, *args, **options):
+        sizes = {
+            name: options[name] if options[name] is not None
+            else max(1, int(base * options['scale']))
+            for name, base in SCALE.items()
+        }
+        if sizes['users'] < 2:
+            raise CommandError('Нужно хотя бы два пользователя.')
+        if not 0 <= options['images'] <= 1:
+            raise CommandError('--images должен быть от 0 до 1.')
+        prefix = options['prefix']
+        if (User.objects.filter(username__startswith=prefix).exists()
+                or Group.objects.filter(
+                    slug__startswith='{}-group-'.format(prefix)
+                ).exists()):
+            raise CommandError(
+                'Данные с префиксом {} уже есть: укажите другой --prefix '
+                'или начните с пустой базы.'.format(prefix)
+            )
+
+        def progress(name, rows, seconds):
+            self.stdout.write('{:<18} {:>10} строк {:>8.1f} с {:>10.0f} '
+                              'строк/с'.format(
+                                  name, rows, seconds,
+                                  rows / seconds if seconds else 0
+                              ))
+
+        results = dataset.generate(
+            follows=options['follows'],
+            comments=options['comments'],
+            images=options['images'],
+            days=options['days'],
+            seed=options['seed'],
+            prefix=prefix,
+            batch_size=options['batch_size'],
+            progress=progress,
+            **sizes
+        )
+        rows = sum(rows for _, rows, _ in results)
+        seconds = sum(seconds for _, _, seconds in results)
+        self.stdout.write(self.style.SUCCESS(
+            'Создано строк: {} за {:.1f} с ({:.0f} строк/с)'.format(
+                rows, seconds, rows / seconds if seconds else 0
+            )
+        ))
@@ -0,0 +1,102 @@
+import json
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import loadtest
+
+
+class Command(BaseCommand):
+    help = ('Нагружает приложение из нескольких процессов смесью '
+            'сценариев или запросами из access log и выводит пропускную '
+            'способность, долю ошибок и задержки по маршрутам. Сценарии '
+            'пишут в базу: запускайте на копии данных (generate_data).')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clients', type=int, default=8,
+            help='Процессов-клиентов.'
+        )
+        parser.add_argument(
+            '--server-processes', type=int, default=2,
+            help='Процессов сервера, если не задан --url.'
+        )
+        parser.add_argument(
+            '--url',
+            help='Нагружать уже запущенный сервер, например '
+                 'http://127.0.0.1:8000.'
+        )
+        parser.add_argument(
+            '--duration', type=float, default=30,
+            help='Длительность теста в секундах.'
+        )
+        parser.add_argument(
+            '--mix', default=loadtest.DEFAULT_MIX,
+            help='Веса сценариев {}.'.format(', '.join(loadtest.ACTIONS))
+        )
+        parser.add_argument(
+            '--replay',
+            help='Повторить GET-запросы из access log вместо сценариев.'
+        )
+        parser.add_argument(
+            '--images', type=float, default=0.1,
+            help='Доля новых постов с картинкой.'
+        )
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='Сохранить сводку в JSON.')
+
+    def handle(self, *args, **options):
+        try:
+            mix = loadtest.parse_mix(options['mix'])
+        except ValueError as error:
+            raise CommandError(error)
+        paths = None
+        if options['replay']:
+            paths = loadtest.read_log(options['replay'])
+            if not paths:
+                raise CommandError('В логе нет GET-запросов.')
+        servers = []
+        if options['url']:
+            url = urlsplit(options['url'])
+            host, port = url.hostname, url.port or 80
+        else:
+            host = '127.0.0.1'
+            port, servers = loadtest.start_servers(
+                options['server_processes']
+            )
+        try:
+            results, seconds = loadtest.run(
+                options['clients'],
+                options['duration'],
+                host,
+                port,
+                mix=mix,
+                paths=paths,
+                images=options['images'],
+                seed=options['seed']
+            )
+        except ValueError as error:
+            raise CommandError(
+                '{}: заполните базу командой generate_data.'.format(error)
+            )
+        finally:
+            loadtest.stop_servers(servers)
+        if not results:
+            raise CommandError('Ни одного запроса не выполнено.')
+        summary = loadtest.summarize(results, seconds)
+        self.stdout.write(
+            '{:<20} {:>9} {:>8} {:>8} {:>9} {:>9} {:>9} {:>9}'.format(
+                'route', 'requests', 'req/s', 'errors', 'p50 ms', 'p95 ms',
+                'p99 ms', 'max ms'
+            )
+        )
+        for route in sorted(summary, key=lambda route: route == 'total'):
+            row = summary[route]
+            self.stdout.write(
+                '{:<20} {requests:>9} {rps:>8.1f} {error_rate:>8.2%} '
+                '{p50_ms:>9.2f} {p95_ms:>9.2f} {p99_ms:>9.2f} '
+                '{max_ms:>9.2f}'.format(route, **row)
+            )
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(summary, output, indent=2)
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from yatube import profiling
+
+
+class Command(BaseCommand):
+    help = ('Включает выборочное профилирование доли запросов или '
+            'выдаёт подписанное значение заголовка X-Profile.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rate', type=float,
+            help='Доля профилируемых запросов, 0 — выключить.'
+        )
+        parser.add_argument(
+            '--duration', type=int, default=600,
+            help='Сколько секунд действует --rate.'
+        )
+        parser.add_argument(
+            '--token', action='store_true',
+            help='Напечатать значение заголовка X-Profile.'
+        )
+
+    def handle(self, *args, **options):
+        rate = options['rate']
+        if rate is None and not options['token']:
+            raise CommandError('Укажите --rate или --token.')
+        if rate is not None:
+            if not 0 <= rate <= 1:
+                raise CommandError('--rate должен быть от 0 до 1.')
+            profiling.set_rate(rate, options['duration'])
+            self.stdout.write(self.style.SUCCESS(
+                'Профилируется доля запросов {} на {} с'.format(
+                    rate, options['duration']
+                ) if rate else 'Профилирование выключено'
+            ))
+        if options['token']:
+            self.stdout.write(profiling.make_token())
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает полнотекстовый индекс постов и комментариев, '
+            'например после массовых изменений мимо сигналов.')
+
+    def handle(self, *args, **options):
+        if not search.available():
+            raise CommandError('Полнотекстовый индекс есть только в SQLite.')
+        with transaction.atomic():
+            total = search.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS('Проиндексировано записей: {}'.format(total))
+        )
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from posts import timelines
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает материализованные ленты подписок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'usernames',
+            nargs='*',
+            help='Пользователи, чьи ленты нужно пересобрать. '
+                 'По умолчанию пересобираются все ленты.'
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+            missing = set(options['usernames']) - set(
+                users.values_list('username', flat=True)
+            )
+            if missing:
+                raise CommandError(
+                    'Нет таких пользователей: {}'.format(
+                        ', '.join(sorted(missing))
+                    )
+                )
+        rebuilt = 0
+        for user in users.iterator():
+            with transaction.atomic():
+                timelines.rebuild(user)
+            rebuilt += 1
+        self.stdout.write(
+            self.style.SUCCESS('Пересобрано лент: {}'.format(rebuilt))
+        )
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import replicas
+
+
+class Command(BaseCommand):
+    help = ('Копирует основную базу SQLite в реплики из '
+            'DATABASE_REPLICAS (или в указанные алиасы).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('aliases', nargs='*')
+
+    def handle(self, *args, **options):
+        aliases = options['aliases'] or settings.DATABASE_REPLICAS
+        if not aliases:
+            raise CommandError('Реплики не настроены: DATABASE_REPLICAS пуст.')
+        for alias in aliases:
+            if alias not in settings.DATABASES:
+                raise CommandError('Нет базы {}.'.format(alias))
+            try:
+                replicas.sync(alias)
+            except ValueError as error:
+                raise CommandError(error)
+            self.stdout.write(
+                self.style.SUCCESS('Реплика {} обновлена'.format(alias))
+            )
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """Изменения моделей, не попавшие в миграции до курсорной паджинации.
+
+    Подсказка к картинке поста и уникальность подписки через
+    UniqueConstraint вместо unique_together уже были в models.py, но
+    makemigrations для них не запускали.
+    """
+
+    dependencies = [
+        ('posts', '0007_auto_20200902_1740'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, help_text='Всем требуется увидеть картинку к посту!', null=True, upload_to='posts/', verbose_name='Картинка'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='follow',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(fields=('user', 'author'), name='follow_pair'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+TABLES = (
+    ('posts_post_fts', 'posts_post'),
+    ('posts_comment_fts', 'posts_comment'),
+)
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table, source in TABLES:
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE {} USING fts5('
+            "text, tokenize = 'unicode61 remove_diacritics 2')".format(table)
+        )
+        schema_editor.execute(
+            'INSERT INTO {}(rowid, text) SELECT id, text FROM {}'.format(
+                table, source
+            )
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table, _ in TABLES:
+        schema_editor.execute('DROP TABLE IF EXISTS {}'.format(table))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_fill_comment_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count
+
+BATCH_SIZE = 500
+
+
+def fill_timelines(apps, schema_editor):
+    """Ленты подписок для уже существующих подписок и постов.
+
+    Как timelines.rebuild(): посты авторов, у которых подписчиков больше
+    TIMELINE_CELEBRITY_FOLLOWERS, в ленты не раскладываются.
+    """
+    Follow = apps.get_model('posts', 'Follow')
+    Post = apps.get_model('posts', 'Post')
+    TimelineEntry = apps.get_model('posts', 'TimelineEntry')
+    celebrities = Follow.objects.order_by().values('author').annotate(
+        count=Count('pk')
+    ).filter(
+        count__gt=settings.TIMELINE_CELEBRITY_FOLLOWERS
+    ).values('author')
+    follows = Follow.objects.exclude(author__in=celebrities).values_list(
+        'user_id', 'author_id'
+    )
+    for user_id, author_id in follows.iterator():
+        posts = Post.objects.filter(
+            author_id=author_id
+        ).values_list('pk', 'pub_date')
+        TimelineEntry.objects.bulk_create(
+            (
+                TimelineEntry(
+                    user_id=user_id,
+                    post_id=post_id,
+                    author_id=author_id,
+                    pub_date=pub_date
+                )
+                for post_id, pub_date in posts.iterator()
+            ),
+            batch_size=BATCH_SIZE,
+            ignore_conflicts=True
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,277 @@
+import base64
+import binascii
+import datetime as dt
+import hashlib
+import inspect
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import EmptyPage, Paginator
+from django.db.models import Max, Q
+from django.db.models.query import QuerySet
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from django.utils.inspect import method_has_no_args
+
+# Границы целого в параметрах запросов SQLite.
+MIN_PK = -2 ** 63
+MAX_PK = 2 ** 63 - 1
+
+
+def encode_cursor(obj, field='pub_date'):
+    """Непрозрачный курсор по паре (дата, id) записи, по умолчанию поста."""
+    raw = '{}|{}'.format(getattr(obj, field).isoformat(), obj.pk)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Разбор курсора. Для битого значения возвращает None.
+
+    Битыми считаются и курсоры, которые нельзя передать в запрос:
+    дата без часового пояса или вне диапазона datetime в UTC, id вне
+    64-битного целого.
+    """
+    if not cursor:
+        return None
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        pub_date, pk = raw.rsplit('|', 1)
+        pub_date, pk = parse_datetime(pub_date), int(pk)
+        if pub_date is None or not timezone.is_aware(pub_date):
+            return None
+        pub_date = pub_date.astimezone(dt.timezone.utc)
+    except (binascii.Error, UnicodeError, ValueError, OverflowError):
+        return None
+    if not MIN_PK <= pk <= MAX_PK:
+        return None
+    return pub_date, pk
+
+
+def seek(object_list, value, pk, field='pub_date', descending=True):
+    """Записи, идущие строго после позиции (value, pk).
+
+    Лента упорядочена по ('-pub_date', '-id'), комментарии — по
+    ('created', 'id'), поэтому условие совпадает с порядком индекса
+    и не требует OFFSET.
+    """
+    if isinstance(object_list, QuerySet):
+        after = 'lt' if descending else 'gt'
+        return object_list.filter(
+            Q(**{'{}__{}'.format(field, after): value})
+            | Q(**{field: value, 'pk__{}'.format(after): pk})
+        )
+    return object_list.seek(value, pk)
+
+
+class CursorPage:
+    """Страница ленты, открытая по курсору.
+
+    Повторяет ту часть интерфейса Page, которой пользуются шаблоны.
+    """
+
+    def __init__(self, object_list, cursor, next_cursor):
+        self.object_list = object_list
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+
+    def __repr__(self):
+        return '<CursorPage after {}>'.format(self.cursor or 'start')
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.cursor is not None
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+
+class CursorPaginator:
+    """Паджинатор по курсору (keyset pagination).
+
+    В отличие от Paginator не делает ни COUNT(*), ни OFFSET:
+    каждая страница — это выборка per_page + 1 записей после курсора,
+    поэтому глубокие страницы открываются так же быстро, как первая,
+    а новые посты не сдвигают уже открытую ленту.
+    """
+
+    def __init__(self, object_list, per_page):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+
+    def get_page(self, cursor):
+        position = decode_cursor(cursor)
+        object_list = self.object_list
+        if position is None:
+            cursor = None
+        else:
+            object_list = seek(object_list, *position)
+        items = list(object_list[:self.per_page + 1])
+        next_cursor = None
+        if len(items) > self.per_page:
+            items = items[:self.per_page]
+            next_cursor = encode_cursor(items[-1])
+        return CursorPage(items, cursor, next_cursor)
+
+
+def queryset_page(queryset, cursor, per_page, field, descending=False):
+    """Страница выборки после курсора в виде QuerySet.
+
+    В отличие от CursorPaginator страница остаётся выборкой: её можно
+    передать туда, где ждут QuerySet. Записи страницы уже загружены
+    одним запросом на per_page + 1 записей, у страницы есть атрибуты
+    cursor и next_cursor (None на последней странице).
+    """
+    position = decode_cursor(cursor)
+    if position is None:
+        cursor = None
+    else:
+        queryset = seek(queryset, *position, field, descending)
+    rows = list(queryset[:per_page + 1])
+    page = queryset[:per_page]
+    page._result_cache = rows[:per_page]
+    page.cursor = cursor
+    page.next_cursor = None
+    if len(rows) > per_page:
+        page.next_cursor = encode_cursor(rows[per_page - 1], field)
+    return page
+
+
+def count_cache_key(object_list):
+    """Ключ кэша для числа записей выборки или None, если кэшировать нельзя.
+
+    Объект может задать ключ сам через атрибут count_cache_key,
+    для QuerySet ключом служит хэш его SQL.
+    """
+    key = getattr(object_list, 'count_cache_key', None)
+    if key is not None or not isinstance(object_list, QuerySet):
+        return key
+    try:
+        sql = str(object_list.query)
+    except EmptyResultSet:
+        return None
+    return 'paginator-count:' + hashlib.md5(sql.encode()).hexdigest()
+
+
+def estimate_count(object_list):
+    """Оценка числа записей по максимальному первичному ключу.
+
+    Работает только для нефильтрованной выборки: MAX(id) читается по
+    индексу первичного ключа, а COUNT(*) — полным проходом по таблице.
+    Удалённые записи делают оценку завышенной, это исправляет page().
+    """
+    if not isinstance(object_list, QuerySet) or object_list.query.where:
+        return None
+    return object_list.order_by().aggregate(last=Max('pk'))['last'] or 0
+
+
+class ApproximatePaginator(Paginator):
+    """Paginator с кэшированным или оценочным числом записей.
+
+    Число записей берётся из кэша (устаревает не больше чем на
+    settings.PAGINATOR_COUNT_TIMEOUT секунд), а для больших
+    нефильтрованных таблиц оценивается без COUNT(*). Содержимое страницы
+    при этом всегда точное: page() выбирает на одну запись больше и по
+    ней уточняет устаревшее число записей.
+    """
+
+    ELLIPSIS = '…'
+    # Во сколько раз номер страницы может превышать num_pages, прежде
+    # чем вместо него откроется последняя страница.
+    MAX_OVERSHOOT = 2
+
+    @cached_property
+    def count(self):
+        key = count_cache_key(self.object_list)
+        if key is None:
+            return self._exact_count()
+        count = cache.get(key)
+        if count is None:
+            count = estimate_count(self.object_list)
+            if count is None or count < settings.PAGINATOR_ESTIMATE_THRESHOLD:
+                count = self._exact_count()
+            cache.set(key, count, settings.PAGINATOR_COUNT_TIMEOUT)
+        return count
+
+    def _exact_count(self):
+        c = getattr(self.object_list, 'count', None)
+        if callable(c) and not inspect.isbuiltin(c) and method_has_no_args(c):
+            return c()
+        return len(self.object_list)
+
+    def _set_count(self, count):
+        self.__dict__['count'] = count
+        self.__dict__.pop('num_pages', None)
+        key = count_cache_key(self.object_list)
+        if key is not None:
+            cache.set(key, count, settings.PAGINATOR_COUNT_TIMEOUT)
+
+    def validate_number(self, number):
+        # Верхнюю границу проверяет page(): число записей может устареть.
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            number = int(number)
+            if number < 1:
+                raise
+            # Огромный номер не выбирается из базы: такой OFFSET не
+            # помещается в параметр запроса SQLite.
+            if number > self.num_pages * self.MAX_OVERSHOOT:
+                return self.num_pages
+            return number
+
+    def get_page(self, number):
+        try:
+            return super().get_page(number)
+        except EmptyPage:
+            # page() уже пересчитал число записей, последняя страница точна.
+            return self.page(self.num_pages)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            self._set_count(self._exact_count())
+            raise EmptyPage('That page contains no results')
+        seen = bottom + min(len(rows), self.per_page)
+        if len(rows) > self.per_page:
+            if self.count <= seen:
+                self._set_count(seen + 1)
+        elif self.count != seen:
+            self._set_count(seen)
+        page = self._get_page(rows[:self.per_page], number, self)
+        page.elided_page_range = list(self.get_elided_page_range(number))
+        return page
+
+    def get_elided_page_range(self, number=1, on_each_side=3, on_ends=2):
+        """Номера страниц вокруг текущей и по краям, пропуски — ELLIPSIS."""
+        number = self.validate_number(number)
+        if self.num_pages <= (on_each_side + on_ends) * 2:
+            yield from self.page_range
+            return
+        if number > (1 + on_each_side + on_ends) + 1:
+            yield from range(1, on_ends + 1)
+            yield self.ELLIPSIS
+            yield from range(number - on_each_side, number + 1)
+        else:
+            yield from range(1, number + 1)
+        if number < (self.num_pages - on_each_side - on_ends) - 1:
+            yield from range(number + 1, number + on_each_side + 1)
+            yield self.ELLIPSIS
+            yield from range(self.num_pages - on_ends + 1, self.num_pages + 1)
+        else:
+            yield from range(number + 1, self.num_pages + 1)
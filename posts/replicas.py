@@ -0,0 +1,137 @@
+"""Чтение лент с реплик базы и чтение своих записей с основной базы.
+
+Запись всегда идёт в основную базу (default). Чтение идёт на реплику
+из settings.DATABASE_REPLICAS только внутри view, обёрнутых
+read_from_replica, и только если пользователь ничего не записывал
+последние settings.REPLICA_PIN_TIMEOUT секунд: после записи
+PrimaryPinMiddleware ставит подписанную cookie, и до её истечения
+пользователь читает основную базу и видит свои изменения, даже если
+реплика отстаёт.
+
+Реплика — копия основной базы. Локально её обновляет команда
+sync_replica.
+"""
+import contextvars
+import random
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = 'primary_pin'
+PIN_SALT = 'posts.replicas'
+
+_state = contextvars.ContextVar('replica_state', default=None)
+
+
+class RequestState:
+    """Что известно о чтении и записи в текущем запросе."""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.replica_reads = False
+        self.replica = None
+        self.wrote = False
+
+
+def current():
+    return _state.get()
+
+
+def used_replica():
+    """Читал ли текущий запрос с реплики."""
+    state = _state.get()
+    return state is not None and state.replica is not None
+
+
+class ReplicaRouter:
+    """Роутер: запись в default, чтение в read_from_replica — с реплики.
+
+    Все запросы одного HTTP-запроса читают одну и ту же реплику.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if (state is None or not state.replica_reads or state.pinned
+                or not settings.DATABASE_REPLICAS):
+            return DEFAULT_DB_ALIAS
+        if state.replica is None:
+            state.replica = random.choice(settings.DATABASE_REPLICAS)
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики — копии основной базы, объекты из них совместимы.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+
+class PrimaryPinMiddleware:
+    """Закрепляет за пользователем основную базу после его записи."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pinned = request.get_signed_cookie(
+            PIN_COOKIE,
+            default=None,
+            salt=PIN_SALT,
+            max_age=settings.REPLICA_PIN_TIMEOUT
+        ) is not None
+        token = _state.set(RequestState(pinned=pinned))
+        try:
+            response = self.get_response(request)
+            state = _state.get()
+        finally:
+            _state.reset(token)
+        if state.wrote and settings.DATABASE_REPLICAS:
+            response.set_signed_cookie(
+                PIN_COOKIE,
+                '1',
+                salt=PIN_SALT,
+                max_age=settings.REPLICA_PIN_TIMEOUT,
+                httponly=True,
+                samesite='Lax'
+            )
+        return response
+
+
+def read_from_replica(view):
+    """Разрешает view читать с реплики.
+
+    Без PrimaryPinMiddleware (например, в RequestFactory) view тоже
+    читает с реплики, но без закрепления после записи.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = None
+        state = _state.get()
+        if state is None:
+            state = RequestState()
+            token = _state.set(state)
+        state.replica_reads = True
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            state.replica_reads = False
+            if token is not None:
+                _state.reset(token)
+    return wrapper
+
+
+def sync(alias):
+    """Копирует основную базу в реплику alias (SQLite backup API)."""
+    source, target = connections[DEFAULT_DB_ALIAS], connections[alias]
+    if source.vendor != 'sqlite' or target.vendor != 'sqlite':
+        raise ValueError('sync копирует только базы SQLite')
+    source.ensure_connection()
+    target.ensure_connection()
+    source.connection.backup(target.connection)
@@ -0,0 +1,182 @@
+"""Полнотекстовый поиск по постам и комментариям (SQLite FTS5).
+
+Тексты постов и комментариев копируются в таблицы FTS5 с rowid, равным
+id записи. Индекс обновляют сигналы моделей, массовые изменения мимо
+сигналов (QuerySet.update, bulk_create) исправляет команда
+rebuild_search_index. На других базах поиск работает через icontains.
+"""
+import base64
+import binascii
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .models import Comment, Post
+from .paginators import CursorPage, CursorPaginator
+
+TABLES = {
+    Post: 'posts_post_fts',
+    Comment: 'posts_comment_fts',
+}
+
+# Совпадение в комментарии весит вдвое меньше совпадения в тексте поста.
+COMMENT_WEIGHT = 0.5
+
+
+def available():
+    return connection.vendor == 'sqlite'
+
+
+def match_query(query):
+    """Запрос FTS5 из пользовательского ввода: все слова, по префиксу.
+
+    Слова берутся в кавычки, поэтому операторы FTS5 во вводе не
+    работают и не ломают запрос. Пустой ввод даёт None.
+    """
+    words = re.findall(r'\w+', query.lower())
+    if not words:
+        return None
+    return ' '.join('"{}"*'.format(word) for word in words)
+
+
+def index(instance):
+    if not available():
+        return
+    table = TABLES[type(instance)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM {} WHERE rowid = %s'.format(table), [instance.pk]
+        )
+        cursor.execute(
+            'INSERT INTO {}(rowid, text) VALUES (%s, %s)'.format(table),
+            [instance.pk, instance.text]
+        )
+
+
+def unindex(instance):
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM {} WHERE rowid = %s'.format(TABLES[type(instance)]),
+            [instance.pk]
+        )
+
+
+def rebuild():
+    """Пересобирает индекс с нуля, возвращает число проиндексированных."""
+    total = 0
+    with connection.cursor() as cursor:
+        for model, table in TABLES.items():
+            cursor.execute('DELETE FROM {}'.format(table))
+            cursor.execute(
+                'INSERT INTO {}(rowid, text) SELECT id, text FROM {}'.format(
+                    table, model._meta.db_table
+                )
+            )
+            total += cursor.rowcount
+            cursor.execute(
+                "INSERT INTO {0}({0}) VALUES ('optimize')".format(table)
+            )
+    return total
+
+
+class MatchingRows(RawSQL):
+    """Подзапрос rowid совпавших с запросом записей индекса для __in.
+
+    Django 2.2 берёт правую часть __in в скобки ещё раз, а
+    IN ((SELECT ...)) SQLite читает как скалярный подзапрос, то есть
+    только первую строку. Поэтому свои скобки RawSQL здесь не ставятся.
+    """
+
+    def __init__(self, model, query):
+        table = TABLES[model]
+        super().__init__(
+            'SELECT rowid FROM {} WHERE {} MATCH %s'.format(table, table),
+            [match_query(query)]
+        )
+
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
+
+
+def filter_matching(queryset, query):
+    """Оставляет в выборке записи, совпавшие с запросом.
+
+    Условие — подзапрос к индексу в WHERE: в отличие от списка id,
+    оно не ограничено числом параметров SQL.
+    """
+    return queryset.filter(pk__in=MatchingRows(queryset.model, query))
+
+
+# Посты, совпавшие текстом или комментарием, по возрастанию bm25
+# (у FTS5 лучшие совпадения имеют меньший ранг).
+RANKED_SQL = '''
+    SELECT post_id, score FROM (
+        SELECT post_id, MIN(score) AS score FROM (
+            SELECT rowid AS post_id, bm25(posts_post_fts) AS score
+            FROM posts_post_fts
+            WHERE posts_post_fts MATCH %s
+            UNION ALL
+            SELECT comment.post_id, bm25(posts_comment_fts) * {weight}
+            FROM posts_comment_fts
+            JOIN posts_comment AS comment
+                ON comment.id = posts_comment_fts.rowid
+            WHERE posts_comment_fts MATCH %s
+                AND comment.post_id IS NOT NULL
+        )
+        GROUP BY post_id
+    )
+    WHERE %s IS NULL OR score > %s OR (score = %s AND post_id < %s)
+    ORDER BY score, post_id DESC
+    LIMIT %s
+'''.format(weight=COMMENT_WEIGHT)
+
+
+def encode_cursor(rank, pk):
+    raw = '{!r}|{}'.format(rank, pk)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Разбор курсора выдачи. Для битого значения возвращает None."""
+    if not cursor:
+        return None
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        rank, pk = raw.rsplit('|', 1)
+        return float(rank), int(pk)
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
+
+
+def search_page(query, cursor=None, per_page=10):
+    """Страница выдачи по релевантности, открытая по курсору."""
+    if not available():
+        posts = Post.objects.for_feed().filter(text__icontains=query)
+        return CursorPaginator(posts, per_page).get_page(cursor)
+    match = match_query(query)
+    if match is None:
+        return CursorPage([], None, None)
+    position = decode_cursor(cursor)
+    if position is None:
+        cursor = None
+        rank = pk = None
+    else:
+        rank, pk = position
+    with connection.cursor() as sql:
+        sql.execute(
+            RANKED_SQL, [match, match, rank, rank, rank, pk, per_page + 1]
+        )
+        rows = sql.fetchall()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last_pk, last_rank = rows[-1]
+        next_cursor = encode_cursor(last_rank, last_pk)
+    posts = Post.objects.for_feed().in_bulk([pk for pk, _ in rows])
+    return CursorPage(
+        [posts[pk] for pk, _ in rows if pk in posts], cursor, next_cursor
+    )
@@ -0,0 +1,96 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import counters, search, timelines
+from .cache import invalidate
+from .models import Comment, Follow, Group, Post, User
+
+
+def invalidate_post(post):
+    tags = [
+        'posts',
+        'post:{}'.format(post.pk),
+        'author:{}'.format(post.author_id),
+    ]
+    if post.group_id:
+        tags.append('group:{}'.format(post.group_id))
+    invalidate(*tags)
+
+
+def invalidate_follow(follow):
+    invalidate(
+        'author:{}'.format(follow.author_id),
+        'author:{}'.format(follow.user_id)
+    )
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, **kwargs):
+    """Счётчик постов автора и раскладка поста по лентам подписчиков."""
+    if created:
+        counters.change_posts(instance.author_id, 1)
+        timelines.fan_out(instance)
+    search.index(instance)
+    invalidate_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    counters.change_posts(instance.author_id, -1)
+    search.unindex(instance)
+    invalidate_post(instance)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    if created:
+        counters.change_comments(instance.post_id, 1)
+    search.index(instance)
+    invalidate('post:{}'.format(instance.post_id))
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.change_comments(instance.post_id, -1)
+    search.unindex(instance)
+    invalidate('post:{}'.format(instance.post_id))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    invalidate('group:{}'.format(instance.pk))
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, update_fields, **kwargs):
+    """Имя пользователя есть в карточках его постов и в профиле.
+
+    Вход меняет только last_login и кэш не сбрасывает.
+    """
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    invalidate(
+        'user:{}'.format(instance.pk), 'author:{}'.format(instance.pk)
+    )
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    """Посты автора попадают в ленту нового подписчика.
+
+    Счётчики меняются первыми: от числа подписчиков зависит,
+    раскладываются ли посты автора по лентам.
+    """
+    if created:
+        counters.change_follow(instance.user_id, instance.author_id, 1)
+        timelines.follow(instance.user_id, instance.author_id)
+        invalidate_follow(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    """Посты автора убираются из ленты бывшего подписчика."""
+    counters.change_follow(instance.user_id, instance.author_id, -1)
+    timelines.unfollow(instance.user_id, instance.author_id)
+    invalidate_follow(instance)
@@ -0,0 +1,15 @@
+from django import template
+
+from posts import thumbnails
+
+register = template.Library()
+
+
+@register.inclusion_tag('posts/picture.html')
+def post_picture(post):
+    """Картинка поста: варианты WebP по ширине, JPEG или оригинал.
+
+    Миниатюры, найденные для всей страницы через thumbnails.resolve(),
+    повторно не ищутся.
+    """
+    return {'picture': thumbnails.picture(post)}
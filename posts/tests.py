@@ -1,13 +1,35 @@
+import base64
 import datetime as dt
+import io
 import os
 import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from unittest import mock
 
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase
+from django.core.files.uploadhandler import StopUpload
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import (Client, RequestFactory, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from PIL import Image, ImageFile
 
-from posts.models import Comment, Follow, Group, Post, User
+from posts import counters, loadtest, search, thumbnails, timelines
+from posts.cache import LOCK_KEY, METRICS, cache_key
+from posts.forms import PostForm
+from posts.models import Comment, Follow, Group, Post, TimelineEntry, User
+from posts.paginators import (ApproximatePaginator, decode_cursor,
+                              encode_cursor)
+from posts.replicas import PIN_COOKIE
+from posts.uploads import LimitedTemporaryFileUploadHandler
 
 
 class ContentTest(TestCase):
@@ -693,3 +715,1564 @@ class CommentTest(TestCase):
             msg='Авторизованный пользователь написал комментарий.'
                 'Проверь функцию создания комментария.'
         )
+
+
+class CommentPaginationTest(TestCase):
+    """Тесты постраничной подгрузки комментариев."""
+
+    def setUp(self):
+        """Пост с 45 комментариями, у всех одинаковое время создания."""
+        self.client = Client()
+        self.author = User.objects.create_user(username='author')
+        self.post = Post.objects.create(text='Пост', author=self.author)
+        Comment.objects.bulk_create(
+            Comment(post=self.post, author=self.author, text=f'Коммент {i}')
+            for i in range(45)
+        )
+        Comment.objects.update(
+            created=dt.datetime(2020, 1, 1, 12, 0, tzinfo=dt.timezone.utc)
+        )
+        self.ids = list(
+            Comment.objects.order_by('id').values_list('id', flat=True)
+        )
+        self.url = reverse('post_comments', args=[self.author, self.post.id])
+        cache.clear()
+
+    def test_post_page_renders_first_page(self):
+        """Страница поста показывает первые комментарии и ссылку дальше."""
+        response = self.client.get(
+            reverse('post', args=[self.author, self.post.id])
+        )
+        items = response.context['items']
+        self.assertEqual([item.pk for item in items], self.ids[:20])
+        self.assertContains(response, 'Коммент 19')
+        self.assertNotContains(response, 'Коммент 20')
+        self.assertContains(
+            response, '{}?after={}'.format(self.url, items.next_cursor)
+        )
+
+    def test_fragment_pages(self):
+        """Фрагменты по курсору идут подряд, последний без ссылки дальше."""
+        cursor, seen = None, []
+        while True:
+            params = {'after': cursor} if cursor else {}
+            response = self.client.get(self.url, params)
+            self.assertNotContains(response, '<html')
+            seen.extend(item.pk for item in response.context['items'])
+            cursor = response.context['items'].next_cursor
+            if cursor is None:
+                break
+        self.assertEqual(seen, self.ids)
+        self.assertNotContains(response, 'Показать ещё')
+
+    def test_json_pages(self):
+        """JSON отдаёт комментарии страницы и курсор следующей."""
+        first = self.client.get(self.url, {'format': 'json'}).json()
+        self.assertEqual(
+            [comment['id'] for comment in first['comments']], self.ids[:20]
+        )
+        self.assertEqual(first['comments'][0]['author'], 'author')
+        last = self.client.get(
+            self.url, {'format': 'json', 'after': first['next']}
+        ).json()
+        self.assertEqual(
+            [comment['id'] for comment in last['comments']],
+            self.ids[20:40]
+        )
+
+    def test_queries_do_not_depend_on_comment_count(self):
+        """Число запросов страницы поста не растёт с числом комментариев."""
+        url = reverse('post', args=[self.author, self.post.id])
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(url)
+        readers = [
+            User.objects.create_user(username=f'reader{i}') for i in range(30)
+        ]
+        Comment.objects.bulk_create(
+            Comment(post=self.post, author=reader, text='Ещё коммент')
+            for reader in readers
+        )
+        cache.clear()
+        with CaptureQueriesContext(connection) as after:
+            response = self.client.get(url)
+        self.assertEqual(len(after), len(before))
+        self.assertEqual(len(response.context['items']), 20)
+
+
+class CursorPaginationTest(TestCase):
+    """Тесты паджинации лент по курсору."""
+
+    def setUp(self):
+        """Создаю автора, группу и 25 постов с одинаковой датой."""
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='tester'
+        )
+        self.client.force_login(self.user)
+        self.group = Group.objects.create(
+            title='TestGroup',
+            slug='test',
+            description='Test group'
+        )
+        Post.objects.bulk_create(
+            Post(text=f'Пост {i}', author=self.user, group=self.group)
+            for i in range(25)
+        )
+        Post.objects.update(
+            pub_date=dt.datetime(2020, 1, 1, tzinfo=dt.timezone.utc)
+        )
+        cache.clear()
+
+    def walk(self, url):
+        """Проходит ленту по ссылкам «Следующая» и собирает id постов."""
+        ids = []
+        response = self.client.get(url)
+        while True:
+            page = response.context['page']
+            ids.extend(post.id for post in page)
+            if not page.has_next():
+                return ids
+            response = self.client.get(url, {'after': page.next_cursor})
+
+    def test_cursor_walk(self):
+        """Лента по курсору отдаёт все посты ровно один раз и по порядку."""
+        expected = list(Post.objects.values_list('id', flat=True))
+        url_list = (
+            reverse('index'),
+            reverse('group_posts', args=[self.group.slug]),
+            reverse('profile', args=[self.user.username]),
+        )
+        for url in url_list:
+            with self.subTest(url=url):
+                cache.clear()
+                self.assertEqual(
+                    self.walk(url),
+                    expected,
+                    msg='Курсор пропускает или повторяет записи'
+                )
+
+    def test_cursor_stable_on_new_posts(self):
+        """Новые посты не сдвигают уже открытую по курсору страницу."""
+        response = self.client.get(reverse('profile', args=[self.user]))
+        cursor = response.context['page'].next_cursor
+        second = self.client.get(
+            reverse('profile', args=[self.user]), {'after': cursor}
+        )
+        Post.objects.create(text='Свежий пост', author=self.user)
+        again = self.client.get(
+            reverse('profile', args=[self.user]), {'after': cursor}
+        )
+        self.assertEqual(
+            [post.id for post in second.context['page']],
+            [post.id for post in again.context['page']],
+            msg='Страница по курсору изменилась после публикации поста'
+        )
+
+    def test_page_number_and_bad_cursor(self):
+        """Ссылки ?page=N работают, битый курсор открывает начало ленты."""
+        response = self.client.get(reverse('index'), {'page': 3})
+        self.assertEqual(len(response.context['page']), 5)
+        response = self.client.get(reverse('index'), {'after': '!!!'})
+        self.assertEqual(
+            response.context['page'][0],
+            Post.objects.first(),
+            msg='Битый курсор должен открывать первую страницу'
+        )
+
+    def test_out_of_range_cursor(self):
+        """Курсор, который нельзя передать в запрос, открывает начало."""
+        post = Post.objects.first()
+        raw_list = (
+            '2020-01-01T00:00:00+00:00|99999999999999999999999',
+            '0001-01-01T00:00:00+14:00|1',
+            '9999-12-31T23:59:59-14:00|1',
+            '2020-01-01T00:00:00|1',
+        )
+        url_list = (
+            reverse('index'),
+            reverse('follow_index'),
+            reverse('post_comments', args=[self.user.username, post.id]),
+        )
+        for raw in raw_list:
+            cursor = base64.urlsafe_b64encode(raw.encode()).decode()
+            with self.subTest(raw=raw):
+                self.assertIsNone(decode_cursor(cursor))
+                for url in url_list:
+                    response = self.client.get(url, {'after': cursor})
+                    self.assertEqual(response.status_code, 200)
+
+
+class TimelineTest(TestCase):
+    """Тесты материализованной ленты подписок."""
+
+    def setUp(self):
+        """Подписчик, обычный автор и автор-«звезда»."""
+        self.client = Client()
+        self.reader = User.objects.create_user(username='reader')
+        self.author = User.objects.create_user(username='author')
+        self.star = User.objects.create_user(username='star')
+        self.fan = User.objects.create_user(username='fan')
+        self.client.force_login(self.reader)
+        cache.clear()
+
+    def feed_texts(self):
+        response = self.client.get(reverse('follow_index'))
+        return [post.text for post in response.context['page']]
+
+    def test_fan_out_on_post_and_follow(self):
+        """Посты попадают в ленту при публикации и при подписке."""
+        Post.objects.create(text='До подписки', author=self.author)
+        self.client.get(reverse('profile_follow', args=[self.author]))
+        Post.objects.create(text='После подписки', author=self.author)
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.reader).count(),
+            2,
+            msg='Посты автора не разложены по ленте подписчика'
+        )
+        self.assertEqual(
+            self.feed_texts(),
+            ['После подписки', 'До подписки']
+        )
+
+        self.client.get(reverse('profile_unfollow', args=[self.author]))
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.reader).exists(),
+            msg='После отписки посты остались в ленте'
+        )
+
+    @override_settings(TIMELINE_CELEBRITY_FOLLOWERS=1)
+    def test_celebrity_merged_on_read(self):
+        """Посты «звезды» не раскладываются, но видны в ленте."""
+        Follow.objects.create(user=self.fan, author=self.star)
+        Follow.objects.create(user=self.reader, author=self.star)
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.create(text='Обычный', author=self.author)
+        Post.objects.create(text='Звёздный', author=self.star)
+        self.assertFalse(
+            TimelineEntry.objects.filter(author=self.star).exists(),
+            msg='Пост «звезды» разложен по лентам'
+        )
+        self.assertEqual(self.feed_texts(), ['Звёздный', 'Обычный'])
+        response = self.client.get(reverse('follow_index'))
+        self.assertEqual(response.context['paginator'].count, 2)
+
+        Follow.objects.get(user=self.fan, author=self.star).delete()
+        self.assertTrue(
+            TimelineEntry.objects.filter(
+                user=self.reader, author=self.star
+            ).exists(),
+            msg='Посты бывшей «звезды» не досланы подписчикам'
+        )
+
+    def test_rebuild_command(self):
+        """Команда rebuild_timelines восстанавливает ленту."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.create(text='Пост', author=self.author)
+        TimelineEntry.objects.all().delete()
+        call_command('rebuild_timelines', 'reader', stdout=io.StringIO())
+        self.assertEqual(self.feed_texts(), ['Пост'])
+
+
+
+class ApproximatePaginatorTest(TestCase):
+    """Тесты паджинатора с кэшированным числом записей."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='tester')
+        Post.objects.bulk_create(
+            Post(text=f'Пост {i}', author=self.user) for i in range(95)
+        )
+        cache.clear()
+
+    def test_stale_count_is_corrected(self):
+        """Устаревшее число записей не портит содержимое страниц."""
+        posts = Post.objects.all()
+        self.assertEqual(ApproximatePaginator(posts, 10).count, 95)
+        Post.objects.bulk_create(
+            Post(text=f'Новый {i}', author=self.user) for i in range(10)
+        )
+        paginator = ApproximatePaginator(posts, 10)
+        page = paginator.get_page(10)
+        self.assertEqual(len(page), 10)
+        self.assertTrue(page.has_next(), msg='Потеряна последняя страница')
+        self.assertEqual(len(paginator.get_page(11)), 5)
+
+        Post.objects.filter(text__startswith='Новый').delete()
+        paginator = ApproximatePaginator(posts, 10)
+        page = paginator.get_page(11)
+        self.assertEqual(page.number, 10, msg='Пустая страница не отсечена')
+        self.assertEqual(paginator.count, 95)
+
+    @override_settings(PAGINATOR_ESTIMATE_THRESHOLD=50)
+    def test_estimated_count(self):
+        """Для большой нефильтрованной таблицы COUNT(*) не выполняется."""
+        with CaptureQueriesContext(connection) as queries:
+            count = ApproximatePaginator(Post.objects.all(), 10).count
+        self.assertEqual(count, Post.objects.order_by('-pk')[0].pk)
+        self.assertFalse(
+            any('COUNT(' in query['sql'] for query in queries),
+            msg='Число записей посчитано через COUNT(*)'
+        )
+
+    def test_elided_page_range(self):
+        """В паджинаторе выводится только окно страниц."""
+        Post.objects.bulk_create(
+            Post(text='Ещё пост', author=self.user) for i in range(900)
+        )
+        paginator = ApproximatePaginator(Post.objects.all(), 10)
+        self.assertEqual(
+            list(paginator.get_elided_page_range(50)),
+            [1, 2, '…', 47, 48, 49, 50, 51, 52, 53, '…', 99, 100]
+        )
+        response = Client().get(reverse('index'), {'page': 50})
+        self.assertContains(response, '?page=100')
+        self.assertNotContains(response, '?page=20"')
+
+
+    def test_huge_page_number(self):
+        """Номер далеко за концом ленты открывает последнюю страницу."""
+        response = Client().get(
+            reverse('index'), {'page': '999999999999999999999'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['page'].number, 10)
+
+
+# Сколько SQL-запросов может сделать страница при пустом кэше.
+# Число не должно зависеть от количества постов и комментариев на ней:
+# если тест падает, в шаблон или view вернулся запрос на каждый пост.
+QUERY_BUDGETS = {
+    'index': 5,
+    'group_posts': 5,
+    'profile': 6,
+    'post': 4,
+    'follow_index': 6,
+}
+
+
+class QueryBudgetTest(TestCase):
+    """Бюджет SQL-запросов для страниц с лентами и постом."""
+
+    def setUp(self):
+        """Десять авторов с постами в одной группе, у постов комментарии."""
+        self.group = Group.objects.create(title='TestGroup', slug='test')
+        self.authors = [
+            User.objects.create_user(username=f'author{i}')
+            for i in range(10)
+        ]
+        self.reader = self.authors[0]
+        for author in self.authors:
+            post = Post.objects.create(
+                text='Пост', author=author, group=self.group
+            )
+            for commentator in self.authors[:3]:
+                Comment.objects.create(
+                    post=post, author=commentator, text='Коммент'
+                )
+            if author != self.reader:
+                Follow.objects.create(user=self.reader, author=author)
+        self.post = Post.objects.filter(author=self.authors[1]).first()
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def test_query_budget(self):
+        """Страницы укладываются в QUERY_BUDGETS."""
+        urls = {
+            'index': reverse('index'),
+            'group_posts': reverse('group_posts', args=[self.group.slug]),
+            'profile': reverse('profile', args=[self.authors[1].username]),
+            'post': reverse(
+                'post', args=[self.authors[1].username, self.post.id]
+            ),
+            'follow_index': reverse('follow_index'),
+        }
+        for name, url in urls.items():
+            with self.subTest(view=name):
+                cache.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertLessEqual(
+                    len(queries),
+                    QUERY_BUDGETS[name],
+                    msg='Страница {} превысила бюджет запросов:\n{}'.format(
+                        name,
+                        '\n'.join(query['sql'] for query in queries)
+                    )
+                )
+
+
+class QueryPlanMixin:
+    """Проверка планов запросов через EXPLAIN QUERY PLAN (SQLite).
+
+    Запрос не проходит проверку, если читает таблицу целиком, а не по
+    индексу, или сортирует результат во временном B-дереве. Проход по
+    индексу в его порядке (SCAN ... USING INDEX) допустим: так читается
+    начало ленты с LIMIT.
+    """
+
+    PLAN_STATEMENTS = ('SELECT', 'UPDATE', 'DELETE')
+
+    def query_plan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [str(row[-1]) for row in cursor.fetchall()]
+
+    def bad_plan_steps(self, plan):
+        return [
+            step for step in plan
+            if 'TEMP B-TREE' in step
+            or step.startswith('SCAN') and ' INDEX' not in step
+        ]
+
+    def assertQueriesUseIndexes(self, queries, msg=None):
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN QUERY PLAN есть только у SQLite')
+        problems = []
+        for query in queries:
+            sql = query['sql'].strip()
+            if not sql.upper().startswith(self.PLAN_STATEMENTS):
+                continue
+            steps = self.bad_plan_steps(self.query_plan(sql))
+            if steps:
+                problems.append('{}\n    {}'.format(sql, '; '.join(steps)))
+        if problems:
+            self.fail(self._formatMessage(
+                msg, 'Запросы без индекса:\n' + '\n'.join(problems)
+            ))
+
+
+class QueryPlanTest(QueryPlanMixin, TestCase):
+    """Запросы лент и поста читают таблицы по индексам."""
+
+    def setUp(self):
+        self.group = Group.objects.create(title='TestGroup', slug='test')
+        self.authors = [
+            User.objects.create_user(username=f'author{i}')
+            for i in range(5)
+        ]
+        self.reader = self.authors[0]
+        for author in self.authors[1:]:
+            Follow.objects.create(user=self.reader, author=author)
+            for _ in range(3):
+                post = Post.objects.create(
+                    text='Пост', author=author, group=self.group
+                )
+                Comment.objects.create(
+                    post=post, author=self.reader, text='Коммент'
+                )
+        self.post = Post.objects.filter(author=self.authors[1]).first()
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def test_feed_queries_use_indexes(self):
+        """Страницы лент не читают таблицы целиком и не сортируют."""
+        urls = {
+            'index': reverse('index'),
+            'group_posts': reverse('group_posts', args=[self.group.slug]),
+            'profile': reverse('profile', args=[self.authors[1].username]),
+            'post': reverse(
+                'post', args=[self.authors[1].username, self.post.id]
+            ),
+            'follow_index': reverse('follow_index'),
+        }
+        pages = ({}, {'page': 2}, {'after': encode_cursor(self.post)})
+        for name, url in urls.items():
+            for params in pages:
+                with self.subTest(view=name, params=params):
+                    cache.clear()
+                    with CaptureQueriesContext(connection) as queries:
+                        response = self.client.get(url, params)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertQueriesUseIndexes(queries)
+
+    def test_write_queries_use_indexes(self):
+        """Публикация, комментарий и подписка не читают таблицы целиком."""
+        author = self.authors[2]
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('new_post'), {'text': 'Новый пост'})
+            self.client.post(
+                reverse('add_comment', args=[author.username, self.post.id]),
+                {'text': 'Коммент'}
+            )
+            self.client.get(reverse('profile_unfollow', args=[author]))
+            self.client.get(reverse('profile_follow', args=[author]))
+        self.assertQueriesUseIndexes(queries)
+
+
+class CounterTest(TestCase):
+    """Тесты денормализованных счётчиков."""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='tester')
+        self.author = User.objects.create_user(username='author')
+        self.client.force_login(self.user)
+        cache.clear()
+
+    def test_counters_follow_views(self):
+        """Счётчики меняются вместе с подписками, постами и комментариями."""
+        self.client.get(reverse('profile_follow', args=[self.author]))
+        self.client.post(reverse('new_post'), {'text': 'Пост'})
+        post = Post.objects.get()
+        self.client.post(
+            reverse('add_comment', args=[self.user, post.id]),
+            {'text': 'Коммент'}
+        )
+        self.author.profile.refresh_from_db()
+        self.user.profile.refresh_from_db()
+        post.refresh_from_db()
+        self.assertEqual(self.author.profile.followers_count, 1)
+        self.assertEqual(self.user.profile.following_count, 1)
+        self.assertEqual(self.user.profile.posts_count, 1)
+        self.assertEqual(post.comment_count, 1)
+
+        response = self.client.get(reverse('profile', args=[self.author]))
+        self.assertContains(response, 'Подписчиков: 1')
+
+        self.client.get(reverse('profile_unfollow', args=[self.author]))
+        self.author.profile.refresh_from_db()
+        self.assertEqual(self.author.profile.followers_count, 0)
+
+    def test_reconcile_counters(self):
+        """Команда reconcile_counters исправляет расхождения."""
+        post = Post.objects.create(text='Пост', author=self.author)
+        Comment.objects.create(post=post, author=self.user, text='Коммент')
+        Follow.objects.bulk_create(
+            [Follow(user=self.user, author=self.author)]
+        )
+        Post.objects.update(comment_count=7)
+        call_command('reconcile_counters', stdout=io.StringIO())
+        self.author.profile.refresh_from_db()
+        post.refresh_from_db()
+        self.assertEqual(self.author.profile.followers_count, 1)
+        self.assertEqual(self.author.profile.posts_count, 1)
+        self.assertEqual(post.comment_count, 1)
+
+
+class TagCacheTest(TestCase):
+    """Тесты кэша страниц с инвалидацией по тегам."""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='tester')
+        self.author = User.objects.create_user(username='author')
+        self.client.force_login(self.user)
+        self.group = Group.objects.create(title='TestGroup', slug='test')
+        self.post = Post.objects.create(
+            text='Тестовый пост', author=self.author, group=self.group
+        )
+        cache.clear()
+
+    def post_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, [
+            query for query in queries if 'posts_post' in query['sql']
+        ]
+
+    def test_pages_are_cached(self):
+        """Повторный запрос страницы не обращается к постам в базе."""
+        url_list = (
+            reverse('index'),
+            reverse('group_posts', args=[self.group.slug]),
+            reverse('profile', args=[self.author.username]),
+            reverse('post', args=[self.author.username, self.post.id]),
+        )
+        for url in url_list:
+            with self.subTest(url=url):
+                # Первый запрос выдаёт CSRF-cookie, она входит в ключ кэша.
+                self.client.get(url)
+                first, _ = self.post_queries(url)
+                second, queries = self.post_queries(url)
+                self.assertEqual(queries, [], msg='Страница не закэширована')
+                self.assertEqual(first.content, second.content)
+
+    def test_new_post_visible_immediately(self):
+        """Новый пост сразу виден на главной, в группе и в профиле."""
+        url_list = (
+            reverse('index'),
+            reverse('group_posts', args=[self.group.slug]),
+            reverse('profile', args=[self.author.username]),
+        )
+        for url in url_list:
+            self.client.get(url)
+        Post.objects.create(
+            text='Новый тестовый пост', author=self.author, group=self.group
+        )
+        for url in url_list:
+            with self.subTest(url=url):
+                self.assertContains(
+                    self.client.get(url), 'Новый тестовый пост'
+                )
+
+    def test_comment_and_follow_invalidate(self):
+        """Комментарий и подписка сбрасывают только зависящие страницы."""
+        post_url = reverse('post', args=[self.author.username, self.post.id])
+        profile_url = reverse('profile', args=[self.author.username])
+        group_url = reverse('group_posts', args=[self.group.slug])
+        for url in (post_url, profile_url, group_url):
+            self.client.get(url)
+
+        self.client.post(
+            reverse('add_comment', args=[self.author.username, self.post.id]),
+            {'text': 'Свежий коммент'}
+        )
+        self.assertContains(self.client.get(post_url), 'Свежий коммент')
+
+        self.client.get(reverse('profile_follow', args=[self.author]))
+        self.assertContains(self.client.get(profile_url), 'Подписчиков: 1')
+        other = Group.objects.create(title='Other', slug='other')
+        self.client.get(reverse('group_posts', args=[other.slug]))
+        _, queries = self.post_queries(
+            reverse('group_posts', args=[other.slug])
+        )
+        self.assertEqual(queries, [], msg='Подписка сбросила лишние страницы')
+
+    def test_anonymous_pages_shared(self):
+        """Страницы без CSRF-токена общие для анонимов с разными cookie."""
+        url = reverse('index')
+        states = []
+        for number in range(3):
+            client = Client()
+            client.cookies[settings.CSRF_COOKIE_NAME] = 'csrf{}'.format(
+                number
+            )
+            states.append(client.get(url)['X-Cache'])
+        self.assertEqual(states, ['miss', 'hit', 'hit'])
+
+    def test_csrf_pages_bound_to_cookie(self):
+        """Страница с CSRF-токеном не отдаётся с чужой CSRF-cookie."""
+        url = reverse('post', args=[self.author.username, self.post.id])
+        self.client.get(url)
+        first = self.client.get(url)
+        other = Client()
+        other.force_login(self.user)
+        other.get(url)
+        second = other.get(url)
+        self.assertEqual(first['X-Cache'], 'miss')
+        self.assertEqual(second['X-Cache'], 'miss')
+        self.assertNotEqual(
+            first.context['csrf_token'], second.context['csrf_token']
+        )
+        self.assertEqual(self.client.get(url)['X-Cache'], 'hit')
+
+    def test_pages_vary_by_user(self):
+        """Страница залогиненного пользователя не отдаётся анониму."""
+        self.client.get(reverse('index'))
+        response = Client().get(reverse('index'))
+        self.assertNotContains(response, 'Пользователь: tester')
+
+
+class TagCacheCommitTest(TransactionTestCase):
+    """Тесты инвалидации кэша изменениями внутри транзакции."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        self.client = Client()
+
+    def test_read_during_write_transaction(self):
+        """Страница, закэшированная до коммита, сбрасывается коммитом."""
+        url = reverse('index')
+        self.client.get(url)
+        with transaction.atomic():
+            Post.objects.create(text='Пост в транзакции', author=self.author)
+            # Читатель из другого соединения ещё не видит поста, но
+            # ответ сохраняется уже под новыми версиями тегов.
+            self.assertEqual(self.client.get(url)['X-Cache'], 'miss')
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'miss')
+        self.assertContains(response, 'Пост в транзакции')
+
+
+class StaleWhileRevalidateTest(TestCase):
+    """Тесты отдачи устаревших страниц и объединения промахов кэша."""
+
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(username='author')
+        Post.objects.create(text='Первый пост', author=self.author)
+        cache.clear()
+
+    def index_lock(self):
+        request = RequestFactory().get(reverse('index'))
+        request.user = AnonymousUser()
+        request.COOKIES = {
+            name: morsel.value for name, morsel in self.client.cookies.items()
+        }
+        key = cache_key(request, 'index_page')
+        return key, LOCK_KEY.format(key)
+
+    def get_index(self):
+        before = METRICS.copy()
+        response = self.client.get(reverse('index'))
+        return response, METRICS - before
+
+    @override_settings(VIEW_CACHE_TIMEOUT=0.01)
+    def test_stale_served_while_locked(self):
+        """Пока страницу перестраивает другой воркер, отдаётся старая."""
+        self.get_index()
+        time.sleep(0.02)
+        _, lock = self.index_lock()
+        cache.add(lock, 1)
+        response, events = self.get_index()
+        self.assertEqual(response['X-Cache'], 'stale')
+        self.assertEqual(events, Counter(stale=1))
+        cache.delete(lock)
+        response, events = self.get_index()
+        self.assertEqual(response['X-Cache'], 'miss')
+
+    @override_settings(VIEW_CACHE_LOCK_WAIT=0.2)
+    def test_invalidated_page_never_stale(self):
+        """Страница, сброшенная по тегам, не отдаётся даже под блокировкой."""
+        self.get_index()
+        _, lock = self.index_lock()
+        cache.add(lock, 1)
+        Post.objects.create(text='Новый пост', author=self.author)
+        response, events = self.get_index()
+        self.assertContains(response, 'Новый пост')
+        self.assertEqual(events, Counter(miss=1))
+
+    def test_waiting_request_coalesced(self):
+        """Запрос ждёт ответ воркера, держащего блокировку."""
+        self.get_index()
+        key, lock = self.index_lock()
+        fresh = cache.get(key)
+        cache.set(key, ({'posts': 'old'},) + fresh[1:])
+        cache.add(lock, 1)
+        worker = threading.Timer(0.1, cache.set, args=(key, fresh))
+        worker.start()
+        self.addCleanup(worker.join)
+        with CaptureQueriesContext(connection) as queries:
+            response, events = self.get_index()
+        self.assertEqual(response['X-Cache'], 'coalesced')
+        self.assertEqual(events, Counter(coalesced=1))
+        self.assertFalse(
+            [query for query in queries if 'posts_post' in query['sql']]
+        )
+
+    def test_hit_counted(self):
+        self.get_index()
+        response, events = self.get_index()
+        self.assertEqual(response['X-Cache'], 'hit')
+        self.assertEqual(events, Counter(hit=1))
+
+
+class ConditionalGetTest(TestCase):
+    """Тесты ответов 304 на условные GET-запросы."""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='tester')
+        self.author = User.objects.create_user(username='author')
+        self.client.force_login(self.user)
+        self.group = Group.objects.create(title='TestGroup', slug='test')
+        self.post = Post.objects.create(
+            text='Тестовый пост', author=self.author, group=self.group
+        )
+        self.post_url = reverse(
+            'post', args=[self.author.username, self.post.id]
+        )
+        self.profile_url = reverse('profile', args=[self.author.username])
+        self.group_url = reverse('group_posts', args=[self.group.slug])
+        cache.clear()
+
+    def revalidate(self, url, response):
+        before = METRICS.copy()
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        return second, METRICS - before, queries
+
+    def test_not_modified_without_rendering(self):
+        """Неизменившаяся страница отдаётся как 304 без запросов к постам."""
+        for url in (self.post_url, self.profile_url, self.group_url):
+            with self.subTest(url=url):
+                # Первый запрос выдаёт CSRF-cookie, она входит в ключ кэша.
+                self.client.get(url)
+                response = self.client.get(url)
+                self.assertIn('Last-Modified', response)
+                self.assertIn('private', response['Cache-Control'])
+                second, events, queries = self.revalidate(url, response)
+                self.assertEqual(second.status_code, 304)
+                self.assertEqual(second.content, b'')
+                self.assertEqual(second['ETag'], response['ETag'])
+                self.assertEqual(second['X-Cache'], 'not-modified')
+                self.assertEqual(events, Counter({'not-modified': 1}))
+                self.assertFalse(
+                    [query for query in queries if 'posts_' in query['sql']]
+                )
+
+    def test_if_modified_since(self):
+        self.client.get(self.post_url)
+        response = self.client.get(self.post_url)
+        second = self.client.get(
+            self.post_url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(second.status_code, 304)
+
+    def test_changes_modify_pages(self):
+        """Правка, комментарий и подписка меняют валидаторы страниц."""
+        changes = (
+            (self.post_url, lambda: self.client.post(
+                reverse('add_comment', args=[self.author, self.post.id]),
+                {'text': 'Свежий коммент'}
+            )),
+            (self.profile_url, lambda: self.client.get(
+                reverse('profile_follow', args=[self.author])
+            )),
+            (self.group_url, lambda: Post.objects.filter(
+                pk=self.post.pk
+            ).first().save()),
+        )
+        for url, change in changes:
+            with self.subTest(url=url):
+                self.client.get(url)
+                response = self.client.get(url)
+                change()
+                second, events, _ = self.revalidate(url, response)
+                self.assertEqual(second.status_code, 200)
+                self.assertNotEqual(second['ETag'], response['ETag'])
+                self.assertEqual(events, Counter(miss=1))
+
+    def test_evicted_page_still_not_modified(self):
+        """Без ответа в кэше страница строится, но клиенту уходит 304."""
+        self.client.get(self.post_url)
+        response = self.client.get(self.post_url)
+        request = RequestFactory().get(self.post_url)
+        request.user = self.user
+        request.COOKIES = {
+            name: morsel.value for name, morsel in self.client.cookies.items()
+        }
+        cache.delete(cache_key(request, 'post_page', csrf=True))
+        second, events, _ = self.revalidate(self.post_url, response)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second['X-Cache'], 'not-modified-rendered')
+        self.assertEqual(events, Counter({'not-modified-rendered': 1}))
+
+    def test_validators_vary_by_user(self):
+        """ETag одного пользователя не подходит к странице другого."""
+        self.client.get(self.post_url)
+        response = self.client.get(self.post_url)
+        other = Client()
+        other.force_login(self.author)
+        second = other.get(self.post_url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(second.status_code, 200)
+
+
+class ThumbnailTest(TestCase):
+    """Тесты фоновой генерации миниатюр."""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='tester')
+        gif = (
+            b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x00\x00\x00\x21\xf9\x04'
+            b'\x01\x0a\x00\x01\x00\x2c\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02'
+            b'\x02\x4c\x01\x00\x3b'
+        )
+        self.post = Post.objects.create(
+            text='Пост с картинкой',
+            author=self.user,
+            image=SimpleUploadedFile(
+                name='thumb.gif', content=gif, content_type='image/gif'
+            )
+        )
+        cache.clear()
+
+    def tearDown(self):
+        self.post.image.delete(save=False)
+        shutil.rmtree('media/cache/', ignore_errors=True)
+
+    def test_page_shows_original_until_ready(self):
+        """Страница не строит миниатюру сама и показывает оригинал."""
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, self.post.image.url)
+        self.assertIsNone(thumbnails.ready(self.post.image, 'card'))
+
+    @override_settings(THUMBNAIL_WORKERS=0)
+    def test_generated_thumbnail_replaces_original(self):
+        """Готовая миниатюра сразу заменяет оригинал в карточке."""
+        self.client.get(reverse('index'))
+        thumbnails.submit(self.post.pk, self.post.image.name)
+        thumbnail = thumbnails.ready(self.post.image, 'card')
+        self.assertIsNotNone(thumbnail)
+        self.assertEqual(thumbnail.size, [960, 339])
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, thumbnail.url)
+        self.assertNotContains(response, self.post.image.url)
+
+    @override_settings(THUMBNAIL_WORKERS=0)
+    def test_responsive_webp_variants(self):
+        """Карточка отдаёт WebP разных ширин через srcset, лениво."""
+        thumbnails.submit(self.post.pk, self.post.image.name)
+        response = self.client.get(reverse('index'))
+        for width in thumbnails.CARD_WIDTHS:
+            variant = thumbnails.ready(
+                self.post.image, 'card-{}'.format(width)
+            )
+            self.assertTrue(variant.name.endswith('.webp'))
+            self.assertEqual(variant.width, width)
+            self.assertContains(
+                response, '{} {}w'.format(variant.url, width)
+            )
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, 'sizes="')
+        self.assertContains(response, 'loading="lazy"')
+
+    def test_exif_stripped_on_upload(self):
+        """Из загруженной картинки удаляются EXIF-данные."""
+        image = Image.new('RGB', (40, 20), 'red')
+        exif = image.getexif()
+        exif[0x0110] = 'Secret Camera'
+        exif[0x0112] = 6
+        data = io.BytesIO()
+        image.save(data, 'JPEG', exif=exif)
+        self.client.force_login(self.user)
+        self.client.post(reverse('new_post'), {
+            'text': 'Пост с EXIF',
+            'image': SimpleUploadedFile(
+                'exif.jpg', data.getvalue(), content_type='image/jpeg'
+            ),
+        })
+        post = Post.objects.get(text='Пост с EXIF')
+        self.addCleanup(post.image.delete, save=False)
+        with Image.open(post.image) as saved:
+            # От EXIF остаётся только поворот, пиксели не пересжимаются.
+            self.assertEqual(dict(saved.getexif()), {0x0112: 6})
+            self.assertEqual(saved.size, (40, 20))
+            with Image.open(data) as original:
+                self.assertEqual(saved.getpixel((0, 0)), original.getpixel(
+                    (0, 0)
+                ))
+
+    def test_exif_stripped_without_decoding(self):
+        """EXIF вырезается из JPEG, PNG и WebP без декодирования пикселей."""
+        for image_format in ('JPEG', 'PNG', 'WEBP'):
+            with self.subTest(image_format=image_format):
+                image = Image.new('RGB', (40, 20), 'red')
+                exif = image.getexif()
+                exif[0x8298] = 'Secret Author'
+                exif[0x0112] = 3
+                data = io.BytesIO()
+                image.save(data, image_format, exif=exif)
+                form = PostForm(
+                    {'text': 'Пост'},
+                    {'image': SimpleUploadedFile(
+                        'exif.' + image_format.lower(), data.getvalue()
+                    )}
+                )
+                with mock.patch.object(
+                        ImageFile.ImageFile, 'load',
+                        side_effect=AssertionError('Картинка декодирована')):
+                    self.assertTrue(form.is_valid(), form.errors)
+                stripped = form.cleaned_data['image'].read()
+                self.assertNotIn(b'Secret Author', stripped)
+                with Image.open(io.BytesIO(stripped)) as saved:
+                    self.assertEqual(saved.format, image_format)
+                    self.assertEqual(dict(saved.getexif()), {0x0112: 3})
+                    self.assertEqual(saved.size, (40, 20))
+                    saved.load()
+
+    def test_page_thumbnails_resolved_in_one_query(self):
+        """Миниатюры всей страницы ищутся одним запросом к хранилищу."""
+        for i in range(5):
+            Post.objects.create(
+                text='Пост {}'.format(i),
+                author=self.user,
+                image='posts/missing{}.jpg'.format(i)
+            )
+        before = thumbnails.METRICS.copy()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('index'))
+        kvstore = [
+            query for query in queries
+            if 'thumbnail_kvstore' in query['sql']
+        ]
+        self.assertEqual(len(kvstore), 1)
+        saved = thumbnails.METRICS - before
+        lookups = 6 * len(thumbnails.GEOMETRIES)
+        self.assertEqual(saved['cache_lookups_saved'], lookups - 1)
+        self.assertEqual(saved['db_queries_saved'], lookups - 1)
+
+
+class UploadLimitTest(TestCase):
+    """Тесты ограничений на загрузку картинок."""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='tester')
+        self.client.force_login(self.user)
+
+    def png(self, size):
+        data = io.BytesIO()
+        Image.new('RGB', size, 'red').save(data, 'PNG')
+        return SimpleUploadedFile(
+            'image.png', data.getvalue(), content_type='image/png'
+        )
+
+    def test_handler_stops_upload_at_limit(self):
+        """Загрузка прерывается на первом куске сверх лимита."""
+        request = RequestFactory().post('/new/')
+        handler = LimitedTemporaryFileUploadHandler(request)
+        handler.new_file('image', 'big.png', 'image/png', None)
+        self.addCleanup(handler.file.close)
+        with override_settings(UPLOAD_MAX_SIZE=100):
+            handler.receive_data_chunk(b'x' * 64, 0)
+            with self.assertRaises(StopUpload) as stop:
+                handler.receive_data_chunk(b'x' * 64, 64)
+        self.assertTrue(stop.exception.connection_reset)
+        self.assertTrue(request.upload_too_large)
+        self.assertEqual(handler.file.tell(), 64)
+
+    def test_csrf_checked(self):
+        """Замена обработчиков загрузки не отключает проверку CSRF."""
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        response = client.post(reverse('new_post'), {
+            'text': 'Пост без токена',
+            'image': self.png((20, 20)),
+        })
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Post.objects.exists())
+
+    def test_other_uploads_not_limited(self):
+        """Лимит действует только на загрузки картинок постов."""
+        self.assertNotIn(
+            'posts.uploads.LimitedTemporaryFileUploadHandler',
+            settings.FILE_UPLOAD_HANDLERS
+        )
+        request = RequestFactory().post('/admin/', {
+            'file': SimpleUploadedFile('big.bin', b'x' * 4096),
+        })
+        with override_settings(UPLOAD_MAX_SIZE=1024):
+            self.assertEqual(request.FILES['file'].size, 4096)
+
+    @override_settings(UPLOAD_MAX_SIZE=1024)
+    def test_oversized_file_rejected(self):
+        response = self.client.post(reverse('new_post'), {
+            'text': 'Большая картинка',
+            'image': SimpleUploadedFile(
+                'big.png', b'x' * 4096, content_type='image/png'
+            ),
+        })
+        self.assertFormError(
+            response, 'form', 'image', 'Файл больше 1,0\xa0КБ.'
+        )
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(UPLOAD_MAX_MEGAPIXELS=0.001)
+    def test_too_many_pixels_rejected(self):
+        """Картинка с большим разрешением отклоняется по заголовку."""
+        response = self.client.post(reverse('new_post'), {
+            'text': 'Огромная картинка',
+            'image': self.png((100, 100)),
+        })
+        self.assertFormError(
+            response,
+            'form',
+            'image',
+            'Картинка 100×100 больше 0.001 мегапикселей.'
+        )
+        self.assertFalse(Post.objects.exists())
+
+    def test_image_within_limits_saved(self):
+        self.client.post(reverse('new_post'), {
+            'text': 'Обычная картинка',
+            'image': self.png((20, 20)),
+        })
+        post = Post.objects.get()
+        self.addCleanup(post.image.delete, save=False)
+        self.assertEqual(post.image.width, 20)
+
+
+class SearchTest(TestCase):
+    """Тесты полнотекстового поиска."""
+
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(username='author')
+        cache.clear()
+
+    def search(self, query, **params):
+        return self.client.get(reverse('search'), dict(q=query, **params))
+
+    def test_ranked_posts_and_comments(self):
+        """Совпадение в тексте поста выше совпадения в комментарии."""
+        commented = Post.objects.create(
+            text='Про погоду', author=self.author
+        )
+        Comment.objects.create(
+            post=commented, author=self.author, text='Где снимали котиков?'
+        )
+        post = Post.objects.create(
+            text='Фотографии котиков и котов', author=self.author
+        )
+        Post.objects.create(text='Совсем другое', author=self.author)
+        response = self.search('котик')
+        self.assertEqual(list(response.context['page']), [post, commented])
+
+    def test_index_follows_changes(self):
+        post = Post.objects.create(text='Старый текст', author=self.author)
+        post.text = 'Новый текст'
+        post.save()
+        self.assertEqual(list(self.search('новый').context['page']), [post])
+        self.assertEqual(list(self.search('старый').context['page']), [])
+        post.delete()
+        self.assertEqual(list(self.search('новый').context['page']), [])
+
+    def test_cursor_pagination(self):
+        Post.objects.bulk_create(
+            Post(text='Пост номер {}'.format(i), author=self.author)
+            for i in range(15)
+        )
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        first = self.search('пост').context['page']
+        self.assertEqual(len(first), 10)
+        self.assertTrue(first.has_next())
+        second = self.search('пост', after=first.next_cursor).context['page']
+        self.assertEqual(len(second), 5)
+        self.assertFalse(second.has_next())
+        self.assertFalse(set(first) & set(second))
+
+    def test_query_syntax_is_escaped(self):
+        """Операторы FTS5 во вводе не ломают поиск."""
+        Post.objects.create(text='Кавычки и скобки', author=self.author)
+        for query in ('"скобки', 'NEAR(скобки', '*', 'скобки OR'):
+            with self.subTest(query=query):
+                self.assertEqual(self.search(query).status_code, 200)
+
+    def test_rebuild_command(self):
+        """Команда переиндексирует изменения, сделанные мимо сигналов."""
+        post = Post.objects.create(text='До обновления', author=self.author)
+        Post.objects.filter(pk=post.pk).update(text='После обновления')
+        self.assertEqual(list(self.search('после').context['page']), [])
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(list(self.search('после').context['page']), [post])
+
+    def test_filter_matching_composes(self):
+        """Условие поиска сочетается с другими фильтрами выборки."""
+        other = User.objects.create_user(username='other')
+        Post.objects.create(text='Искомый пост', author=self.author)
+        found = Post.objects.create(text='Тоже искомый', author=other)
+        Post.objects.create(text='Другой пост', author=other)
+        matching = search.filter_matching(Post.objects.all(), 'искомый')
+        self.assertEqual(matching.count(), 2)
+        self.assertEqual(list(matching.filter(author=other)), [found])
+        self.assertEqual(
+            list(search.filter_matching(
+                Post.objects.filter(author=other), 'искомый'
+            )),
+            [found]
+        )
+
+    def test_admin_search_uses_index(self):
+        admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password'
+        )
+        self.client.force_login(admin)
+        post = Post.objects.create(text='Искомый пост', author=self.author)
+        Post.objects.create(text='Тоже искомый', author=self.author)
+        Comment.objects.create(
+            post=post, author=self.author, text='Искомый коммент'
+        )
+        Comment.objects.create(
+            post=post, author=self.author, text='Тоже искомый'
+        )
+        for url in ('/admin/posts/post/', '/admin/posts/comment/'):
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url, {'q': 'искомый'})
+                self.assertContains(response, 'Искомый')
+                self.assertContains(response, 'Тоже искомый')
+                sql = ' '.join(query['sql'] for query in queries)
+                self.assertIn('_fts', sql)
+                self.assertNotIn('LIKE', sql)
+
+
+class PostCardCacheTest(TestCase):
+    """Тесты кэширования карточек постов."""
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+        self.post = Post.objects.create(
+            text='Старый текст', author=self.author
+        )
+        self.client = Client()
+        self.client.force_login(self.author)
+        cache.clear()
+
+    def test_card_reused_until_post_changes(self):
+        """Карточка берётся из кэша, пока не изменились пост и группа."""
+        self.client.get(reverse('index'))
+        Post.objects.filter(pk=self.post.pk).update(text='Тихая правка')
+        Post.objects.create(text='Другой пост', author=self.reader)
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'Другой пост')
+        self.assertContains(
+            response,
+            'Старый текст',
+            msg_prefix='Неизменённая карточка не взята из кэша'
+        )
+
+        self.post.text = 'Новый текст'
+        self.post.save()
+        self.assertContains(self.client.get(reverse('index')), 'Новый текст')
+
+    def test_card_follows_author_rename(self):
+        """Смена имени автора перерисовывает карточки его постов."""
+        self.client.get(reverse('index'))
+        self.author.username = 'renamed'
+        self.author.save()
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, '@renamed')
+        self.assertContains(response, reverse('profile', args=['renamed']))
+
+    def test_viewer_parts_not_cached(self):
+        """Ссылка на редактирование не попадает в общую часть карточки."""
+        edit_url = reverse('post_edit', args=[self.author, self.post.id])
+        self.assertContains(self.client.get(reverse('index')), edit_url)
+        reader = Client()
+        reader.force_login(self.reader)
+        self.assertNotContains(reader.get(reverse('index')), edit_url)
+
+
+class LargeTableAdminTest(TestCase):
+    """Тесты списков и массовых действий админки постов и комментариев."""
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='author')
+        self.group = Group.objects.create(title='Группа', slug='group')
+        self.other = Group.objects.create(title='Другая', slug='other')
+        admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password'
+        )
+        self.client = Client()
+        self.client.force_login(admin)
+        cache.clear()
+
+    def create_posts(self, count):
+        for i in range(count):
+            post = Post.objects.create(
+                text=f'Пост {i}', author=self.author, group=self.group
+            )
+            Comment.objects.create(
+                post=post, author=self.author, text='Искомый коммент'
+            )
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow(self):
+        """Число запросов списка не зависит от числа строк на странице."""
+        for url in ('/admin/posts/post/', '/admin/posts/comment/'):
+            Post.objects.all().delete()
+            self.create_posts(2)
+            few = self.count_queries(url)
+            self.create_posts(10)
+            with self.subTest(url=url):
+                self.assertEqual(self.count_queries(url), few)
+
+    def test_date_hierarchy_uses_index(self):
+        """Даты для навигации по pub_date берутся из индекса."""
+        self.create_posts(2)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/admin/posts/post/')
+        for query in queries:
+            if 'MAX("posts_post"."pub_date")' not in query['sql']:
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+            self.assertIn('post_pub_date', plan)
+            break
+        else:
+            self.fail('Нет запроса границ дат')
+
+    def test_move_to_group_in_chunks(self):
+        """Перенос в группу идёт порциями и сбрасывает страницы групп."""
+        self.create_posts(5)
+        self.client.get(reverse('group_posts', args=[self.other.slug]))
+        with mock.patch('posts.bulk.CHUNK_SIZE', 2):
+            response = self.client.post('/admin/posts/post/', {
+                'action': 'move_to_group',
+                'select_across': '1',
+                'index': '0',
+                '_selected_action': ['0'],
+                'group': self.other.pk,
+            }, follow=True)
+        self.assertContains(response, 'Перенесено постов: 5.')
+        self.assertEqual(self.other.posts.count(), 5)
+        response = self.client.get(
+            reverse('group_posts', args=[self.other.slug])
+        )
+        self.assertContains(response, 'Пост 4')
+
+    def test_delete_posts_in_chunks(self):
+        """Удаление постов убирает комментарии, индекс и счётчик автора."""
+        self.create_posts(5)
+        kept = Post.objects.order_by('pk').first()
+        selected = list(
+            Post.objects.exclude(pk=kept.pk).values_list('pk', flat=True)
+        )
+        data = {
+            'action': 'delete_in_chunks',
+            'index': '0',
+            '_selected_action': selected,
+        }
+        response = self.client.post('/admin/posts/post/', data)
+        self.assertContains(response, 'Будет удалено')
+        self.assertEqual(Post.objects.count(), 5)
+        self.assertContains(self.client.get(reverse('index')), 'Пост 4')
+        with mock.patch('posts.bulk.CHUNK_SIZE', 3):
+            self.client.post('/admin/posts/post/', dict(data, post='yes'))
+        self.assertEqual(list(Post.objects.all()), [kept])
+        self.assertNotContains(
+            self.client.get(reverse('index')),
+            'Пост 4',
+            msg_prefix='Удаление не сбросило закэшированную ленту'
+        )
+        self.assertEqual(Comment.objects.count(), 1)
+        self.author.profile.refresh_from_db()
+        self.assertEqual(self.author.profile.posts_count, 1)
+        response = self.client.get(reverse('search'), {'q': 'пост'})
+        self.assertEqual(list(response.context['page']), [kept])
+
+    def test_delete_comments_in_chunks(self):
+        """Удаление комментариев уменьшает их счётчик у постов."""
+        self.create_posts(3)
+        with mock.patch('posts.bulk.CHUNK_SIZE', 2):
+            self.client.post('/admin/posts/comment/', {
+                'action': 'delete_in_chunks',
+                'select_across': '1',
+                'index': '0',
+                '_selected_action': ['0'],
+                'post': 'yes',
+            })
+        self.assertFalse(Comment.objects.exists())
+        self.assertFalse(Post.objects.filter(comment_count__gt=0).exists())
+        response = self.client.get(reverse('search'), {'q': 'искомый'})
+        self.assertEqual(list(response.context['page']), [])
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_PIN_TIMEOUT=5)
+class ReplicaTest(TransactionTestCase):
+    """Тесты чтения с реплики, отстающей от основной базы.
+
+    Отставание моделируется тем, что реплика обновляется только
+    командой sync_replica.
+    """
+
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+        self.sync()
+
+    def sync(self):
+        call_command('sync_replica', stdout=io.StringIO())
+
+    def test_reads_own_writes(self):
+        """Автор сразу видит свой пост, остальные — после синхронизации."""
+        response = self.author_client.post(
+            reverse('new_post'), {'text': 'Свежий пост'}
+        )
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertNotContains(
+            self.reader_client.get(reverse('index')), 'Свежий пост'
+        )
+        self.assertContains(
+            self.author_client.get(reverse('index')), 'Свежий пост'
+        )
+        self.sync()
+        self.assertContains(
+            self.reader_client.get(reverse('index')),
+            'Свежий пост',
+            msg_prefix='Страница с отстающей реплики осталась в кэше'
+        )
+
+    def test_pin_expires(self):
+        """После REPLICA_PIN_TIMEOUT автор снова читает с реплики."""
+        self.author_client.get(reverse('profile_follow', args=[self.reader]))
+        Post.objects.create(text='Пост мимо реплики', author=self.author)
+        url = reverse('profile', args=[self.author])
+        self.assertContains(self.author_client.get(url), 'Пост мимо реплики')
+        later = time.time() + 10
+        with mock.patch('time.time', return_value=later):
+            cache.clear()
+            self.assertNotContains(
+                self.author_client.get(url), 'Пост мимо реплики'
+            )
+
+    def test_writes_go_to_primary(self):
+        """Запись идёт в основную базу, а детали поста читаются с реплики."""
+        post = Post.objects.create(text='Старый текст', author=self.author)
+        self.sync()
+        self.author_client.post(
+            reverse('post_edit', args=[self.author, post.id]),
+            {'text': 'Новый текст'}
+        )
+        self.assertEqual(
+            Post.objects.using('replica').get(pk=post.pk).text, 'Старый текст'
+        )
+        url = reverse('post', args=[self.author, post.id])
+        self.assertContains(self.author_client.get(url), 'Новый текст')
+        self.assertContains(self.reader_client.get(url), 'Старый текст')
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas(self):
+        """Без реплик всё читается из основной базы и cookie не ставится."""
+        response = self.author_client.post(
+            reverse('new_post'), {'text': 'Свежий пост'}
+        )
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        self.assertContains(
+            self.reader_client.get(reverse('index')), 'Свежий пост'
+        )
+
+
+class GenerateDataTest(TestCase):
+    """Тесты генератора синтетических данных."""
+
+    def generate(self, prefix='gen'):
+        output = io.StringIO()
+        call_command(
+            'generate_data', users=30, groups=5, posts=300, follows=5,
+            comments=3, prefix=prefix, batch_size=100, stdout=output
+        )
+        return output.getvalue()
+
+    def test_generate_data(self):
+        """Данные согласованы: счётчики, ленты, даты; скорость в отчёте."""
+        output = self.generate()
+        self.assertIn('строк/с', output)
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(Group.objects.count(), 5)
+        self.assertEqual(Post.objects.count(), 300)
+        self.assertEqual(
+            Comment.objects.count(),
+            sum(Post.objects.values_list('comment_count', flat=True))
+        )
+        self.assertEqual(counters.reconcile(), 0)
+        for user in User.objects.all()[:5]:
+            generated = set(user.timeline.values_list('post_id', flat=True))
+            timelines.rebuild(user)
+            self.assertEqual(
+                set(user.timeline.values_list('post_id', flat=True)),
+                generated
+            )
+        dates = list(
+            Post.objects.order_by('pk').values_list('pub_date', flat=True)
+        )
+        self.assertEqual(dates, sorted(dates))
+        self.assertGreater(dates[-1] - dates[0], dt.timedelta(days=300))
+        self.assertTrue(Post._meta.get_field('pub_date').auto_now_add)
+        self.assertTrue(Comment._meta.get_field('created').auto_now_add)
+
+    def test_reproducible(self):
+        """Тот же seed даёт те же данные, повтор префикса запрещён."""
+        self.generate('first')
+        with self.assertRaises(CommandError):
+            self.generate('first')
+        self.generate('second')
+
+        def rows(prefix):
+            return list(Post.objects.filter(
+                author__username__startswith=prefix
+            ).order_by('pk').values_list(
+                'author__username', 'text', 'comment_count'
+            ))
+
+        self.assertEqual(
+            [(name[len('first'):], *rest) for name, *rest in rows('first')],
+            [(name[len('second'):], *rest) for name, *rest in rows('second')]
+        )
+
+    def test_cached_pages_refreshed(self):
+        """После генерации закэшированные страницы не устаревшие."""
+        cache.clear()
+        self.client.get(reverse('index'))
+        self.generate()
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response['X-Cache'], 'miss')
+        self.assertEqual(response.context['paginator'].count, 300)
+
+
+class LoadTestTest(TestCase):
+    """Тесты вспомогательных функций нагрузочного теста."""
+
+    def test_parse_mix(self):
+        """Смесь сценариев разбирается, неизвестные сценарии — ошибка."""
+        self.assertEqual(
+            loadtest.parse_mix('feed=3,post=1'), {'feed': 3.0, 'post': 1.0}
+        )
+        for text in ('feed=3,delete=1', 'feed=0', 'feed=много'):
+            with self.assertRaises(ValueError):
+                loadtest.parse_mix(text)
+
+    def test_replay_log(self):
+        """Из access log берутся GET и HEAD, маршруты — по URLconf."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'access.log')
+        with open(path, 'w') as output:
+            output.write(
+                '127.0.0.1 - - [17/Oct/2026:07:00:00 +0000] '
+                '"GET /group/cats/?page=2 HTTP/1.1" 200 512 "-" "curl"\n'
+                '127.0.0.1 - - [17/Oct/2026:07:00:01 +0000] '
+                '"POST /new/ HTTP/1.1" 302 0 "-" "curl"\n'
+                'мусор\n'
+                '127.0.0.1 - - [17/Oct/2026:07:00:02 +0000] '
+                '"HEAD / HTTP/1.0" 200 0\n'
+            )
+        paths = loadtest.read_log(path)
+        self.assertEqual(paths, ['/group/cats/?page=2', '/'])
+        self.assertEqual(
+            [loadtest.route_of(path) for path in paths],
+            ['group_posts', 'index']
+        )
+        self.assertEqual(loadtest.route_of('/a/b/c/d/'), 'unmatched')
+
+    def test_summarize(self):
+        """Сводка: запросы, ошибки (сбои и статусы от 400) и перцентили."""
+        results = [('index', 200, float(ms)) for ms in range(1, 101)]
+        results += [('new_post', 302, 5.0), ('new_post', 500, 7.0),
+                    ('new_post', 0, 30000.0)]
+        summary = loadtest.summarize(results, 10)
+        self.assertEqual(summary['index']['requests'], 100)
+        self.assertEqual(summary['index']['rps'], 10)
+        self.assertEqual(summary['index']['error_rate'], 0)
+        self.assertEqual(summary['index']['p95_ms'], 96)
+        self.assertAlmostEqual(summary['new_post']['error_rate'], 0.6667)
+        self.assertEqual(summary['total']['requests'], 103)
+        self.assertEqual(summary['total']['max_ms'], 30000)
+
+    def test_multipart(self):
+        """Тело с картинкой, которое шлют клиенты, принимает new_post."""
+        user = User.objects.create_user(username='loader')
+        client = Client()
+        client.force_login(user)
+        body, content_type = loadtest.multipart(
+            {'text': 'Пост под нагрузкой'},
+            {'image': ('load.jpg', loadtest.make_image())}
+        )
+        with mock.patch('posts.views.thumbnails.queue'):
+            response = client.generic(
+                'POST', reverse('new_post'), body, content_type=content_type
+            )
+        self.assertEqual(response.status_code, 302)
+        post = Post.objects.get(author=user)
+        self.assertEqual(post.text, 'Пост под нагрузкой')
+        self.assertTrue(post.image.name.endswith('.jpg'))
+        self.addCleanup(post.image.delete, save=False)
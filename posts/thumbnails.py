@@ -0,0 +1,444 @@
+"""Фоновая генерация миниатюр картинок постов.
+
+sorl-thumbnail строит миниатюру при первом показе, внутри запроса.
+Здесь миниатюры всех размеров из GEOMETRIES строятся сразу после
+сохранения поста в пуле процессов, а шаблоны через тег post_picture
+берут только готовые миниатюры и до их появления показывают оригинал.
+
+Карточка получает варианты WebP нескольких ширин для srcset и JPEG для
+браузеров без WebP. EXIF удаляется ещё при загрузке (strip_metadata).
+
+При settings.THUMBNAIL_WORKERS = 0 миниатюры строятся в том же
+процессе сразу после коммита.
+"""
+import logging
+import multiprocessing
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from django.conf import settings
+from django.core.files.base import File
+from django.db import transaction
+from PIL import Image
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as thumbnail_defaults
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.kvstores.cached_db_kvstore import KVStore as CachedDBStore
+from sorl.thumbnail.models import KVStore
+
+from . import worker
+from .cache import invalidate
+
+logger = logging.getLogger(__name__)
+
+# Картинка карточки поста: варианты WebP по ширине для srcset и JPEG
+# для браузеров без WebP. Пропорции у всех вариантов как у 960x339.
+CARD_WIDTHS = (480, 720, 960, 1440)
+CARD_SIZES = (
+    '(min-width: 1200px) 1110px, (min-width: 992px) 930px, '
+    '(min-width: 768px) 690px, (min-width: 576px) 510px, 100vw'
+)
+CARD_OPTIONS = {'crop': 'center', 'upscale': True}
+
+# Метаданные, которые вырезаются из загруженных картинок: сегменты JPEG
+# APP1 (EXIF, XMP) и APP13 (IPTC), чанки PNG и WebP.
+JPEG_METADATA = (0xE1, 0xED)
+PNG_METADATA = (b'eXIf', b'tEXt', b'zTXt', b'iTXt')
+WEBP_METADATA = (b'EXIF', b'XMP ')
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+EXIF_HEADER = b'Exif\x00\x00'
+ORIENTATION = 0x0112
+# Флаги EXIF и XMP в чанке VP8X.
+WEBP_EXIF_FLAG = 0x08
+WEBP_XMP_FLAG = 0x04
+
+# Размеры, которые используют шаблоны: имя -> (геометрия, параметры).
+GEOMETRIES = {
+    'card': ('960x339', dict(CARD_OPTIONS, format='JPEG')),
+}
+GEOMETRIES.update(
+    (
+        'card-{}'.format(width),
+        (
+            '{}x{}'.format(width, round(width * 339 / 960)),
+            dict(CARD_OPTIONS, format='WEBP')
+        )
+    )
+    for width in CARD_WIDTHS
+)
+
+# Сколько поисков миниатюр сэкономила пакетная выборка в этом процессе.
+METRICS = Counter()
+
+_executor = None
+
+
+class Backend(ThumbnailBackend):
+    """Бэкенд sorl, умеющий искать миниатюру без её генерации."""
+
+    def thumbnail_file(self, file_, geometry_string, **options):
+        """ImageFile будущей миниатюры с тем же именем, что у sorl."""
+        source = ImageFile(file_)
+        # Те же шаги, что в ThumbnailBackend.get_thumbnail.
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(thumbnail_defaults, attr):
+                options.setdefault(key, value)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return ImageFile(name, default.storage)
+
+    def get_ready(self, file_, geometry_string, **options):
+        """Готовая миниатюра из хранилища ключей или None."""
+        if not file_:
+            return None
+        return default.kvstore.get(
+            self.thumbnail_file(file_, geometry_string, **options)
+        )
+
+
+backend = Backend()
+
+
+def ready(file_, name):
+    """Готовая миниатюра размера name из GEOMETRIES или None."""
+    geometry, options = GEOMETRIES[name]
+    return backend.get_ready(file_, geometry, **options)
+
+
+def resolve(posts):
+    """Находит готовые миниатюры всех постов страницы разом.
+
+    Вместо поиска по хранилищу ключей sorl на каждую миниатюру делает
+    один get_many к кэшу и, для не найденных в кэше, один запрос к базе.
+    Результат кладётся в post.thumbnails — словарь имя -> миниатюра
+    (или None) по всем GEOMETRIES. Возвращает число сэкономленных
+    обращений.
+    """
+    posts = [post for post in posts if post.image]
+    files = {
+        (post.pk, name): backend.thumbnail_file(
+            post.image, geometry, **options
+        )
+        for post in posts
+        for name, (geometry, options) in GEOMETRIES.items()
+    }
+    kvstore = default.kvstore
+    if not posts or not isinstance(kvstore, CachedDBStore):
+        for post in posts:
+            post.thumbnails = {
+                name: kvstore.get(files[post.pk, name])
+                for name in GEOMETRIES
+            }
+        return 0
+    keys = {item: add_prefix(file_.key) for item, file_ in files.items()}
+    values = kvstore.cache.get_many(list(keys.values()))
+    missing = [key for key in keys.values() if key not in values]
+    if missing:
+        found = dict(
+            KVStore.objects.filter(key__in=missing).values_list('key', 'value')
+        )
+        loaded = {key: found.get(key, EMPTY_VALUE) for key in missing}
+        kvstore.cache.set_many(
+            loaded, thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT
+        )
+        values.update(loaded)
+    for post in posts:
+        post.thumbnails = {}
+        for name in GEOMETRIES:
+            value = values[keys[post.pk, name]]
+            post.thumbnails[name] = (
+                None if value == EMPTY_VALUE
+                else deserialize_image_file(value)
+            )
+    # По отдельности: обращение к кэшу на каждую миниатюру и запрос
+    # к базе на каждый промах кэша.
+    cache_saved = len(keys) - 1
+    queries_saved = max(len(missing) - 1, 0)
+    METRICS['cache_lookups_saved'] += cache_saved
+    METRICS['db_queries_saved'] += queries_saved
+    METRICS['batches'] += 1
+    return cache_saved + queries_saved
+
+
+def picture(post):
+    """Данные для <picture> карточки: готовые варианты или оригинал.
+
+    Варианты, которые ещё строятся, в srcset не попадают; пока нет
+    JPEG-миниатюры, запасным вариантом служит оригинал картинки.
+    """
+    if not post.image:
+        return None
+    if not hasattr(post, 'thumbnails'):
+        resolve([post])
+    webp = []
+    for width in CARD_WIDTHS:
+        thumbnail = post.thumbnails['card-{}'.format(width)]
+        if thumbnail is not None:
+            webp.append('{} {}w'.format(thumbnail.url, width))
+    return {
+        'fallback': post.thumbnails['card'],
+        'original': post.image,
+        'webp_srcset': ', '.join(webp),
+        'sizes': CARD_SIZES,
+    }
+
+
+def _orientation(exif):
+    """Значение тега Orientation из EXIF, 1 — если его нет."""
+    try:
+        orientation = Image.Exif()
+        orientation.load(exif)
+        orientation = orientation.get(ORIENTATION, 1)
+    except Exception:
+        return 1
+    return orientation if orientation in range(2, 9) else 1
+
+
+def _orientation_exif(orientation):
+    """EXIF (TIFF) с единственным тегом Orientation."""
+    return b'MM\x00\x2a\x00\x00\x00\x08' + struct.pack(
+        '>HHHIHHI', 1, ORIENTATION, 3, 1, orientation, 0, 0
+    )
+
+
+def _copy(source, output, size):
+    while size > 0:
+        chunk = source.read(min(size, 64 * 1024))
+        if not chunk:
+            raise ValueError('Файл картинки обрезан')
+        output.write(chunk)
+        size -= len(chunk)
+
+
+def _strip_jpeg(source, output):
+    if source.read(2) != b'\xff\xd8':
+        raise ValueError('Не JPEG')
+    output.write(b'\xff\xd8')
+    stripped = False
+    while True:
+        marker = source.read(2)
+        while marker[1:] == b'\xff':
+            marker = b'\xff' + source.read(1)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            raise ValueError('Повреждённый JPEG')
+        if marker[1] in (0xDA, 0xD9):
+            # После SOS идут сжатые данные, метаданных в них нет.
+            output.write(marker)
+            shutil.copyfileobj(source, output)
+            return stripped
+        header = source.read(2)
+        length = int.from_bytes(header, 'big')
+        if length < 2:
+            raise ValueError('Повреждённый JPEG')
+        if marker[1] not in JPEG_METADATA:
+            output.write(marker + header)
+            _copy(source, output, length - 2)
+            continue
+        stripped = True
+        data = source.read(length - 2)
+        orientation = 1
+        if data.startswith(EXIF_HEADER):
+            orientation = _orientation(data)
+        if orientation != 1:
+            exif = EXIF_HEADER + _orientation_exif(orientation)
+            output.write(b'\xff\xe1' + struct.pack('>H', len(exif) + 2))
+            output.write(exif)
+
+
+def _strip_png(source, output):
+    if source.read(8) != PNG_SIGNATURE:
+        raise ValueError('Не PNG')
+    output.write(PNG_SIGNATURE)
+    stripped = False
+    while True:
+        header = source.read(8)
+        if len(header) < 8:
+            raise ValueError('Повреждённый PNG')
+        length, kind = struct.unpack('>I4s', header)
+        if kind not in PNG_METADATA:
+            output.write(header)
+            _copy(source, output, length + 4)
+            if kind == b'IEND':
+                return stripped
+            continue
+        stripped = True
+        data = source.read(length + 4)[:length]
+        orientation = _orientation(data) if kind == b'eXIf' else 1
+        if orientation != 1:
+            chunk = b'eXIf' + _orientation_exif(orientation)
+            output.write(struct.pack('>I', len(chunk) - 4) + chunk)
+            output.write(struct.pack('>I', zlib.crc32(chunk)))
+
+
+def _strip_webp(source, output):
+    header = source.read(12)
+    if header[:4] != b'RIFF' or header[8:] != b'WEBP':
+        raise ValueError('Не WebP')
+    output.write(header)
+    stripped = exif_kept = False
+    flags_at = None
+    while True:
+        chunk = source.read(8)
+        if not chunk:
+            break
+        if len(chunk) < 8:
+            raise ValueError('Повреждённый WebP')
+        kind, size = struct.unpack('<4sI', chunk)
+        padded = size + size % 2
+        if kind not in WEBP_METADATA:
+            if kind == b'VP8X':
+                flags_at = output.tell() + 8
+            output.write(chunk)
+            _copy(source, output, padded)
+            continue
+        stripped = True
+        data = source.read(padded)[:size]
+        orientation = _orientation(data) if kind == b'EXIF' else 1
+        if orientation != 1:
+            exif = _orientation_exif(orientation)
+            output.write(b'EXIF' + struct.pack('<I', len(exif)) + exif)
+            exif_kept = True
+    if not stripped:
+        return False
+    if flags_at is not None:
+        output.seek(flags_at)
+        flags = output.read(1)[0] & ~WEBP_XMP_FLAG
+        if not exif_kept:
+            flags &= ~WEBP_EXIF_FLAG
+        output.seek(flags_at)
+        output.write(bytes([flags]))
+    output.seek(0, os.SEEK_END)
+    size = output.tell() - 8
+    output.seek(4)
+    output.write(struct.pack('<I', size))
+    return True
+
+
+STRIPPERS = {
+    'JPEG': _strip_jpeg,
+    'PNG': _strip_png,
+    'WEBP': _strip_webp,
+}
+
+
+def strip_metadata(upload):
+    """Копия загруженной картинки без EXIF (геотеги, модель камеры).
+
+    Метаданные вырезаются из файла без декодирования пикселей, поэтому
+    память не зависит от разрешения картинки. Поворот сохраняется:
+    вместо EXIF остаётся EXIF с единственным тегом Orientation, его
+    учитывают браузеры и миниатюры. Картинки без метаданных возвращаются
+    как есть; ValueError, если файл не удалось разобрать.
+    """
+    upload.seek(0)
+    with Image.open(upload) as image:
+        strip = STRIPPERS.get(image.format)
+    if strip is None:
+        upload.seek(0)
+        return upload
+    upload.seek(0)
+    output = tempfile.TemporaryFile()
+    try:
+        stripped = strip(upload, output)
+    except (ValueError, IndexError, struct.error):
+        output.close()
+        raise ValueError('Не удалось разобрать картинку')
+    upload.seek(0)
+    if not stripped:
+        output.close()
+        return upload
+    output.seek(0)
+    return File(output, name=upload.name)
+
+
+def generate(image_name):
+    """Строит все миниатюры картинки, возвращает их ключи в хранилище."""
+    keys = []
+    for geometry, options in GEOMETRIES.values():
+        thumbnail = backend.get_thumbnail(image_name, geometry, **options)
+        keys.append(thumbnail.key)
+    return keys
+
+
+def executor():
+    global _executor
+    if _executor is None:
+        # spawn, а не fork: дочерний процесс не наследует открытые
+        # соединения с базой и блокировки потоков родителя.
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.THUMBNAIL_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=worker.setup,
+            initargs=(os.environ.get('DJANGO_SETTINGS_MODULE'),)
+        )
+    return _executor
+
+
+def shutdown():
+    """Останавливает пул генерации, дождавшись поставленных задач."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+
+
+def _generated(post_id, future):
+    try:
+        keys = future.result()
+    except Exception:
+        logger.exception('Не удалось построить миниатюры поста %s', post_id)
+        return
+    # Процесс мог закэшировать отсутствие миниатюры в хранилище ключей
+    # sorl: сбрасываем эти записи и карточку поста.
+    default.kvstore.cache.delete_many([add_prefix(key) for key in keys])
+    invalidate('post:{}'.format(post_id))
+
+
+def _generate_inline(image_name):
+    future = Future()
+    try:
+        future.set_result(generate(image_name))
+    except Exception as error:
+        future.set_exception(error)
+    return future
+
+
+def submit(post_id, image_name):
+    global _executor
+    if not settings.THUMBNAIL_WORKERS:
+        future = _generate_inline(image_name)
+    else:
+        try:
+            future = executor().submit(
+                worker.run, 'posts.thumbnails.generate', image_name
+            )
+        except BrokenProcessPool:
+            # Пул пересоздаётся при следующей загрузке, а карточка этого
+            # поста пока показывает оригинал картинки.
+            logger.exception('Пул генерации миниатюр остановлен')
+            _executor = None
+            return
+    future.add_done_callback(partial(_generated, post_id))
+
+
+def queue(post):
+    """Ставит миниатюры картинки поста в очередь после коммита."""
+    if post.image:
+        transaction.on_commit(
+            partial(submit, post.pk, post.image.name)
+        )
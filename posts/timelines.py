@@ -0,0 +1,196 @@
+"""Материализованные ленты подписок.
+
+Пост обычного автора при публикации раскладывается по лентам всех его
+подписчиков (fan-out on write). Посты авторов, у которых подписчиков
+больше settings.TIMELINE_CELEBRITY_FOLLOWERS, не раскладываются:
+они подмешиваются в ленту при чтении (fan-out on read).
+"""
+import heapq
+
+from django.conf import settings
+from django.db.models import Q
+
+from users.models import Profile
+
+from .models import Follow, Post, TimelineEntry
+
+BATCH_SIZE = 500
+
+
+def followers_count(author_id):
+    return Profile.objects.filter(
+        user_id=author_id
+    ).values_list('followers_count', flat=True).first() or 0
+
+
+def is_celebrity(author_id):
+    return followers_count(author_id) > settings.TIMELINE_CELEBRITY_FOLLOWERS
+
+
+def celebrities_followed(user):
+    """id авторов-«звёзд», на которых подписан пользователь."""
+    return list(
+        Follow.objects.filter(
+            user=user,
+            author__profile__followers_count__gt=(
+                settings.TIMELINE_CELEBRITY_FOLLOWERS
+            )
+        ).values_list('author_id', flat=True)
+    )
+
+
+def fan_out(post):
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    if is_celebrity(post.author_id):
+        return
+    followers = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(
+                user_id=user_id,
+                post_id=post.pk,
+                author_id=post.author_id,
+                pub_date=post.pub_date
+            )
+            for user_id in followers.iterator()
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту подписчика все посты автора."""
+    posts = Post.objects.filter(
+        author_id=author_id
+    ).values_list('pk', 'pub_date')
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(
+                user_id=user_id,
+                post_id=post_id,
+                author_id=author_id,
+                pub_date=pub_date
+            )
+            for post_id, pub_date in posts.iterator()
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def follow(user_id, author_id):
+    """Подписка: переносит посты обычного автора в ленту подписчика."""
+    if not is_celebrity(author_id):
+        backfill(user_id, author_id)
+
+
+def unfollow(user_id, author_id):
+    """Отписка: убирает посты автора из ленты.
+
+    Если после отписки автор перестал быть «звездой», его посты,
+    опубликованные без раскладки, досылаются остальным подписчикам.
+    """
+    TimelineEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+    if followers_count(author_id) == settings.TIMELINE_CELEBRITY_FOLLOWERS:
+        followers = Follow.objects.filter(
+            author_id=author_id
+        ).values_list('user_id', flat=True)
+        for follower_id in followers.iterator():
+            backfill(follower_id, author_id)
+
+
+def rebuild(user):
+    """Пересобирает ленту пользователя с нуля."""
+    TimelineEntry.objects.filter(user=user).delete()
+    celebrities = set(celebrities_followed(user))
+    authors = Follow.objects.filter(user=user).values_list(
+        'author_id', flat=True
+    )
+    for author_id in authors:
+        if author_id not in celebrities:
+            backfill(user.pk, author_id)
+
+
+class FollowFeed:
+    """Лента подписок пользователя в виде последовательности постов.
+
+    Поддерживает срезы и count(), поэтому подходит и для Paginator,
+    и для CursorPaginator (через seek()). Материализованная часть
+    читается одним диапазоном индекса timeline_user_date, посты «звёзд»
+    сливаются с ней по (pub_date, id).
+    """
+
+    ordered = True
+
+    def __init__(self, user, position=None):
+        self.user = user
+        self.position = position
+        self._celebrities = None
+
+    @property
+    def celebrities(self):
+        if self._celebrities is None:
+            self._celebrities = celebrities_followed(self.user)
+        return self._celebrities
+
+    @property
+    def count_cache_key(self):
+        return 'follow-feed-count:{}'.format(self.user.pk)
+
+    def seek(self, pub_date, pk):
+        feed = FollowFeed(self.user, (pub_date, pk))
+        feed._celebrities = self._celebrities
+        return feed
+
+    def count(self):
+        entries = TimelineEntry.objects.filter(user=self.user)
+        if not self.celebrities:
+            return entries.count()
+        return (
+            entries.exclude(author_id__in=self.celebrities).count()
+            + Post.objects.filter(author_id__in=self.celebrities).count()
+        )
+
+    def _keys(self, limit):
+        """Первые limit пар (pub_date, post_id) ленты после позиции."""
+        entries = TimelineEntry.objects.filter(
+            user=self.user
+        ).order_by('-pub_date', '-post_id')
+        if self.position is not None:
+            pub_date, pk = self.position
+            entries = entries.filter(
+                Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, post_id__lt=pk)
+            )
+        keys = entries.values_list('pub_date', 'post_id')[:limit]
+        if not self.celebrities:
+            return list(keys)
+        posts = Post.objects.filter(author_id__in=self.celebrities)
+        if self.position is not None:
+            pub_date, pk = self.position
+            posts = posts.filter(
+                Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, pk__lt=pk)
+            )
+        merged = heapq.merge(
+            keys,
+            posts.values_list('pub_date', 'pk')[:limit],
+            reverse=True
+        )
+        result, seen = [], set()
+        for key in merged:
+            if key[1] not in seen:
+                seen.add(key[1])
+                result.append(key)
+            if len(result) == limit:
+                break
+        return result
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self[key:key + 1][0]
+        start, stop = key.start or 0, key.stop
+        ids = [pk for _, pk in self._keys(stop)[start:stop]]
+        posts = Post.objects.for_feed().in_bulk(ids)
+        return [posts[pk] for pk in ids if pk in posts]
@@ -0,0 +1,84 @@
+"""Загрузка картинок постов с ограничением памяти.
+
+View, обёрнутые limit_uploads, пишут файл во временный файл по частям
+(по умолчанию Django держит небольшие загрузки в памяти целиком), а
+как только файл превышает settings.UPLOAD_MAX_SIZE, загрузка
+прерывается: остаток тела запроса не читается. Форма проверяет размер
+и число пикселей по заголовку картинки, до декодирования.
+
+Остальные загрузки сайта (например, в админке) идут через обработчики
+Django без этого ограничения.
+"""
+from functools import wraps
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadhandler import (StopUpload,
+                                             TemporaryFileUploadHandler)
+from django.template.defaultfilters import filesizeformat
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+
+
+class LimitedTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """Временный файл, загрузка которого прерывается на UPLOAD_MAX_SIZE.
+
+    Прерванная загрузка отмечается в request.upload_too_large: файла
+    в request.FILES тогда нет, и форма показывает ошибку о размере.
+    """
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.UPLOAD_MAX_SIZE:
+            self.request.upload_too_large = True
+            raise StopUpload(connection_reset=True)
+        return super().receive_data_chunk(raw_data, start)
+
+
+def limit_uploads(view):
+    """Загрузки view идут только через LimitedTemporaryFileUploadHandler.
+
+    Обработчики можно заменить только до чтения тела запроса, а
+    CsrfViewMiddleware читает его раньше view. Поэтому CSRF проверяется
+    уже внутри, после замены.
+    """
+    protected = csrf_protect(view)
+
+    @csrf_exempt
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        request.upload_handlers = [
+            LimitedTemporaryFileUploadHandler(request)
+        ]
+        return protected(request, *args, **kwargs)
+    return wrapper
+
+
+def too_large(request):
+    """Прервана ли загрузка файла этого запроса по размеру."""
+    return getattr(request, 'upload_too_large', False)
+
+
+def size_error():
+    return ValidationError(
+        'Файл больше %(limit)s.',
+        code='file_too_large',
+        params={'limit': filesizeformat(settings.UPLOAD_MAX_SIZE)}
+    )
+
+
+def check_pixels(upload):
+    """Отклоняет картинку, в которой больше UPLOAD_MAX_MEGAPIXELS.
+
+    Размеры берутся из заголовка, который уже прочитал ImageField:
+    сами пиксели не декодируются.
+    """
+    width, height = upload.image.size
+    if width * height > settings.UPLOAD_MAX_MEGAPIXELS * 1000 * 1000:
+        raise ValidationError(
+            'Картинка %(width)s×%(height)s больше %(limit)s мегапикселей.',
+            code='image_too_large',
+            params={
+                'width': width,
+                'height': height,
+                'limit': settings.UPLOAD_MAX_MEGAPIXELS
+            }
+        )
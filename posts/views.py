@@ -1,19 +1,60 @@
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
+from django.db import transaction
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
 
+from . import thumbnails
+from .cache import cache_tagged, post_tags, stamp_cards, tag
 from .forms import CommentForm, PostForm
 from .models import Follow, Group, Post, User
+from .paginators import (ApproximatePaginator, CursorPaginator,
+                         encode_cursor, queryset_page)
+from .replicas import read_from_replica
+from .search import search_page
+from .timelines import FollowFeed
+from .uploads import limit_uploads, too_large
 
+POSTS_PER_PAGE = 10
+COMMENTS_PER_PAGE = 20
 
-@cache_page(20, key_prefix='index_page')
+
+def paginate(request, object_list):
+    """Страница ленты по номеру (?page=N) или по курсору (?after=...).
+
+    Ссылка «Следующая» всегда строится по курсору, поэтому листание
+    вглубь ленты не упирается в OFFSET. Число записей для номеров
+    страниц берётся из кэша или оценивается, см. ApproximatePaginator.
+    """
+    after = request.GET.get('after')
+    if after:
+        paginator = CursorPaginator(object_list, POSTS_PER_PAGE)
+        return paginator.get_page(after), paginator
+    paginator = ApproximatePaginator(object_list, POSTS_PER_PAGE)
+    page = paginator.get_page(request.GET.get('page'))
+    page.next_cursor = encode_cursor(page[-1]) if page.has_next() else None
+    return page, paginator
+
+
+def comments_page(post, cursor):
+    """Страница комментариев поста по курсору, от старых к новым."""
+    return queryset_page(
+        post.comments.select_related('author'),
+        cursor,
+        COMMENTS_PER_PAGE,
+        field='created'
+    )
+
+
+@read_from_replica
+@cache_tagged(key_prefix='index_page')
 def index(request):
     """Функция отрисовки главной страницы."""
-    post_list = Post.objects.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    tag(request, 'posts')
+    post_list = Post.objects.for_feed()
+    page, paginator = paginate(request, post_list)
+    tag(request, *post_tags(page))
+    stamp_cards(page, request.cache_tags)
+    thumbnails.resolve(page)
     return render(
         request,
         'posts/index.html',
@@ -21,13 +62,17 @@ def index(request):
     )
 
 
+@read_from_replica
+@cache_tagged(key_prefix='group_page')
 def group_posts(request, slug):
     """Функция отрисовки постов группы."""
     group = get_object_or_404(Group, slug=slug)
-    slug_posts = group.posts.all()
-    paginator = Paginator(slug_posts, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    tag(request, 'group:{}'.format(group.pk))
+    slug_posts = group.posts.for_feed()
+    page, paginator = paginate(request, slug_posts)
+    tag(request, *post_tags(page))
+    stamp_cards(page, request.cache_tags)
+    thumbnails.resolve(page)
     return render(
         request,
         'group.html',
@@ -36,15 +81,19 @@ def group_posts(request, slug):
 
 
 @login_required
+@limit_uploads
 def new_post(request):
     """Функция создания нового поста. Требует авторизации."""
     form = PostForm(
         request.POST or None,
-        files=request.FILES or None
+        files=request.FILES or None,
+        upload_too_large=too_large(request)
     )
     if form.is_valid():
         form.instance.author = request.user
-        form.save()
+        with transaction.atomic():
+            post = form.save()
+            thumbnails.queue(post)
         return redirect('index')
     return render(
         request,
@@ -53,13 +102,20 @@ def new_post(request):
     )
 
 
+@read_from_replica
+@cache_tagged(key_prefix='profile_page')
 def profile(request, username):
     """Функция отрисовки профиля автора."""
-    author = get_object_or_404(User, username=username)
-    post_list = author.posts.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    author = get_object_or_404(
+        User.objects.select_related('profile'),
+        username=username
+    )
+    tag(request, 'author:{}'.format(author.pk))
+    post_list = author.posts.for_feed()
+    page, paginator = paginate(request, post_list)
+    tag(request, *post_tags(page))
+    stamp_cards(page, request.cache_tags)
+    thumbnails.resolve(page)
     try:
         following = Follow.objects.filter(
             user__username=request.user,
@@ -80,10 +136,19 @@ def profile(request, username):
     )
 
 
+@read_from_replica
+@cache_tagged(key_prefix='post_page')
 def post_view(request, username, post_id):
     """Функция отображения поста."""
-    post = get_object_or_404(Post, author__username=username, pk=post_id)
-    items = post.comments.all()
+    post = get_object_or_404(
+        Post.objects.for_feed().select_related('author__profile'),
+        author__username=username,
+        pk=post_id
+    )
+    tag(request, 'author:{}'.format(post.author_id), *post_tags([post]))
+    stamp_cards([post], request.cache_tags)
+    thumbnails.resolve([post])
+    items = comments_page(post, request.GET.get('after'))
     return render(
         request,
         'posts/post_page.html',
@@ -96,7 +161,44 @@ def post_view(request, username, post_id):
     )
 
 
+@read_from_replica
+@cache_tagged(key_prefix='comments_page')
+def post_comments(request, username, post_id):
+    """Страница комментариев поста для подгрузки без перезагрузки.
+
+    Отдаёт фрагмент HTML с комментариями после курсора ?after=...
+    и ссылкой на следующую страницу, а с ?format=json — список
+    комментариев и курсор следующей страницы.
+    """
+    post = get_object_or_404(
+        Post.objects.select_related('author'),
+        author__username=username,
+        pk=post_id
+    )
+    tag(request, 'post:{}'.format(post.pk))
+    items = comments_page(post, request.GET.get('after'))
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'comments': [
+                {
+                    'id': comment.pk,
+                    'author': comment.author.username,
+                    'text': comment.text,
+                    'created': comment.created.isoformat(),
+                }
+                for comment in items
+            ],
+            'next': items.next_cursor,
+        })
+    return render(
+        request,
+        'posts/comment_list.html',
+        {'post': post, 'items': items}
+    )
+
+
 @login_required
+@limit_uploads
 def post_edit(request, username, post_id):
     """Функция редактирования поста.
 
@@ -110,10 +212,14 @@ def post_edit(request, username, post_id):
     form = PostForm(
         request.POST or None,
         files=request.FILES or None,
-        instance=post
+        instance=post,
+        upload_too_large=too_large(request)
         )
     if form.is_valid():
-        form.save()
+        with transaction.atomic():
+            post = form.save()
+            if 'image' in form.changed_data:
+                thumbnails.queue(post)
         return redirect('post', username=username, post_id=post_id)
     return render(
         request,
@@ -125,6 +231,21 @@ def post_edit(request, username, post_id):
     )
 
 
+def search(request):
+    """Функция поиска по постам и комментариям."""
+    query = request.GET.get('q', '').strip()
+    page = None
+    if query:
+        page = search_page(query, request.GET.get('after'), POSTS_PER_PAGE)
+        stamp_cards(page)
+        thumbnails.resolve(page)
+    return render(
+        request,
+        'posts/search.html',
+        {'query': query, 'page': page}
+    )
+
+
 def page_not_found(request, exception):
     """Кастомная функция вывода страницы 404."""
     return render(
@@ -143,9 +264,13 @@ def server_error(request):
 @login_required
 def add_comment(request, username, post_id):
     """Функция добавления комментария."""
-    post = get_object_or_404(Post, author__username=username, pk=post_id)
+    post = get_object_or_404(
+        Post.objects.select_related('author'),
+        author__username=username,
+        pk=post_id
+    )
     form = CommentForm(request.POST or None)
-    items = post.comments.all()
+    items = comments_page(post, None)
     if not form.is_valid():
         context = {
             'form': form,
@@ -159,7 +284,8 @@ def add_comment(request, username, post_id):
                 )
     form.instance.author = request.user
     form.instance.post = post
-    form.save()
+    with transaction.atomic():
+        form.save()
     return redirect('post', username=username, post_id=post.id)
 
 
@@ -171,10 +297,10 @@ def follow_index(request):
     на которого подписан авторизованный пользователь
     с реализацией паджинатора.
     """
-    post_list = Post.objects.filter(author__following__user=request.user)
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = FollowFeed(request.user)
+    page, paginator = paginate(request, post_list)
+    stamp_cards(page)
+    thumbnails.resolve(page)
     return render(
         request,
         'posts/follow.html',
@@ -190,7 +316,8 @@ def profile_follow(request, username):
     """Функция подписки на автора."""
     author = get_object_or_404(User, username=username)
     if request.user != author:
-        Follow.objects.get_or_create(user=request.user, author=author)
+        with transaction.atomic():
+            Follow.objects.get_or_create(user=request.user, author=author)
     return redirect('profile', username=username)
 
 
@@ -198,9 +325,10 @@ def profile_follow(request, username):
 def profile_unfollow(request, username):
     """Функция отписки пользователя от автора."""
     author = get_object_or_404(User, username=username)
-    unfollow = Follow.objects.get(
-        user=request.user,
-        author=author
-    )
-    unfollow.delete()
+    with transaction.atomic():
+        unfollow = Follow.objects.get(
+            user=request.user,
+            author=author
+        )
+        unfollow.delete()
     return redirect('profile', username=username)
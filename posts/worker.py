@@ -0,0 +1,23 @@
+"""Запуск задач Django в процессах фонового пула (spawn).
+
+Модуль не импортирует ничего из Django на верхнем уровне: процесс пула
+распаковывает ссылки на эти функции раньше, чем настроен Django.
+"""
+import os
+
+
+def setup(settings_module):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+
+def run(path, *args):
+    """Вызывает функцию по её пути и закрывает соединения с базой."""
+    from django.db import connections
+    from django.utils.module_loading import import_string
+
+    try:
+        return import_string(path)(*args)
+    finally:
+        connections.close_all()
@@ -1,4 +1,19 @@
+import pytest
+
 pytest_plugins = [
     'tests.fixtures.fixture_user',
     'tests.fixtures.fixture_data',
 ]
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    from django.core.cache import cache
+    cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def inline_thumbnails(settings):
+    # Процессы пула настраивают Django заново и открыли бы рабочую базу
+    # вместо тестовой: миниатюры строятся в процессе теста.
+    settings.THUMBNAIL_WORKERS = 0
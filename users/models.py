@@ -1,3 +1,33 @@
+from django.contrib.auth import get_user_model
 from django.db import models
 
-# Create your models here.
+User = get_user_model()
+
+
+class Profile(models.Model):
+    """Счётчики пользователя, которые выводит карточка автора.
+
+    Хранятся отдельно, чтобы не считать COUNT(*) на каждой странице.
+    Обновляются вместе с подписками и постами, расхождения исправляет
+    команда reconcile_counters.
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        related_name='profile'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Подписчиков'
+    )
+    following_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Подписок'
+    )
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Записей'
+    )
+
+    def __str__(self):
+        return str(self.user)
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Profile, User
+
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, **kwargs):
+    """У каждого пользователя есть профиль со счётчиками."""
+    if created:
+        Profile.objects.get_or_create(user=instance)
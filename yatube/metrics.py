@@ -0,0 +1,384 @@
+"""Метрики запросов в формате Prometheus.
+
+MetricsMiddleware считает для каждого view время ответа (гистограмма),
+число и время SQL-запросов, время рендеринга шаблонов, число и время
+обращений к кэшу, исход кэша страниц (заголовок X-Cache), статусы
+и размер ответов. Счётчики копятся в памяти процесса, текст для
+Prometheus собирается только при обращении к metrics_view, поэтому
+без сбора метрик запрос платит лишь за несколько сложений.
+
+Под несколькими воркерами фоновый поток каждого процесса раз в
+settings.METRICS_FLUSH_INTERVAL секунд сохраняет его счётчики в
+settings.METRICS_DIR (если они изменились), и metrics_view складывает
+файлы всех процессов. Сами запросы на диск не пишут.
+
+Читать метрики можно только с адресов settings.METRICS_ALLOWED_IPS и
+с заголовком «Authorization: Bearer <settings.METRICS_TOKEN>». За
+обратным прокси все запросы приходят с его адреса, поэтому без токена
+метрики отдаются только при DEBUG.
+"""
+import contextlib
+import contextvars
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache
+from django.db import connections
+from django.http import Http404, HttpResponse
+from django.template.backends.django import Template
+from django.utils.crypto import constant_time_compare
+
+from posts import thumbnails
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+CACHE_METHODS = (
+    'add', 'get', 'set', 'touch', 'delete', 'get_many', 'has_key', 'incr',
+    'set_many', 'delete_many',
+)
+
+HELP = {
+    'yatube_request_duration_seconds': ('histogram', 'Время ответа view.'),
+    'yatube_responses_total': ('counter', 'Ответы по статусам.'),
+    'yatube_response_bytes_total': ('counter', 'Размер тел ответов.'),
+    'yatube_sql_queries_total': ('counter', 'SQL-запросы.'),
+    'yatube_sql_duration_seconds_total': ('counter', 'Время SQL-запросов.'),
+    'yatube_template_duration_seconds_total': (
+        'counter', 'Время рендеринга шаблонов.'
+    ),
+    'yatube_cache_calls_total': ('counter', 'Обращения к кэшу.'),
+    'yatube_cache_duration_seconds_total': (
+        'counter', 'Время обращений к кэшу.'
+    ),
+    'yatube_view_cache_total': ('counter', 'Исходы кэша страниц.'),
+    'yatube_thumbnails_total': (
+        'counter', 'Сэкономленные поиски миниатюр.'
+    ),
+}
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Счётчики одного запроса."""
+
+    __slots__ = ('queries', 'sql', 'templates', 'cache_calls', 'cache',
+                 'rendering', 'in_cache')
+
+    def __init__(self):
+        self.queries = 0
+        self.sql = 0.0
+        self.templates = 0.0
+        self.cache_calls = 0
+        self.cache = 0.0
+        # Вложенные вызовы (include, get_many через get) уже учтены
+        # во внешнем.
+        self.rendering = False
+        self.in_cache = False
+
+
+class Registry:
+    """Счётчики и гистограммы процесса."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Процесс, в котором запущен поток сохранения: после fork
+        # воркеру нужен свой.
+        self.flusher_pid = None
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.counters = defaultdict(float)
+            self.histograms = {}
+            self.dirty = False
+
+    def record(self, view, status, seconds, size, metrics, cache_state):
+        labels = (('view', view),)
+        if self.flusher_pid != os.getpid() and settings.METRICS_DIR:
+            self.start_flusher()
+        with self.lock:
+            self.dirty = True
+            counters = self.counters
+            counters['yatube_responses_total', labels + (
+                ('status', str(status)),
+            )] += 1
+            counters['yatube_response_bytes_total', labels] += size
+            counters['yatube_sql_queries_total', labels] += metrics.queries
+            counters['yatube_sql_duration_seconds_total', labels] += (
+                metrics.sql
+            )
+            counters['yatube_template_duration_seconds_total', labels] += (
+                metrics.templates
+            )
+            counters['yatube_cache_calls_total', labels] += (
+                metrics.cache_calls
+            )
+            counters['yatube_cache_duration_seconds_total', labels] += (
+                metrics.cache
+            )
+            if cache_state:
+                counters['yatube_view_cache_total', labels + (
+                    ('outcome', cache_state),
+                )] += 1
+            histogram = self.histograms.setdefault(
+                view, [0] * (len(BUCKETS) + 2)
+            )
+            for index, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram[index] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def snapshot(self):
+        """Счётчики процесса в виде, пригодном для JSON."""
+        with self.lock:
+            counters = [
+                [name, dict(labels), value]
+                for (name, labels), value in self.counters.items()
+            ]
+            histograms = {
+                view: list(values)
+                for view, values in self.histograms.items()
+            }
+        counters.extend(
+            ['yatube_thumbnails_total', {'kind': kind}, value]
+            for kind, value in thumbnails.METRICS.items()
+        )
+        return {'counters': counters, 'histograms': histograms}
+
+    def start_flusher(self):
+        """Запускает поток, сохраняющий снимок процесса раз в интервал."""
+        with self.lock:
+            if self.flusher_pid == os.getpid():
+                return
+            self.flusher_pid = os.getpid()
+        threading.Thread(
+            target=self._flush_loop, name='metrics-flush', daemon=True
+        ).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+            if self.dirty:
+                self.flush()
+
+    def flush(self):
+        """Сохраняет снимок процесса в METRICS_DIR."""
+        directory = settings.METRICS_DIR
+        if not directory:
+            return
+        self.dirty = False
+        os.makedirs(directory, exist_ok=True)
+        handle, path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(handle, 'w') as output:
+            json.dump(self.snapshot(), output)
+        os.replace(
+            path, os.path.join(directory, '{}.json'.format(os.getpid()))
+        )
+
+
+registry = Registry()
+
+
+def snapshots():
+    """Снимки всех процессов: из METRICS_DIR и свежий свой."""
+    own = registry.snapshot()
+    directory = settings.METRICS_DIR
+    if not directory or not os.path.isdir(directory):
+        return [own]
+    result = [own]
+    own_file = '{}.json'.format(os.getpid())
+    for name in os.listdir(directory):
+        if not name.endswith('.json') or name == own_file:
+            continue
+        try:
+            with open(os.path.join(directory, name)) as source:
+                result.append(json.load(source))
+        except (OSError, ValueError):
+            continue
+    return result
+
+
+def label_text(labels):
+    return ','.join(
+        '{}="{}"'.format(
+            key, str(value).replace('\\', '\\\\').replace('"', '\\"')
+        )
+        for key, value in sorted(labels.items())
+    )
+
+
+def exposition(parts):
+    """Текст в формате Prometheus из снимков процессов."""
+    counters = defaultdict(float)
+    histograms = {}
+    for part in parts:
+        for name, labels, value in part['counters']:
+            counters[name, label_text(labels)] += value
+        for view, values in part['histograms'].items():
+            total = histograms.setdefault(view, [0] * len(values))
+            for index, value in enumerate(values):
+                total[index] += value
+    lines = []
+    by_name = defaultdict(list)
+    for (name, labels), value in sorted(counters.items()):
+        by_name[name].append((labels, value))
+    if histograms:
+        by_name['yatube_request_duration_seconds'] = []
+    for name in sorted(by_name):
+        kind, text = HELP[name]
+        lines.append('# HELP {} {}'.format(name, text))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        if kind == 'histogram':
+            for view, values in sorted(histograms.items()):
+                labels = label_text({'view': view})
+                for bound, value in zip(BUCKETS, values):
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                        name, labels, bound, value
+                    ))
+                lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(
+                    name, labels, values[-1]
+                ))
+                lines.append('{}_sum{{{}}} {}'.format(
+                    name, labels, values[-2]
+                ))
+                lines.append('{}_count{{{}}} {}'.format(
+                    name, labels, values[-1]
+                ))
+            continue
+        for labels, value in by_name[name]:
+            lines.append('{}{{{}}} {}'.format(name, labels, value))
+    return '\n'.join(lines) + '\n'
+
+
+def allowed(request):
+    """Можно ли отдать метрики: адрес из списка и верный токен."""
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return False
+    token = settings.METRICS_TOKEN
+    if not token:
+        return settings.DEBUG
+    return constant_time_compare(
+        request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer ' + token
+    )
+
+
+def metrics_view(request):
+    """Метрики для Prometheus (см. allowed)."""
+    if not allowed(request):
+        raise Http404
+    return HttpResponse(
+        exposition(snapshots()),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+def _time_sql(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.sql += time.perf_counter() - start
+
+
+def _timed_render(render):
+    @wraps(render)
+    def wrapper(self, *args, **kwargs):
+        metrics = _current.get()
+        if metrics is None or metrics.rendering:
+            return render(self, *args, **kwargs)
+        metrics.rendering = True
+        start = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            metrics.rendering = False
+            metrics.templates += time.perf_counter() - start
+    wrapper.timed = True
+    return wrapper
+
+
+def _timed_cache(method):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        metrics = _current.get()
+        if metrics is None or metrics.in_cache:
+            return method(self, *args, **kwargs)
+        metrics.in_cache = True
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            metrics.in_cache = False
+            metrics.cache_calls += 1
+            metrics.cache += time.perf_counter() - start
+    wrapper.timed = True
+    return wrapper
+
+
+def _subclasses(cls):
+    for subclass in cls.__subclasses__():
+        yield subclass
+        yield from _subclasses(subclass)
+
+
+def install():
+    """Оборачивает рендеринг шаблонов и методы бэкендов кэша.
+
+    Вне запроса (и без MetricsMiddleware) обёртки сразу вызывают
+    исходный метод.
+    """
+    if not getattr(Template.render, 'timed', False):
+        Template.render = _timed_render(Template.render)
+    # Бэкенды кэша импортируются при первом обращении к ним.
+    for alias in settings.CACHES:
+        caches[alias]
+    for cls in (BaseCache, *_subclasses(BaseCache)):
+        for name in CACHE_METHODS:
+            method = cls.__dict__.get(name)
+            if method is not None and not getattr(method, 'timed', False):
+                setattr(cls, name, _timed_cache(method))
+
+
+class MetricsMiddleware:
+    """Собирает метрики каждого запроса в registry."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install()
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            with contextlib.ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(_time_sql)
+                    )
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        seconds = time.perf_counter() - start
+        match = request.resolver_match
+        registry.record(
+            match.view_name if match else 'unmatched',
+            response.status_code,
+            seconds,
+            0 if response.streaming else len(response.content),
+            metrics,
+            response.get('X-Cache')
+        )
+        return response
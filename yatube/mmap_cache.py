@@ -0,0 +1,435 @@
+"""Кэш в общем файле, отображённом в память (mmap).
+
+Все процессы-воркеры на одной машине открывают один и тот же файл, так
+что закэшированные страницы хранятся в одном экземпляре, а инвалидация
+в одном процессе сразу видна остальным. Внешний сервер не нужен.
+
+Устройство файла:
+
+* заголовок — геометрия файла и счётчики;
+* хэш-таблица с открытой адресацией на MAX_ENTRIES записей;
+* область данных, куда записи дописываются подряд. Когда место
+  кончается, давно не читанные записи (LRU) вытесняются пачкой, до
+  EVICT_LOW_WATER от размера области и числа записей, а живые записи
+  сдвигаются к началу области (уплотнение). Уплотнение и вытеснение
+  проходят по всей таблице, поэтому запускаются редко: после них
+  свободна заметная часть области, и следующие записи просто
+  дописываются в конец.
+
+Каждая операция выполняется под эксклюзивной блокировкой flock на файл
+(между процессами) и threading.Lock (между потоками одного процесса).
+
+Пример настройки:
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'yatube.mmap_cache.MmapCache',
+            'LOCATION': '/var/tmp/yatube.cache',
+            'OPTIONS': {
+                'MAX_SIZE': 64 * 1024 * 1024,
+                'MAX_ENTRIES': 20000,
+                'COMPRESS_MIN_SIZE': 1024,
+            },
+        },
+    }
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+MAGIC = b'YTMC'
+FORMAT_VERSION = 1
+
+# magic, версия, слотов, размер области данных, занято в области данных,
+# счётчик обращений (часы LRU), байт в живых записях, живых записей,
+# надгробий в хэш-таблице.
+HEADER = struct.Struct('<4sIIQQQQII')
+HEADER_SIZE = 64
+
+# хэш ключа, смещение записи, длина записи, состояние, срок жизни
+# (0 — бессрочно), время последнего обращения по часам LRU.
+SLOT = struct.Struct('<QQIB3xdQ')
+EMPTY, USED, DELETED = 0, 1, 2
+
+# длина ключа, флаги значения.
+RECORD = struct.Struct('<IB')
+COMPRESSED = 1
+
+# До какой доли размера области и MAX_ENTRIES вытесняются записи, когда
+# кэш заполнен.
+EVICT_LOW_WATER = 0.8
+# Уплотнение освобождает только место удалённых и перезаписанных
+# записей. Если их меньше этой доли области, сначала вытесняются записи,
+# иначе уплотнение пришлось бы повторять почти на каждой записи.
+COMPACT_MIN_GARBAGE = 0.1
+
+
+class MmapCache(BaseCache):
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        if 'MAX_ENTRIES' not in options and 'max_entries' not in params:
+            self._max_entries = 10000
+        self._path = location
+        self._data_size = int(options.get('MAX_SIZE', 64 * 1024 * 1024))
+        self._compress_min_size = int(options.get('COMPRESS_MIN_SIZE', 1024))
+        self._compress_level = int(options.get('COMPRESS_LEVEL', 6))
+        self._slots = self._max_entries * 4 // 3 + 1
+        self._table_offset = HEADER_SIZE
+        self._data_offset = HEADER_SIZE + self._slots * SLOT.size
+        self._thread_lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._map = None
+
+    # Файл и блокировки.
+
+    def _open(self):
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = self._data_offset + self._data_size
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size != size:
+                os.ftruncate(self._fd, size)
+            self._map = mmap.mmap(self._fd, size)
+            header = HEADER.unpack_from(self._map, 0)
+            if header[:4] != (
+                MAGIC, FORMAT_VERSION, self._slots, self._data_size
+            ):
+                self._reset()
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._pid = os.getpid()
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            # После fork дескриптор общий с родителем, и flock на нём
+            # не разделяет процессы: дочерний процесс открывает файл заново.
+            if self._pid != os.getpid():
+                self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self, **kwargs):
+        # Django закрывает кэши после каждого запроса, а отображение
+        # файла должно жить всё время работы процесса.
+        pass
+
+    # Заголовок и слоты.
+
+    def _reset(self):
+        self._map[:self._data_offset] = bytes(self._data_offset)
+        self._write_header(0, 0, 0, 0, 0)
+
+    def _read_header(self):
+        _, _, _, _, used, clock, live, count, deleted = HEADER.unpack_from(
+            self._map, 0
+        )
+        return [used, clock, live, count, deleted]
+
+    def _write_header(self, used, clock, live, count, deleted):
+        HEADER.pack_into(
+            self._map, 0, MAGIC, FORMAT_VERSION, self._slots,
+            self._data_size, used, clock, live, count, deleted
+        )
+
+    def _slot(self, index):
+        return list(SLOT.unpack_from(
+            self._map, self._table_offset + index * SLOT.size
+        ))
+
+    def _write_slot(self, index, slot):
+        SLOT.pack_into(
+            self._map, self._table_offset + index * SLOT.size, *slot
+        )
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(
+            hashlib.blake2b(key, digest_size=8).digest(), 'little'
+        )
+
+    def _record_key(self, slot):
+        offset = self._data_offset + slot[1]
+        key_length, _ = RECORD.unpack_from(self._map, offset)
+        start = offset + RECORD.size
+        return self._map[start:start + key_length]
+
+    def _find(self, key, key_hash):
+        """Индекс слота с ключом (или None) и первый свободный слот."""
+        free = None
+        index = key_hash % self._slots
+        for _ in range(self._slots):
+            slot = self._slot(index)
+            if slot[3] == EMPTY:
+                return None, index if free is None else free
+            if slot[3] == DELETED:
+                if free is None:
+                    free = index
+            elif slot[0] == key_hash and self._record_key(slot) == key:
+                return index, free
+            index = (index + 1) % self._slots
+        return None, free
+
+    def _expired(self, slot, now):
+        return slot[4] and slot[4] <= now
+
+    def _remove(self, index, header):
+        slot = self._slot(index)
+        header[2] -= slot[2]
+        header[3] -= 1
+        header[4] += 1
+        slot[3] = DELETED
+        self._write_slot(index, slot)
+
+    def _lookup(self, key, header):
+        """Слот живой записи по ключу; просроченная запись удаляется."""
+        index, _ = self._find(key, self._hash(key))
+        if index is None:
+            return None
+        if self._expired(self._slot(index), time.time()):
+            self._remove(index, header)
+            return None
+        return index
+
+    # Значения.
+
+    def _encode(self, value):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if self._compress_min_size and len(data) >= self._compress_min_size:
+            packed = zlib.compress(data, self._compress_level)
+            if len(packed) < len(data):
+                return packed, COMPRESSED
+        return data, 0
+
+    def _value(self, slot):
+        offset = self._data_offset + slot[1]
+        key_length, flags = RECORD.unpack_from(self._map, offset)
+        start = offset + RECORD.size + key_length
+        data = self._map[start:offset + slot[2]]
+        if flags & COMPRESSED:
+            data = zlib.decompress(data)
+        return pickle.loads(data)
+
+    def _touch_slot(self, index, header):
+        header[1] += 1
+        slot = self._slot(index)
+        slot[5] = header[1]
+        self._write_slot(index, slot)
+
+    # Размещение, уплотнение и вытеснение.
+
+    def _live_slots(self):
+        # Таблица читается одним срезом: по слоту через _slot() полный
+        # проход занимает в разы дольше.
+        table = self._map[self._table_offset:self._data_offset]
+        for index, slot in enumerate(SLOT.iter_unpack(table)):
+            if slot[3] == USED:
+                yield index, list(slot)
+
+    def _compact(self, header):
+        """Сдвигает живые записи к началу области и перестраивает таблицу."""
+        live = sorted(
+            (slot for _, slot in self._live_slots()), key=lambda s: s[1]
+        )
+        used = 0
+        for slot in live:
+            if slot[1] != used:
+                self._map.move(
+                    self._data_offset + used,
+                    self._data_offset + slot[1],
+                    slot[2]
+                )
+                slot[1] = used
+            used += slot[2]
+        self._map[self._table_offset:self._data_offset] = bytes(
+            self._data_offset - self._table_offset
+        )
+        for slot in live:
+            index = slot[0] % self._slots
+            while self._slot(index)[3] != EMPTY:
+                index = (index + 1) % self._slots
+            self._write_slot(index, slot)
+        header[0] = used
+        header[2] = used
+        header[3] = len(live)
+        header[4] = 0
+
+    def _evict(self, header, need_bytes, need_slots):
+        """Удаляет просроченные, затем давно не читанные записи.
+
+        Вытесняет, пока вместе с need_bytes и need_slots занято не больше
+        EVICT_LOW_WATER области и MAX_ENTRIES.
+        """
+        max_bytes = int(self._data_size * EVICT_LOW_WATER) - need_bytes
+        max_entries = int(self._max_entries * EVICT_LOW_WATER) - need_slots
+        now = time.time()
+        live = list(self._live_slots())
+        for index, slot in live:
+            if self._expired(slot, now):
+                self._remove(index, header)
+        live = sorted(
+            (item for item in live if not self._expired(item[1], now)),
+            key=lambda item: item[1][5]
+        )
+        for index, slot in live:
+            if header[2] <= max_bytes and header[3] <= max_entries:
+                break
+            self._remove(index, header)
+
+    def _store(self, key, value, timeout, header):
+        data, flags = self._encode(value)
+        record = RECORD.pack(len(key), flags) + key + data
+        key_hash = self._hash(key)
+        index, free = self._find(key, key_hash)
+        if index is not None:
+            self._remove(index, header)
+        if len(record) > self._data_size // 2:
+            # Слишком большие значения не кэшируются, чтобы одно из них
+            # не вытеснило всё остальное.
+            return False
+        tail_full = header[0] + len(record) > self._data_size
+        if (header[2] + len(record) > self._data_size
+                or header[3] + 1 > self._max_entries
+                or (tail_full and header[0] - header[2]
+                    < self._data_size * COMPACT_MIN_GARBAGE)):
+            self._evict(header, len(record), 1)
+        if (tail_full
+                or header[3] + header[4] + 1 > self._slots * 3 // 4):
+            self._compact(header)
+        _, free = self._find(key, key_hash)
+        offset = header[0]
+        start = self._data_offset + offset
+        self._map[start:start + len(record)] = record
+        header[0] += len(record)
+        header[1] += 1
+        header[2] += len(record)
+        header[3] += 1
+        if self._slot(free)[3] == DELETED:
+            header[4] -= 1
+        expires = self.get_backend_timeout(timeout)
+        self._write_slot(free, [
+            key_hash, offset, len(record), USED,
+            0 if expires is None else expires, header[1]
+        ])
+        return True
+
+    # API кэша Django.
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key.encode()
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        with self._locked():
+            header = self._read_header()
+            if self._lookup(key, header) is not None:
+                self._write_header(*header)
+                return False
+            stored = self._store(key, value, timeout, header)
+            self._write_header(*header)
+            return stored
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version=version).get(key, default)
+
+    def get_many(self, keys, version=None):
+        keys = {self._key(key, version): key for key in keys}
+        found = {}
+        with self._locked():
+            header = self._read_header()
+            for key, original in keys.items():
+                index = self._lookup(key, header)
+                if index is not None:
+                    self._touch_slot(index, header)
+                    found[original] = self._value(self._slot(index))
+            self._write_header(*header)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        encoded = {
+            self._key(key, version): value for key, value in data.items()
+        }
+        with self._locked():
+            header = self._read_header()
+            for key, value in encoded.items():
+                self._store(key, value, timeout, header)
+            self._write_header(*header)
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        with self._locked():
+            header = self._read_header()
+            index = self._lookup(key, header)
+            if index is not None:
+                slot = self._slot(index)
+                expires = self.get_backend_timeout(timeout)
+                slot[4] = 0 if expires is None else expires
+                self._write_slot(index, slot)
+            self._write_header(*header)
+            return index is not None
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        with self._locked():
+            header = self._read_header()
+            for key in keys:
+                index = self._lookup(key, header)
+                if index is not None:
+                    self._remove(index, header)
+            self._write_header(*header)
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        with self._locked():
+            header = self._read_header()
+            found = self._lookup(key, header) is not None
+            self._write_header(*header)
+            return found
+
+    def incr(self, key, delta=1, version=None):
+        # Чтение и запись под одной блокировкой: счётчик не теряет
+        # приращений от параллельных процессов.
+        key = self._key(key, version)
+        with self._locked():
+            header = self._read_header()
+            index = self._lookup(key, header)
+            if index is None:
+                self._write_header(*header)
+                raise ValueError("Key '%s' not found" % key.decode())
+            slot = self._slot(index)
+            value = self._value(slot) + delta
+            timeout = slot[4] - time.time() if slot[4] else None
+            self._store(key, value, timeout, header)
+            self._write_header(*header)
+            return value
+
+    def clear(self):
+        with self._locked():
+            self._reset()
@@ -0,0 +1,166 @@
+"""Выборочный профилировщик запросов для продакшена.
+
+Профилируется запрос с заголовком X-Profile, подписанным командой
+profile_requests --token, или случайная доля запросов, которую задаёт
+profile_requests --rate (доля хранится в кэше и действует во всех
+воркерах без перезапуска).
+
+Пока идёт профилируемый запрос, отдельный поток раз в
+settings.PROFILER_INTERVAL секунд снимает стек потока запроса и
+оставляет в нём кадры кода проекта, шаблонов и ORM. Стеки пишутся в
+settings.PROFILER_DIR в формате collapsed stacks (flamegraph.pl,
+speedscope): по строке «кадр;кадр;кадр число_снимков». Остальные
+запросы платят только за проверку заголовка и случайное число.
+"""
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+
+HEADER = 'HTTP_X_PROFILE'
+RATE_KEY = 'profiler:rate'
+TOKEN_SALT = 'yatube.profiling'
+TOKEN_VALUE = 'profile'
+
+# Модули, кадры которых попадают в стеки: view и прочий код проекта,
+# шаблоны и ORM. Сам профилировщик и обёртки метрик не показываются.
+KEEP_MODULES = ('posts.', 'users.', 'yatube.', 'django.template.',
+                'django.db.')
+SKIP_MODULES = ('yatube.profiling', 'yatube.metrics')
+
+_rate = {'value': 0.0, 'checked': float('-inf')}
+
+
+def make_token():
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(TOKEN_VALUE)
+
+
+def valid_token(token):
+    try:
+        value = signing.TimestampSigner(salt=TOKEN_SALT).unsign(
+            token, max_age=settings.PROFILER_TOKEN_MAX_AGE
+        )
+    except signing.BadSignature:
+        return False
+    return value == TOKEN_VALUE
+
+
+def set_rate(rate, timeout):
+    """Включает профилирование доли rate запросов на timeout секунд."""
+    if rate:
+        cache.set(RATE_KEY, rate, timeout)
+    else:
+        cache.delete(RATE_KEY)
+
+
+def current_rate():
+    """Доля профилируемых запросов, из кэша не чаще раза в секунду."""
+    now = time.monotonic()
+    if now - _rate['checked'] >= settings.PROFILER_RATE_REFRESH:
+        _rate['value'] = cache.get(RATE_KEY, settings.PROFILER_SAMPLE_RATE)
+        _rate['checked'] = now
+    return _rate['value']
+
+
+def frame_label(frame):
+    """Подпись кадра «модуль:функция» или None для пропускаемых кадров."""
+    module = frame.f_globals.get('__name__', '')
+    if (not module.startswith(KEEP_MODULES)
+            or module.startswith(SKIP_MODULES)):
+        return None
+    code = frame.f_code
+    name = code.co_name
+    # co_qualname есть только с Python 3.11: класс метода берётся из
+    # его первого аргумента.
+    if code.co_argcount and code.co_varnames[0] in ('self', 'cls'):
+        owner = frame.f_locals.get(code.co_varnames[0])
+        if owner is not None:
+            if not isinstance(owner, type):
+                owner = type(owner)
+            name = '{}.{}'.format(owner.__name__, name)
+    return '{}:{}'.format(module, name)
+
+
+def collapse(frame):
+    """Стек от корня к листу через «;», только нужные кадры."""
+    labels = []
+    while frame is not None:
+        label = frame_label(frame)
+        if label is not None:
+            labels.append(label)
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class Sampler(threading.Thread):
+    """Поток, снимающий стек потока thread_id каждые interval секунд."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='profiler-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = collapse(frame) if frame is not None else ''
+            if stack:
+                self.samples[stack] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def write(view, samples):
+    """Пишет стеки запроса в файл PROFILER_DIR, возвращает его имя."""
+    os.makedirs(settings.PROFILER_DIR, exist_ok=True)
+    name = '{}-{}-{}-{}.collapsed'.format(
+        time.strftime('%Y%m%d-%H%M%S'),
+        re.sub(r'[^\w.-]', '-', view),
+        os.getpid(),
+        threading.get_ident()
+    )
+    with open(os.path.join(settings.PROFILER_DIR, name), 'w') as output:
+        for stack, count in samples.most_common():
+            output.write('{};{} {}\n'.format(view, stack, count))
+    return name
+
+
+class ProfilerMiddleware:
+    """Профилирует запросы с подписанным X-Profile и долю остальных."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def should_profile(self, request):
+        token = request.META.get(HEADER)
+        if token is not None:
+            return valid_token(token)
+        rate = current_rate()
+        return bool(rate) and random.random() < rate
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+        sampler = Sampler(threading.get_ident(), settings.PROFILER_INTERVAL)
+        sampler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            sampler.stop()
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        name = write(view, sampler.samples)
+        if request.META.get(HEADER) is not None:
+            response['X-Profile-File'] = name
+        return response
@@ -29,8 +29,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'yatube.metrics.MetricsMiddleware',
+    'yatube.profiling.ProfilerMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'posts.replicas.PrimaryPinMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -64,9 +67,24 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+    },
+    # Реплика для локальной проверки чтения с реплик: копия db.sqlite3,
+    # которую обновляет команда sync_replica. Используется, только если
+    # указана в DATABASE_REPLICAS.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.replica.sqlite3'),
+    },
 }
 
+DATABASE_ROUTERS = ['posts.replicas.ReplicaRouter']
+
+# Алиасы реплик, с которых читают ленты, и сколько секунд после записи
+# пользователь читает основную базу. Это же время считается наибольшим
+# отставанием реплики.
+DATABASE_REPLICAS = []
+REPLICA_PIN_TIMEOUT = 5
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME':
@@ -102,6 +120,12 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Картинки постов пишутся на диск частями, загрузка прерывается после
+# UPLOAD_MAX_SIZE байт, картинки больше UPLOAD_MAX_MEGAPIXELS
+# отклоняются до декодирования (posts.uploads).
+UPLOAD_MAX_SIZE = 10 * 1024 * 1024
+UPLOAD_MAX_MEGAPIXELS = 40
+
 LOGIN_URL = '/auth/login/'
 LOGIN_REDIRECT_URL = 'index'
 LOGOUT_REDIRECT_URL = 'index'
@@ -115,6 +139,51 @@ CACHES = {
     }
 }
 
+# Сколько секунд хранятся закэшированные страницы. Устаревшие страницы
+# сбрасываются сразу по тегам, срок нужен только чтобы чистить кэш.
+VIEW_CACHE_TIMEOUT = 60 * 60
+
+# Сколько секунд после срока можно отдавать старую страницу, пока один
+# воркер строит новую, сколько живёт блокировка перестроения и сколько
+# остальные воркеры ждут страницу, сброшенную по тегам.
+VIEW_CACHE_STALE_TIMEOUT = 60
+VIEW_CACHE_LOCK_TIMEOUT = 10
+VIEW_CACHE_LOCK_WAIT = 2
+VIEW_CACHE_LOCK_POLL = 0.05
+
+# Сколько секунд паджинатор доверяет закэшированному числу записей
+# и с какого размера таблицы число записей оценивается без COUNT(*).
+PAGINATOR_COUNT_TIMEOUT = 60
+PAGINATOR_ESTIMATE_THRESHOLD = 10000
+
+# Авторы, у которых подписчиков больше этого числа, не раскладывают
+# свои посты по лентам подписчиков: лента подмешивает их при чтении.
+TIMELINE_CELEBRITY_FOLLOWERS = 1000
+
+# Сколько процессов строят миниатюры картинок в фоне. При 0 миниатюры
+# строятся в процессе запроса сразу после сохранения поста.
+THUMBNAIL_WORKERS = 2
+
+# Метрики для Prometheus (/metrics/): с каких адресов и с каким токеном
+# (заголовок «Authorization: Bearer <токен>») их можно читать, куда
+# процессы сохраняют свои счётчики (None — только в памяти, для одного
+# процесса) и как часто. Без токена метрики отдаются только при DEBUG.
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+METRICS_TOKEN = None
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 1
+
+# Выборочный профилировщик (yatube.profiling): доля профилируемых
+# запросов по умолчанию (команда profile_requests меняет её на ходу,
+# проверка не чаще раза в PROFILER_RATE_REFRESH секунд), интервал между
+# снимками стека, срок жизни подписанных заголовков X-Profile и каталог
+# для файлов со стеками.
+PROFILER_SAMPLE_RATE = 0
+PROFILER_RATE_REFRESH = 1
+PROFILER_INTERVAL = 0.01
+PROFILER_TOKEN_MAX_AGE = 60 * 60
+PROFILER_DIR = os.path.join(BASE_DIR, 'cache', 'profiles')
+
 INTERNAL_IPS = [
     '127.0.0.1',
 ]
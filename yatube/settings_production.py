@@ -0,0 +1,62 @@
+"""Настройки для запуска под несколькими воркерами WSGI.
+
+    DJANGO_SETTINGS_MODULE=yatube.settings_production gunicorn -w 4 yatube.wsgi
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, os
+
+DEBUG = False
+
+# WAL: читатели не ждут писателя, а писатель — читателей. Соединение
+# живёт между запросами (CONN_MAX_AGE), поэтому PRAGMA выполняются
+# один раз на соединение, а не на каждый запрос.
+DATABASES = {
+    'default': {
+        'ENGINE': 'yatube.sqlite_backend',
+        'NAME': os.environ.get(
+            'YATUBE_DB_FILE', os.path.join(BASE_DIR, 'db.sqlite3')
+        ),
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            'init_command': (
+                'PRAGMA journal_mode = WAL;'
+                'PRAGMA synchronous = NORMAL;'
+                'PRAGMA busy_timeout = 5000;'
+                'PRAGMA mmap_size = 268435456;'
+                'PRAGMA cache_size = -65536;'
+                'PRAGMA temp_store = MEMORY'
+            ),
+            'transaction_mode': 'IMMEDIATE',
+            'retries': 3,
+        },
+    }
+}
+
+# Один кэш на все процессы машины: страница, закэшированная одним
+# воркером, отдаётся всеми, а инвалидация по тегам видна сразу всем.
+CACHES = {
+    'default': {
+        'BACKEND': 'yatube.mmap_cache.MmapCache',
+        'LOCATION': os.environ.get(
+            'YATUBE_CACHE_FILE', os.path.join(BASE_DIR, 'cache', 'yatube')
+        ),
+        'OPTIONS': {
+            'MAX_SIZE': 128 * 1024 * 1024,
+            'MAX_ENTRIES': 50000,
+            'COMPRESS_MIN_SIZE': 1024,
+        },
+    }
+}
+
+# Счётчики метрик воркеров складываются из файлов в этом каталоге.
+METRICS_DIR = os.environ.get(
+    'YATUBE_METRICS_DIR', os.path.join(BASE_DIR, 'cache', 'metrics')
+)
+# Токен Prometheus (bearer_token в scrape_config); без него /metrics/
+# недоступен.
+METRICS_TOKEN = os.environ.get('YATUBE_METRICS_TOKEN')
+
+# Стеки профилируемых запросов (команда profile_requests).
+PROFILER_DIR = os.environ.get(
+    'YATUBE_PROFILER_DIR', os.path.join(BASE_DIR, 'cache', 'profiles')
+)
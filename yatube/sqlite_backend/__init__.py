@@ -0,0 +1,5 @@
+"""Бэкенд SQLite для продакшена: PRAGMA при подключении, BEGIN IMMEDIATE
+и повтор запросов при «database is locked».
+
+    DATABASES = {'default': {'ENGINE': 'yatube.sqlite_backend', ...}}
+"""
@@ -0,0 +1,84 @@
+import random
+import time
+
+from django.db.backends.sqlite3 import base
+
+Database = base.Database
+
+
+def is_locked(error):
+    return 'database is locked' in str(error)
+
+
+class SQLiteCursorWrapper(base.SQLiteCursorWrapper):
+    """Курсор, повторяющий запрос, если база занята другим писателем.
+
+    Повторяется только запрос вне транзакции (в том числе сам BEGIN):
+    внутри транзакции уже прочитанные данные могли устареть, и повторять
+    надо всю транзакцию, а не один запрос.
+    """
+
+    retries = 0
+    retry_delay = 0.05
+
+    def execute(self, query, params=None):
+        return self._retry(super().execute, query, params)
+
+    def executemany(self, query, param_list):
+        return self._retry(super().executemany, query, param_list)
+
+    def _retry(self, method, *args):
+        attempt = 0
+        while True:
+            try:
+                return method(*args)
+            except Database.OperationalError as error:
+                if (attempt >= self.retries or not is_locked(error)
+                        or self.connection.in_transaction):
+                    raise
+            # Случайная задержка, чтобы ждущие писатели не просыпались
+            # одновременно.
+            time.sleep(self.retry_delay * 2 ** attempt * random.random())
+            attempt += 1
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """SQLite с настройкой соединения из OPTIONS.
+
+    Кроме параметров sqlite3.connect, OPTIONS понимает:
+
+    * init_command — PRAGMA через «;», выполняются на каждом новом
+      соединении (journal_mode, synchronous, mmap_size и т. д.);
+    * transaction_mode — режим BEGIN у transaction.atomic. IMMEDIATE
+      берёт блокировку записи в начале транзакции, и занятая база
+      ожидается по busy_timeout, а не обрывает транзакцию посередине;
+    * retries — сколько раз повторить запрос вне транзакции при
+      «database is locked».
+    """
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        self.init_commands = [
+            command.strip()
+            for command in kwargs.pop('init_command', '').split(';')
+            if command.strip()
+        ]
+        self.transaction_mode = kwargs.pop('transaction_mode', None)
+        self.retries = kwargs.pop('retries', 0)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for command in self.init_commands:
+            conn.execute(command)
+        return conn
+
+    def create_cursor(self, name=None):
+        cursor = self.connection.cursor(factory=SQLiteCursorWrapper)
+        cursor.retries = self.retries
+        return cursor
+
+    def _start_transaction_under_autocommit(self):
+        if self.transaction_mode is None:
+            return super()._start_transaction_under_autocommit()
+        self.cursor().execute('BEGIN {}'.format(self.transaction_mode))
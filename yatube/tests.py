@@ -1,4 +1,22 @@
-from django.test import Client, TestCase
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connections, transaction
+from django.test import Client, RequestFactory, TestCase, override_settings
+
+from . import metrics, profiling
+from .mmap_cache import MmapCache
+from .sqlite_backend.base import DatabaseWrapper
 
 
 class TestUrl(TestCase):
@@ -13,3 +31,414 @@ class TestUrl(TestCase):
             404,
             msg='Страница 404 не отображается'
         )
+
+
+class MmapCacheTest(TestCase):
+    """Тесты общего кэша в файле, отображённом в память."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cache = self.make_cache()
+
+    def make_cache(self, **options):
+        options.setdefault('MAX_SIZE', 64 * 1024)
+        options.setdefault('MAX_ENTRIES', 100)
+        return MmapCache(
+            os.path.join(self.directory, 'cache'), {'OPTIONS': options}
+        )
+
+    def test_set_get_delete(self):
+        self.cache.set('key', {'value': [1, 2]})
+        self.assertEqual(self.cache.get('key'), {'value': [1, 2]})
+        self.assertTrue(self.cache.has_key('key'))
+        self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+        self.assertEqual(self.cache.get('key', 'default'), 'default')
+
+    def test_add_and_incr(self):
+        self.assertTrue(self.cache.add('counter', 1))
+        self.assertFalse(self.cache.add('counter', 5))
+        self.assertEqual(self.cache.incr('counter', 2), 3)
+        self.assertEqual(self.cache.get('counter'), 3)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_expiry(self):
+        self.cache.set('short', 'value', 0.05)
+        self.cache.set('forever', 'value', None)
+        time.sleep(0.1)
+        self.assertIsNone(self.cache.get('short'))
+        self.assertEqual(self.cache.get('forever'), 'value')
+
+    def test_shared_between_instances(self):
+        """Второй экземпляр (как другой воркер) видит те же данные."""
+        other = self.make_cache()
+        self.cache.set('key', 'value')
+        self.assertEqual(other.get('key'), 'value')
+        other.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_shared_between_processes(self):
+        """Записи дочернего процесса видны родителю и наоборот."""
+        self.cache.set('parent', 'value')
+        context = multiprocessing.get_context('fork')
+        process = context.Process(target=_child_set, args=(self.cache,))
+        process.start()
+        process.join(10)
+        self.assertEqual(process.exitcode, 0)
+        self.assertEqual(self.cache.get('child'), 'parent:value')
+
+    def test_lru_eviction_by_size(self):
+        """Переполнение вытесняет записи, которые давно не читали."""
+        value = 'x' * 4096
+        cache = self.make_cache(MAX_SIZE=32 * 1024, COMPRESS_MIN_SIZE=0)
+        for i in range(6):
+            cache.set('key{}'.format(i), value)
+        cache.get('key0')
+        for i in range(6, 10):
+            cache.set('key{}'.format(i), value)
+        self.assertEqual(cache.get('key0'), value)
+        self.assertIsNone(cache.get('key1'))
+        self.assertEqual(cache.get('key9'), value)
+
+    def test_eviction_in_batches(self):
+        """Полный кэш вытесняет и уплотняет пачкой, а не на каждой записи."""
+        value = 'x' * 4096
+        cache = self.make_cache(MAX_SIZE=256 * 1024, COMPRESS_MIN_SIZE=0)
+        for i in range(100):
+            cache.set('fill{}'.format(i), value)
+        patcher = mock.patch.object(
+            cache, '_compact', wraps=cache._compact
+        )
+        with patcher as compact:
+            for i in range(100):
+                cache.set('key{}'.format(i), value)
+        self.assertLessEqual(compact.call_count, 10)
+        self.assertEqual(cache.get('key99'), value)
+
+    def test_eviction_by_entries(self):
+        cache = self.make_cache(MAX_ENTRIES=10)
+        for i in range(50):
+            cache.set('key{}'.format(i), i)
+        found = cache.get_many(['key{}'.format(i) for i in range(50)])
+        self.assertLessEqual(len(found), 10)
+        self.assertEqual(found['key49'], 49)
+
+    def test_compression(self):
+        """Большие значения сжимаются и читаются без изменений."""
+        value = 'большая страница ' * 2000
+        compressed = self.make_cache(MAX_SIZE=16 * 1024)
+        plain = self.make_cache(MAX_SIZE=16 * 1024, COMPRESS_MIN_SIZE=0)
+        compressed.set('page', value)
+        self.assertEqual(compressed.get('page'), value)
+        plain.clear()
+        plain.set('page', value)
+        self.assertIsNone(plain.get('page'))
+
+    def test_clear(self):
+        self.cache.set_many({'a': 1, 'b': 2})
+        self.cache.clear()
+        self.assertEqual(self.cache.get_many(['a', 'b']), {})
+
+
+class SQLiteBackendTest(TestCase):
+    """Тесты продакшен-бэкенда SQLite на временном файле."""
+
+    alias = 'sqlite_backend_test'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'db.sqlite3')
+
+    def make_wrapper(self, **options):
+        options.setdefault('init_command', 'PRAGMA journal_mode = WAL')
+        wrapper = DatabaseWrapper({
+            'ENGINE': 'yatube.sqlite_backend',
+            'NAME': self.path,
+            'OPTIONS': options,
+            'ATOMIC_REQUESTS': False,
+            'AUTOCOMMIT': True,
+            'CONN_MAX_AGE': 0,
+            'TIME_ZONE': None,
+            'USER': '',
+            'PASSWORD': '',
+            'HOST': '',
+            'PORT': '',
+        }, self.alias)
+        connections[self.alias] = wrapper
+        self.addCleanup(wrapper.close)
+        wrapper.cursor().execute(
+            'CREATE TABLE IF NOT EXISTS item (id INTEGER PRIMARY KEY)'
+        )
+        return wrapper
+
+    def other_connection(self):
+        other = sqlite3.connect(
+            self.path,
+            timeout=0,
+            isolation_level=None,
+            check_same_thread=False
+        )
+        self.addCleanup(other.close)
+        return other
+
+    def test_init_command(self):
+        """PRAGMA из init_command выполняются на новом соединении."""
+        wrapper = self.make_wrapper(init_command=(
+            'PRAGMA journal_mode = WAL; PRAGMA synchronous = NORMAL;'
+            'PRAGMA cache_size = -2048;'
+        ))
+        with wrapper.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -2048)
+
+    def test_immediate_transaction(self):
+        """atomic сразу берёт блокировку записи, читать она не мешает."""
+        self.make_wrapper(transaction_mode='IMMEDIATE')
+        other = self.other_connection()
+        with transaction.atomic(using=self.alias):
+            with self.assertRaisesRegex(sqlite3.OperationalError, 'locked'):
+                other.execute('INSERT INTO item DEFAULT VALUES')
+            self.assertEqual(
+                other.execute('SELECT COUNT(*) FROM item').fetchone(), (0,)
+            )
+
+    @mock.patch('random.random', return_value=1)
+    def test_retry_when_locked(self, random):
+        """Запрос вне транзакции повторяется, пока база занята."""
+        other = self.other_connection()
+        wrapper = self.make_wrapper(
+            init_command='PRAGMA busy_timeout = 0', retries=3
+        )
+        other.execute('BEGIN IMMEDIATE')
+        threading.Timer(0.1, other.execute, ['COMMIT']).start()
+        wrapper.cursor().execute('INSERT INTO item DEFAULT VALUES')
+        self.assertEqual(random.call_count, 2)
+
+    def test_no_retry_without_retries(self):
+        other = self.other_connection()
+        wrapper = self.make_wrapper(init_command='PRAGMA busy_timeout = 0')
+        other.execute('BEGIN IMMEDIATE')
+        self.addCleanup(other.execute, 'COMMIT')
+        with self.assertRaisesRegex(OperationalError, 'locked'):
+            wrapper.cursor().execute('INSERT INTO item DEFAULT VALUES')
+
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsTest(TestCase):
+    """Тесты метрик запросов для Prometheus."""
+
+    def setUp(self):
+        metrics.registry.clear()
+        self.addCleanup(metrics.registry.clear)
+        cache.clear()
+
+    def scrape(self):
+        response = self.client.get(
+            '/metrics/', HTTP_AUTHORIZATION='Bearer secret'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def value(self, text, series):
+        for line in text.splitlines():
+            if line.startswith(series + ' '):
+                return float(line.rsplit(' ', 1)[1])
+        self.fail('Нет ряда {}'.format(series))
+
+    def test_view_metrics(self):
+        """Время, SQL, шаблоны, кэш и размер ответа считаются по view."""
+        first = self.client.get('/')
+        self.client.get('/')
+        text = self.scrape()
+        view = '{view="index"}'
+        self.assertEqual(
+            self.value(text, 'yatube_request_duration_seconds_count' + view),
+            2
+        )
+        self.assertEqual(self.value(
+            text,
+            'yatube_request_duration_seconds_bucket{view="index",le="+Inf"}'
+        ), 2)
+        self.assertGreater(
+            self.value(text, 'yatube_sql_queries_total' + view), 0
+        )
+        self.assertGreater(
+            self.value(text, 'yatube_template_duration_seconds_total' + view),
+            0
+        )
+        self.assertGreater(
+            self.value(text, 'yatube_cache_calls_total' + view), 0
+        )
+        self.assertEqual(
+            self.value(text, 'yatube_response_bytes_total' + view),
+            len(first.content) * 2
+        )
+        for outcome in ('miss', 'hit'):
+            self.assertEqual(self.value(
+                text,
+                'yatube_view_cache_total{{outcome="{}",view="index"}}'.format(
+                    outcome
+                )
+            ), 1)
+        self.assertEqual(self.value(
+            text, 'yatube_responses_total{status="200",view="index"}'
+        ), 2)
+
+    def test_only_allowed_addresses(self):
+        response = self.client.get(
+            '/metrics/', REMOTE_ADDR='10.0.0.1',
+            HTTP_AUTHORIZATION='Bearer secret'
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_token_required(self):
+        """С адреса прокси метрики без верного токена не отдаются."""
+        for header in ('', 'Bearer wrong', 'secret'):
+            with self.subTest(header=header):
+                response = self.client.get(
+                    '/metrics/', HTTP_AUTHORIZATION=header
+                )
+                self.assertEqual(response.status_code, 404)
+        with override_settings(METRICS_TOKEN=None):
+            self.assertEqual(
+                self.client.get('/metrics/').status_code, 404
+            )
+            # Сам view с DEBUG не запрашивается: в DEBUG включается
+            # debug toolbar.
+            with override_settings(DEBUG=True):
+                self.assertTrue(
+                    metrics.allowed(RequestFactory().get('/metrics/'))
+                )
+
+    def test_processes_summed(self):
+        """Счётчики других процессов из METRICS_DIR складываются."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        other = {
+            'counters': [
+                ['yatube_sql_queries_total', {'view': 'index'}, 5],
+            ],
+            'histograms': {
+                'index': [1] * len(metrics.BUCKETS) + [0.001, 1],
+            },
+        }
+        with open(os.path.join(directory, '1.json'), 'w') as output:
+            json.dump(other, output)
+        own = os.path.join(directory, '{}.json'.format(os.getpid()))
+        with override_settings(METRICS_DIR=directory,
+                               METRICS_FLUSH_INTERVAL=0.01):
+            self.client.get('/')
+            text = self.scrape()
+            deadline = time.monotonic() + 5
+            while not os.path.exists(own) and time.monotonic() < deadline:
+                time.sleep(0.01)
+        view = '{view="index"}'
+        self.assertEqual(
+            self.value(text, 'yatube_request_duration_seconds_count' + view),
+            2
+        )
+        self.assertGreater(
+            self.value(text, 'yatube_sql_queries_total' + view), 5
+        )
+        self.assertTrue(os.path.exists(own))
+
+
+@override_settings(PROFILER_INTERVAL=0.001, PROFILER_RATE_REFRESH=0)
+class ProfilerTest(TestCase):
+    """Тесты выборочного профилировщика."""
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings = override_settings(PROFILER_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # Без задержки главная страница может уложиться в один интервал.
+        patcher = mock.patch(
+            'posts.views.thumbnails.resolve',
+            side_effect=lambda page: time.sleep(0.05)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stacks(self):
+        result = {}
+        for name in os.listdir(self.directory):
+            with open(os.path.join(self.directory, name)) as source:
+                for line in source:
+                    stack, count = line.rsplit(' ', 1)
+                    result[stack] = result.get(stack, 0) + int(count)
+        return result
+
+    def test_signed_header(self):
+        """Запрос с подписанным X-Profile пишет стеки view в файл."""
+        response = self.client.get(
+            '/', HTTP_X_PROFILE=profiling.make_token()
+        )
+        self.assertEqual(
+            os.listdir(self.directory), [response['X-Profile-File']]
+        )
+        stacks = self.stacks()
+        self.assertTrue(stacks)
+        self.assertTrue(any(
+            'posts.views:index' in stack.split(';') for stack in stacks
+        ))
+        for stack in stacks:
+            frames = stack.split(';')
+            self.assertEqual(frames[0], 'index')
+            self.assertFalse(any(
+                frame.startswith(('unittest', 'yatube.profiling'))
+                for frame in frames
+            ))
+
+    def test_bad_header(self):
+        """Неподписанный или просроченный X-Profile игнорируется."""
+        self.client.get('/', HTTP_X_PROFILE='profile')
+        with mock.patch('time.time', return_value=time.time() - 7200):
+            token = profiling.make_token()
+        response = self.client.get('/', HTTP_X_PROFILE=token)
+        self.assertNotIn('X-Profile-File', response)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_rate(self):
+        """profile_requests --rate включает и выключает профилирование."""
+        self.client.get('/')
+        self.assertEqual(os.listdir(self.directory), [])
+        call_command('profile_requests', rate=1, stdout=mock.Mock())
+        response = self.client.get('/')
+        self.assertNotIn('X-Profile-File', response)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        call_command('profile_requests', rate=0, stdout=mock.Mock())
+        self.client.get('/')
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+    def test_collapse(self):
+        """В стек попадают только кадры проекта, шаблонов и ORM."""
+        from django.template import Context, Template
+
+        class Probe:
+            def __str__(self):
+                self.stack = profiling.collapse(sys._getframe())
+                return ''
+
+        probe = Probe()
+        Template('{{ probe }}').render(Context({'probe': probe}))
+        frames = probe.stack.split(';')
+        self.assertIn('django.template.base:Template.render', frames)
+        self.assertEqual(frames[-1], 'yatube.tests:Probe.__str__')
+        self.assertFalse(any(
+            frame.startswith(('unittest', 'django.test'))
+            for frame in frames
+        ))
+
+
+def _child_set(cache):
+    cache.set('child', 'parent:' + cache.get('parent'))
@@ -5,7 +5,10 @@ from django.contrib import admin
 from django.contrib.flatpages import views
 from django.urls import include, path
 
+from .metrics import metrics_view
+
 urlpatterns = [
+    path('metrics/', metrics_view, name='metrics'),
     path('auth/', include('users.urls')),
     path('auth/', include('django.contrib.auth.urls')),
     path('about/', include('django.contrib.flatpages.urls')),